@@ -35,8 +35,13 @@ DEBUG = True
 ALLOWED_HOSTS = ['app', *os.environ.get("VIRTUAL_HOST", "").split(",")]
 
 CORS_ALLOW_HEADERS = list(corsheaders.defaults.default_headers) + [
-    "X-CSRF-TOKEN"
+    "X-CSRF-TOKEN",
+    "If-None-Match",
+    "If-Range",
+    "Range",
 ]
+# Headers describing downloads of data, which browsers only show to the frontend if listed here
+CORS_EXPOSE_HEADERS = ["ETag", "Accept-Ranges", "Content-Range", "Content-Disposition", "X-Galv-Dtype"]
 CORS_ALLOWED_ORIGINS = os.environ.get("FRONTEND_VIRTUAL_HOST", "").split(",")
 CORS_ALLOW_CREDENTIALS = True
 CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
@@ -63,6 +68,7 @@ MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'galv.middleware.RequestDecompressionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -137,6 +143,32 @@ USE_I18N = True
 USE_TZ = True
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 100000000
+# Limit for request bodies once decompressed (see galv.middleware)
+DATA_UPLOAD_MAX_DECOMPRESSED_SIZE = 1000000000
+
+# How uploaded timeseries data are stored (see galv.storage):
+# 'chunks' stores each upload as a separate row,
+# 'array' appends each upload to a single array per column,
+# 'blobs' stores numeric uploads as compressed binary blobs (see galv.blobs)
+TIMESERIES_STORAGE = os.environ.get('DJANGO_TIMESERIES_STORAGE', 'chunks')
+# Maximum number of values in each blob, and how blobs are compressed ('zstd', or 'lz4' if installed)
+TIMESERIES_BLOB_LENGTH = int(os.environ.get('DJANGO_TIMESERIES_BLOB_LENGTH', 65536))
+TIMESERIES_BLOB_COMPRESSION = os.environ.get('DJANGO_TIMESERIES_BLOB_COMPRESSION', 'zstd')
+
+# Whether reports carrying data are queued and stored by `manage.py ingest_worker` (see galv.ingest),
+# rather than stored while the Harvester waits; set to FALSE, NO, 0 or '' to store them while it waits
+QUEUE_HARVESTER_UPLOADS = os.environ.get('DJANGO_QUEUE_HARVESTER_UPLOADS', 'TRUE').upper() not in \
+    ('F', 'FALSE', 'N', 'NO', '0', '')
+
+# Exports of imported Datasets are kept here, and reused until their File is reimported (see galv.export);
+# set to '' to build every export on request
+EXPORT_ROOT = os.environ.get('DJANGO_EXPORT_ROOT', '/exports/')
+# Most bytes that kept exports may take up, after which the ingest worker deletes the oldest; set to 0 for no limit
+EXPORT_MAX_SIZE = int(os.environ.get('DJANGO_EXPORT_MAX_SIZE', 10 * 1024 ** 3))
+# Internal URL under which the proxy serves EXPORT_ROOT, so that kept exports are sent using X-Accel-Redirect.
+# Only set this where every request comes through that proxy (as in docker-compose.yml);
+# by default kept exports are sent from Django
+EXPORT_ACCEL_REDIRECT_URL = os.environ.get('DJANGO_EXPORT_ACCEL_REDIRECT_URL', '')
 
 
 # Static files (CSS, JavaScript, Images)
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Encoding Column values as compressed binary blobs (see TimeseriesBlob).
+
+A blob's encoding lists the steps applied to its values, in order, e.g. 'delta,zstd':
+    delta: monotonic values are replaced by the differences between successive values,
+        taken between their bit patterns as 64-bit integers so that floats are stored exactly
+    zstd, lz4: the resulting bytes are compressed
+"""
+
+import numpy as np
+import zstandard
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# Types in which the values of each kind of Column are stored
+BLOB_DTYPES = {
+    'float': '<f8',
+    'int': '<i8',
+}
+
+COMPRESSORS = {
+    'zstd': (lambda b: zstandard.ZstdCompressor().compress(b), lambda b: zstandard.ZstdDecompressor().decompress(b)),
+}
+if lz4 is not None:
+    COMPRESSORS['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+
+class UnsupportedBlobEncodingError(ValueError):
+    pass
+
+
+def to_blob_array(values: list | np.ndarray, data_type: str) -> np.ndarray | None:
+    """
+    Convert values to the type they are stored in, or return None if they cannot be stored as a blob.
+
+    Values that include None (NULL) are not stored as blobs.
+    """
+    dtype = BLOB_DTYPES.get(data_type)
+    if dtype is None:
+        return None
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind not in ('biuf' if data_type == 'float' else 'biu'):
+            return None
+        if values.dtype.kind == 'u' and len(values) and values.max() > np.iinfo(np.int64).max:
+            return None
+        return values.astype(dtype)
+    if any(v is None for v in values):
+        return None
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def is_monotonic(values: np.ndarray) -> bool:
+    if len(values) < 2:
+        return False
+    steps = np.diff(values)
+    return bool(np.all(steps >= 0) or np.all(steps <= 0))
+
+
+def encode_blob(values: np.ndarray, compression: str = 'zstd') -> tuple[str, bytes]:
+    """
+    Encode values, returning the encoding and the encoded bytes.
+    """
+    if compression not in COMPRESSORS:
+        raise UnsupportedBlobEncodingError(f"Unsupported blob compression '{compression}'")
+    encoding = []
+    if is_monotonic(values):
+        # Differences wrap around on overflow, and are undone exactly by a cumulative sum
+        values = np.diff(values.view('<i8'), prepend=np.int64(0))
+        encoding.append('delta')
+    encoding.append(compression)
+    return ','.join(encoding), COMPRESSORS[compression][0](values.tobytes())
+
+
+def decode_blob(data: bytes, dtype: str, encoding: str) -> np.ndarray:
+    """
+    Decode the values of a blob
+    """
+    *steps, compression = encoding.split(',')
+    if compression not in COMPRESSORS or any(s != 'delta' for s in steps):
+        raise UnsupportedBlobEncodingError(f"Unsupported blob encoding '{encoding}'")
+    raw = COMPRESSORS[compression][1](bytes(data))
+    if 'delta' in steps:
+        return np.cumsum(np.frombuffer(raw, dtype='<i8'), dtype='<i8').view(dtype)
+    return np.frombuffer(raw, dtype=dtype)
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Conditional and partial responses for data that are identified by their version.
+
+Responses carry a strong ETag derived from the version of the data they hold and the request parameters,
+so that clients can revalidate (If-None-Match) and resume (Range, If-Range) downloads.
+Only single byte ranges are supported; requests for several ranges are sent the whole response.
+"""
+
+import hashlib
+import re
+from typing import Iterable, Iterator
+
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+# Bytes read at a time when sending part of a file
+FILE_BLOCK_SIZE = 1024 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    """
+    Raised when a requested byte range lies outside the content
+    """
+    pass
+
+
+def make_etag(*parts) -> str:
+    """
+    Return a strong ETag for a response that is fully determined by parts
+    """
+    return quote_etag(hashlib.sha256(repr(parts).encode('utf-8')).hexdigest())
+
+
+def not_modified(request: HttpRequest, etag: str) -> HttpResponse | None:
+    """
+    Return a 304 (or 412) response if the request's preconditions mean the content should not be sent
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+    return response
+
+
+def get_range(request: HttpRequest, etag: str, length: int) -> tuple[int, int] | None:
+    """
+    Return the first and last byte of the range requested from content of the given length,
+    or None if the whole content should be sent.
+
+    Raises RangeNotSatisfiable if the range lies outside the content.
+    """
+    header = request.META.get('HTTP_RANGE')
+    if header is None:
+        return None
+    if 'HTTP_IF_RANGE' in request.META and request.META['HTTP_IF_RANGE'] != etag:
+        # The client's partial copy is out of date
+        return None
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', header.strip())
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        if int(last) == 0 or length == 0:
+            raise RangeNotSatisfiable()
+        return max(length - int(last), 0), length - 1
+    first, last = int(first), length - 1 if last == '' else min(int(last), length - 1)
+    if first >= length:
+        raise RangeNotSatisfiable()
+    if last < first:
+        return None
+    return first, last
+
+
+def range_not_satisfiable_response(length: int) -> HttpResponse:
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f"bytes */{length}"
+    return response
+
+
+def set_content_range(response: HttpResponse, first: int, last: int, length: int):
+    response.status_code = 206
+    response['Content-Range'] = f"bytes {first}-{last}/{length}"
+    response['Content-Length'] = last - first + 1
+
+
+def slice_stream(chunks: Iterable[bytes], skip: int, take: int) -> Iterator[bytes]:
+    """
+    Yield `take` bytes of a stream of chunks, after skipping the first `skip` bytes
+    """
+    for chunk in chunks:
+        if take <= 0:
+            return
+        if skip >= len(chunk):
+            skip -= len(chunk)
+            continue
+        chunk = chunk[skip:skip + take]
+        skip = 0
+        take -= len(chunk)
+        yield chunk
+
+
+def iter_file_range(path: str, first: int, last: int) -> Iterator[bytes]:
+    """
+    Yield bytes first to last of a file
+    """
+    with open(path, 'rb') as file:
+        file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = file.read(min(FILE_BLOCK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,127 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Reducing a Column's values to a few points for charting, while keeping its peaks and troughs.
+
+Points are selected by one of the DECIMATION_METHODS, optionally keyed on the values of another Column (x).
+When keyed on the sample number, points are selected from the extremes in the Column's downsample pyramid
+(see galv.pyramid) where it has one, rather than from every value.
+Selections are not cached: clients revalidate them with the ETag of the Columns' data instead.
+"""
+
+import numpy as np
+
+from .models import DataColumn
+from .pyramid import get_extremes
+from .storage import iter_values, get_values_version
+
+
+def _bucket_extremes(buckets: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Return the positions of the smallest and largest y in each bucket, in order of position
+    """
+    if not len(y):
+        return np.array([], dtype=np.int64)
+    # Sorting by bucket, then y, puts each bucket's minimum first and its maximum last
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    firsts = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    lasts = np.r_[firsts[1:] - 1, len(order) - 1]
+    return np.unique(np.concatenate([order[firsts], order[lasts]]))
+
+
+def minmax(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Divide x into points/2 equal ranges, and select the lowest and highest y in each.
+    """
+    n_buckets = max(points // 2, 1)
+    low, span = (x.min(), x.max() - x.min()) if len(x) else (0, 0)
+    if not np.isfinite(span) or span == 0:
+        buckets = np.zeros(len(x), dtype=np.int64)
+    else:
+        buckets = np.clip(((x - low) * (n_buckets / span)).astype(np.int64), 0, n_buckets - 1)
+    return _bucket_extremes(buckets, y)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Select points using Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+
+    Each bucket's point is the one making the largest triangle with the previously selected point
+    and the mean of the next bucket.
+    """
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:max(points, 1)])
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        mean_x, mean_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        areas = np.abs((x[a] - mean_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+DECIMATION_METHODS = {
+    'minmax': minmax,
+    'lttb': lttb,
+}
+MAX_DECIMATION_POINTS = 100000
+# Rows of a pyramid level needed for each point selected from it
+PYRAMID_ROWS_PER_POINT = 2
+
+
+def load_values(column: DataColumn, start: int, stop: int) -> np.ndarray:
+    """
+    Load values[start:stop] of a numeric Column as floats, with missing values as NaN
+    """
+    blocks = [np.asarray(v, dtype=np.float64) for v in iter_values(column, start, stop)]
+    return np.concatenate(blocks) if blocks else np.array([], dtype=np.float64)
+
+
+def decimate(x: np.ndarray, y: np.ndarray, points: int, method: str) -> np.ndarray:
+    """
+    Return the positions of about `points` pairs of x and y that preserve the shape of y against x.
+
+    Pairs where either value is missing are left out.
+    """
+    valid = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(valid) <= points:
+        return valid
+    return valid[DECIMATION_METHODS[method](x[valid], y[valid], points)]
+
+
+def decimate_column(
+        column: DataColumn,
+        x_column: DataColumn | None,
+        start: int,
+        stop: int,
+        points: int,
+        method: str
+) -> np.ndarray:
+    """
+    Return about `points` rows of (x, value) summarising values[start:stop] of a Column,
+    where x is the value of x_column, or the sample number if x_column is None.
+    """
+    extremes = None
+    if x_column is None:
+        extremes = get_extremes(column, start, stop, points * PYRAMID_ROWS_PER_POINT, get_values_version(column))
+    if extremes is not None:
+        positions, y = extremes
+        x = positions.astype(np.float64)
+    else:
+        y = load_values(column, start, stop)
+        x = load_values(x_column, start, stop) if x_column else np.arange(start, start + len(y), dtype=np.float64)
+        n = min(len(x), len(y))
+        x, y = x[:n], y[:n]
+    selected = decimate(x, y, points, method)
+    return np.column_stack([x[selected], y[selected]])
@@ -0,0 +1,204 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Exporting a Dataset's Columns as a single table, with a row for each sample.
+
+The table is built as a sequence of Arrow record batches, reading every Column in step,
+so that only one batch of each Column's values is held in memory at a time.
+
+Exports of all the Columns of imported Datasets are also written to files under settings.EXPORT_ROOT
+as they are sent. Each file is named by a hash of the Columns and versions of their data that it holds,
+so later downloads of the same data can be served from the file, by the proxy where there is one.
+Each Dataset keeps one file for each format, and the ingest worker deletes the oldest files once they take up
+more than settings.EXPORT_MAX_SIZE bytes. A Dataset's files are deleted when its File is reimported.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from typing import Iterator
+import numpy as np
+import pyarrow as pa
+from django.conf import settings
+
+from .models import DataColumn, Dataset, ObservedFile
+from .storage import iter_values, get_values_version
+
+logger = logging.getLogger(__name__)
+
+# Arrow types in which the values of each kind of Column are exported
+EXPORT_TYPES = {
+    'float': pa.float64(),
+    'int': pa.int64(),
+    'str': pa.string(),
+}
+# Number of rows in each record batch
+EXPORT_BATCH_LENGTH = 65536
+
+
+def get_export_schema(columns: list[DataColumn]) -> pa.Schema:
+    return pa.schema([pa.field(c.name, EXPORT_TYPES.get(c.data_type, pa.string())) for c in columns])
+
+
+class _ColumnReader:
+    """
+    Read a Column's values a given number at a time, from the blocks in which they are stored
+    """
+    def __init__(self, column: DataColumn, arrow_type: pa.DataType, start: int, stop: int):
+        self.blocks = iter_values(column, start, stop)
+        self.arrow_type = arrow_type
+        self.pending = None
+
+    def read(self, n: int) -> pa.Array:
+        """
+        Return the next n values, padded with nulls once the Column's values run out
+        """
+        arrays = []
+        while n > 0:
+            if self.pending is None:
+                values = next(self.blocks, None)
+                if values is None:
+                    arrays.append(pa.nulls(n, self.arrow_type))
+                    break
+                self.pending = values if isinstance(values, np.ndarray) else pa.array(values, type=self.arrow_type)
+            taken, rest = self.pending[:n], self.pending[n:]
+            self.pending = rest if len(rest) else None
+            arrays.append(pa.array(taken, type=self.arrow_type) if isinstance(taken, np.ndarray) else taken)
+            n -= len(taken)
+        return pa.concat_arrays(arrays) if len(arrays) != 1 else arrays[0]
+
+
+def iter_export_batches(
+        columns: list[DataColumn],
+        start: int,
+        stop: int,
+        batch_length: int = EXPORT_BATCH_LENGTH
+) -> Iterator[pa.RecordBatch]:
+    """
+    Yield the values of Columns for samples start to stop as record batches of get_export_schema(columns),
+    with nulls where a Column has fewer values.
+    """
+    schema = get_export_schema(columns)
+    readers = [_ColumnReader(c, field.type, start, stop) for c, field in zip(columns, schema)]
+    for batch_start in range(start, stop, batch_length):
+        n = min(batch_length, stop - batch_start)
+        yield pa.record_batch([reader.read(n) for reader in readers], schema=schema)
+
+
+def get_export_version(columns: list[DataColumn]) -> str:
+    """
+    Return a string that changes whenever the Columns, or their values, change
+    """
+    key = hashlib.sha256()
+    for column in columns:
+        key.update(f"{column.id}:{column.name}:{column.data_type}:{get_values_version(column)};".encode('utf-8'))
+    return key.hexdigest()
+
+
+def get_export_path(dataset: Dataset, version: str, format: str) -> str | None:
+    """
+    Return the path, relative to settings.EXPORT_ROOT, of the file holding the export of a Dataset's Columns
+    at a version given by get_export_version(), or None if exports are not kept.
+    """
+    if not settings.EXPORT_ROOT:
+        return None
+    return os.path.join(str(dataset.id), f"{version}.{format}")
+
+
+def export_exists(path: str) -> bool:
+    return os.path.exists(os.path.join(settings.EXPORT_ROOT, path))
+
+
+def write_export(path: str, content: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Yield content, writing it to the file at path (relative to settings.EXPORT_ROOT).
+
+    The file only appears once all the content has been written, so partial exports are never served.
+    """
+    full_path = os.path.join(settings.EXPORT_ROOT, path)
+    temp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file = open(temp_path, 'wb')
+    except OSError as e:
+        logger.error(f"Cannot write export {full_path}: {e}")
+        yield from content
+        return
+    try:
+        with file:
+            for data in content:
+                file.write(data)
+                yield data
+        os.replace(temp_path, full_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    delete_superseded_exports(path)
+
+
+def delete_superseded_exports(path: str):
+    """
+    Delete the other exports in the same format of the Dataset whose export is at path
+    (relative to settings.EXPORT_ROOT).
+
+    Files that are being sent when they are deleted are still sent in full.
+    """
+    directory, name = os.path.split(os.path.join(settings.EXPORT_ROOT, path))
+    extension = os.path.splitext(name)[1]
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for export_name in names:
+        if export_name != name and export_name.endswith(extension):
+            try:
+                os.remove(os.path.join(directory, export_name))
+            except FileNotFoundError:
+                # Deleted by another request
+                pass
+
+
+def prune_exports():
+    """
+    Delete the oldest exports until they take up no more than settings.EXPORT_MAX_SIZE bytes.
+
+    This reads the size of every kept export, so it is run from time to time by the ingest worker
+    rather than each time an export is written.
+    """
+    max_size = getattr(settings, 'EXPORT_MAX_SIZE', 0)
+    if not settings.EXPORT_ROOT or not max_size:
+        return
+    exports = []
+    for dir_path, _, names in os.walk(settings.EXPORT_ROOT):
+        for export_name in names:
+            if export_name.endswith('.tmp'):
+                continue
+            export_path = os.path.join(dir_path, export_name)
+            try:
+                stat = os.stat(export_path)
+            except FileNotFoundError:
+                continue
+            exports.append((stat.st_mtime, stat.st_size, export_path))
+    size = sum(export_size for _, export_size, _ in exports)
+    for _, export_size, export_path in sorted(exports):
+        if size <= max_size:
+            break
+        try:
+            os.remove(export_path)
+        except FileNotFoundError:
+            pass
+        size -= export_size
+
+
+def delete_file_exports(file: ObservedFile):
+    """
+    Delete the exports of a File's Datasets
+    """
+    if not settings.EXPORT_ROOT:
+        return
+    for dataset_id in Dataset.objects.filter(file=file).values_list('id', flat=True):
+        shutil.rmtree(os.path.join(settings.EXPORT_ROOT, str(dataset_id)), ignore_errors=True)
@@ -0,0 +1,256 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Storing the data that Harvesters upload while importing a file.
+
+Reports carrying data may be applied as soon as they arrive, or queued as IngestJobs
+and applied in order by a worker (`manage.py ingest_worker`), so that web workers are not
+held up by the database writes.
+"""
+
+import io
+import json
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import HarvestError, \
+    ObservedFile, \
+    FileState, \
+    Dataset, \
+    DataUnit, \
+    DataColumnType, \
+    DataColumn, \
+    UploadSession, \
+    IngestJob, \
+    IngestJobState, \
+    UnsupportedTimeseriesDataTypeError, \
+    get_timeseries_chunk_handler_by_type
+from .middleware import decompress_body
+from .parsers import ColumnReportParser
+from .pyramid import build_file_pyramids
+from .storage import append_values_bulk
+
+logger = logging.getLogger(__name__)
+
+# Media types of reports that can be queued
+QUEUEABLE_MEDIA_TYPES = ['application/json', ColumnReportParser.media_type]
+# Media type of the jobs, queued once a File is imported, that build its downsample pyramids
+BUILD_PYRAMIDS_MEDIA_TYPE = 'application/x-galv-build-pyramids'
+
+
+class IngestError(ValueError):
+    """
+    Raised when a report's data cannot be stored because the report is invalid.
+    """
+    pass
+
+
+def deserialize_datetime(serialized_value: str | float) -> timezone.datetime:
+    if isinstance(serialized_value, str):
+        return timezone.make_aware(timezone.datetime.fromisoformat(serialized_value))
+    if isinstance(serialized_value, float):
+        return timezone.make_aware(timezone.datetime.fromtimestamp(serialized_value))
+    raise TypeError
+
+
+def get_or_create_column(dataset: Dataset, column_data: dict) -> DataColumn:
+    """
+    Return the Column in a Dataset described by a harvester report, creating it if necessary.
+
+    Columns are described by the id of their Column Type, or by their name and unit.
+    """
+    data_type = column_data.get('data_type')
+    try:
+        column_type = DataColumnType.objects.get(id=column_data['column_id'])
+        column, _ = DataColumn.objects.get_or_create(
+            name=column_type.name,
+            data_type=data_type,
+            type=column_type,
+            dataset=dataset,
+            official_sample_counter=column_data.get('official_sample_counter', False)
+        )
+    except KeyError:
+        if 'unit_id' in column_data:
+            unit = DataUnit.objects.get(id=column_data['unit_id'])
+        else:
+            unit, _ = DataUnit.objects.get_or_create(symbol=column_data['unit_symbol'])
+        try:
+            column_type = DataColumnType.objects.get(unit=unit)
+        except DataColumnType.DoesNotExist:
+            column_type = DataColumnType.objects.create(
+                name=column_data['column_name'],
+                unit=unit
+            )
+        column, _ = DataColumn.objects.get_or_create(
+            name=column_data['column_name'],
+            data_type=data_type,
+            type=column_type,
+            dataset=dataset,
+            official_sample_counter=column_data.get('official_sample_counter', False)
+        )
+    return column
+
+
+def check_column_data_type(column: DataColumn):
+    try:
+        get_timeseries_chunk_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        raise IngestError(f'Unsupported variable type {column.data_type} in column {column.name}')
+
+
+def store_import_data(file: ObservedFile, content: dict):
+    """
+    Store the data carried by an 'in_progress' import report
+    """
+    time_start = time.time()
+    if content.get('upload_session') is not None:
+        # Columns were resolved when the upload began, so can be referred to by id
+        try:
+            upload_session = UploadSession.objects.select_related('dataset').get(id=content['upload_session'], file=file)
+        except UploadSession.DoesNotExist:
+            raise IngestError("UploadSession does not exist")
+        dataset = upload_session.dataset
+        columns_by_id = DataColumn.objects.filter(dataset=dataset).in_bulk([
+            c['column'] for c in content['data'] if 'column' in c
+        ])
+    else:
+        date = deserialize_datetime(content['test_date'])
+        dataset = Dataset.objects.get(file=file, date=date)
+        columns_by_id = {}
+    uploads = []
+    for column_data in content['data']:
+        if 'column' in column_data:
+            column = columns_by_id.get(column_data['column'])
+            if column is None:
+                raise IngestError(f"Column {column_data['column']} is not part of this upload")
+        else:
+            column = get_or_create_column(dataset, column_data)
+            check_column_data_type(column)
+        uploads.append((column, column_data["values"]))
+    try:
+        # insert values for all columns at once
+        append_values_bulk(uploads)
+    except Exception as e:
+        raise IngestError(f"Error saving data. {type(e)}: {e.args[0]}")
+    logger.info(f"Stored {len(uploads)} columns for {file} (in {round(time.time() - time_start, 2)}s)")
+
+
+def complete_import(file: ObservedFile):
+    """
+    Mark an importing File as imported, and queue building its downsample pyramids.
+
+    Building pyramids reads every value, so it is left to the ingest worker.
+    """
+    if file.state == FileState.IMPORTING:
+        file.state = FileState.IMPORTED
+        file.save()
+        IngestJob.objects.create(file=file, media_type=BUILD_PYRAMIDS_MEDIA_TYPE)
+
+
+def queue_report(file: ObservedFile, media_type: str, body: bytes, content_encoding: str = None) -> IngestJob:
+    """
+    Queue a report as received, so that a compressed body is only decompressed when it is applied
+    """
+    return IngestJob.objects.create(file=file, media_type=media_type, body=body, content_encoding=content_encoding)
+
+
+def get_queued_reports(file: ObservedFile):
+    return IngestJob.objects.filter(file=file).exclude(media_type=BUILD_PYRAMIDS_MEDIA_TYPE)
+
+
+def has_queued_reports(file: ObservedFile) -> bool:
+    return get_queued_reports(file).filter(state=IngestJobState.PENDING).exists()
+
+
+def get_import_progress(file: ObservedFile) -> dict:
+    """
+    Count a File's queued reports by state
+    """
+    progress = {state.lower(): 0 for state in IngestJobState.values}
+    counts = get_queued_reports(file).order_by().values_list('state').annotate(n=Count('id'))
+    for state, n in counts:
+        progress[state.lower()] = n
+    return progress
+
+
+def parse_report(job: IngestJob) -> dict:
+    body = bytes(job.body)
+    if job.content_encoding is not None:
+        body = decompress_body(job.content_encoding, body)
+    if job.media_type == ColumnReportParser.media_type:
+        return ColumnReportParser().parse(io.BytesIO(body))
+    return json.loads(body)
+
+
+def apply_ingest_job(job: IngestJob):
+    content = parse_report(job)['content']
+    if content['status'] == 'in_progress':
+        store_import_data(job.file, content)
+    elif content['status'] == 'complete':
+        complete_import(job.file)
+    else:
+        raise IngestError(f"Cannot queue import reports with status {content['status']}")
+    return content['status']
+
+
+def process_next_ingest_job() -> bool:
+    """
+    Apply the oldest queued report whose File is not already being worked on.
+
+    Reports for each File are applied one at a time, in the order they arrived.
+    Once a File is imported, its downsample pyramids are built after its reports.
+    Returns False if there was no job to do.
+    """
+    with transaction.atomic():
+        job = IngestJob.objects\
+            .select_related('file', 'file__harvester')\
+            .select_for_update(skip_locked=True, of=('self', 'file'))\
+            .filter(state=IngestJobState.PENDING)\
+            .order_by('id')\
+            .first()
+        if job is None:
+            return False
+        if job.media_type != BUILD_PYRAMIDS_MEDIA_TYPE:
+            apply_queued_report(job)
+            return True
+        # The job is claimed by deleting it, so that the pyramids are built without holding any locks.
+        # Pyramids only make reading faster; any left unbuilt can be built with `manage.py build_pyramids`.
+        job.delete()
+    build_file_pyramids(job.file)
+    return True
+
+
+def apply_queued_report(job: IngestJob):
+    """
+    Apply a queued report whose IngestJob and File are locked, recording whether it failed
+    """
+    try:
+        with transaction.atomic():
+            status = apply_ingest_job(job)
+    except Exception as e:
+        logger.error(f"Failed to apply {job}: {e}")
+        job.state = IngestJobState.FAILED
+        job.error = str(e)
+        job.file.state = FileState.IMPORT_FAILED
+        job.file.save()
+        HarvestError.objects.create(harvester=job.file.harvester, file=job.file, error=str(e))
+        # Later reports for the File cannot be applied without this one
+        IngestJob.objects.filter(file=job.file, state=IngestJobState.PENDING).exclude(id=job.id).update(
+            state=IngestJobState.FAILED,
+            error=f"Not applied because report {job.id} failed",
+            body=None
+        )
+    else:
+        if status == 'complete':
+            # The File is imported, so the reports that made it up are no longer needed
+            get_queued_reports(job.file).filter(id__lte=job.id).delete()
+            return
+        job.state = IngestJobState.DONE
+    job.body = None
+    job.save()
@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+from django.core.management.base import BaseCommand
+
+from galv.models import ObservedFile, FileState
+from galv.pyramid import build_file_pyramids
+
+
+class Command(BaseCommand):
+    help = """
+    Build the downsample pyramids of imported Files' numeric Columns.
+    Pyramids are built as Files are imported, so this is only needed for Files imported before that.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('file_ids', nargs='*', type=int, help="Files to build pyramids for (default: all imported)")
+
+    def handle(self, *args, **options):
+        files = ObservedFile.objects.filter(state=FileState.IMPORTED)
+        if options['file_ids']:
+            files = files.filter(id__in=options['file_ids'])
+        for file in files:
+            build_file_pyramids(file)
+            self.stdout.write(f"Built pyramids for {file}")
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,43 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+import time
+
+from galv.export import prune_exports
+from galv.ingest import process_next_ingest_job
+
+
+class Command(BaseCommand):
+    help = """
+    Store the data from queued Harvester reports.
+    Several workers can run at once: each File's reports are applied in order by one worker at a time.
+    Workers also delete the oldest kept exports once they take up more than settings.EXPORT_MAX_SIZE bytes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument(
+            '--sleep', type=float, default=1.0,
+            help="Seconds to wait before checking an empty queue again"
+        )
+        parser.add_argument(
+            '--prune-interval', type=float, default=300.0,
+            help="Seconds between checks of the size of kept exports"
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Ingest worker started.'))
+        last_pruned = None
+        while True:
+            close_old_connections()
+            if last_pruned is None or time.monotonic() - last_pruned >= options['prune_interval']:
+                prune_exports()
+                last_pruned = time.monotonic()
+            if process_next_ingest_job():
+                continue
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import io
+import zlib
+import zstandard
+from django.conf import settings
+from django.http import JsonResponse
+
+
+def decompress_gzip(body: bytes, max_size: int) -> bytes:
+    return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS).decompress(body, max_size + 1)
+
+
+def decompress_zstd(body: bytes, max_size: int) -> bytes:
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+        return reader.read(max_size + 1)
+
+
+# Supported Content-Encodings, in order of preference
+DECOMPRESSORS = {
+    'zstd': decompress_zstd,
+    'gzip': decompress_gzip,
+}
+
+
+def decompress_body(encoding: str, body: bytes) -> bytes:
+    """
+    Decompress a body sent with a supported Content-Encoding.
+
+    Raises ValueError if the decompressed body exceeds DATA_UPLOAD_MAX_DECOMPRESSED_SIZE.
+    """
+    max_size = getattr(settings, 'DATA_UPLOAD_MAX_DECOMPRESSED_SIZE', settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+    body = DECOMPRESSORS[encoding](body, max_size)
+    if len(body) > max_size:
+        raise ValueError(f"Decompressed request body exceeds {max_size} bytes")
+    return body
+
+
+class RequestDecompressionMiddleware:
+    """
+    Decompress request bodies sent with a Content-Encoding header,
+    so that parsers and views see the original body.
+
+    DATA_UPLOAD_MAX_MEMORY_SIZE applies to the compressed body,
+    and the decompressed body may be at most DATA_UPLOAD_MAX_DECOMPRESSED_SIZE.
+    The body as sent is kept as request.encoded_body, a (Content-Encoding, body) tuple,
+    so that views can store it without its decompressed copy.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            decompress = DECOMPRESSORS.get(encoding)
+            if decompress is None:
+                return JsonResponse({'error': f"Unsupported Content-Encoding '{encoding}'"}, status=415)
+            try:
+                body = decompress_body(encoding, request.body)
+            except (zlib.error, zstandard.ZstdError) as e:
+                return JsonResponse({'error': f"Could not decompress request body: {e}"}, status=400)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=413)
+            request.encoded_body = (encoding, request.body)
+            request._body = body
+            request._stream = io.BytesIO(body)
+            request.META['CONTENT_LENGTH'] = str(len(body))
+            del request.META['HTTP_CONTENT_ENCODING']
+        return self.get_response(request)
@@ -274,6 +274,70 @@ class Dataset(models.Model):
         unique_together = [['file', 'date']]
 
 
+class UploadSession(models.Model):
+    file = models.ForeignKey(
+        to=ObservedFile,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        help_text="File being imported"
+    )
+    dataset = models.ForeignKey(
+        to=Dataset,
+        on_delete=models.CASCADE,
+        help_text="Dataset receiving the imported data"
+    )
+    created = models.DateTimeField(auto_now_add=True, help_text="Date and time the import began")
+
+    def __str__(self):
+        return f"{self.file} [UploadSession {self.id}]"
+
+
+class IngestJobState(models.TextChoices):
+    PENDING = "PENDING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+
+
+class IngestJob(models.Model):
+    file = models.ForeignKey(
+        to=ObservedFile,
+        on_delete=models.CASCADE,
+        related_name='ingest_jobs',
+        help_text="File whose import the report is part of"
+    )
+    media_type = models.TextField(
+        null=False,
+        help_text="Media type of the report, or application/x-galv-build-pyramids for building "
+                  "the File's downsample pyramids once it is imported"
+    )
+    body = models.BinaryField(null=True, help_text="Report as received from the Harvester; cleared once applied")
+    content_encoding = models.TextField(
+        null=True,
+        help_text="Content-Encoding the body was received with, e.g. 'zstd', if it was compressed"
+    )
+    state = models.TextField(
+        choices=IngestJobState.choices,
+        default=IngestJobState.PENDING,
+        null=False,
+        help_text="Whether the report has been applied"
+    )
+    error = models.TextField(null=True, help_text="Reason the report could not be applied")
+    created = models.DateTimeField(auto_now_add=True, help_text="Date and time the report was received")
+
+    def __str__(self):
+        return f"{self.file} [IngestJob {self.id}: {self.state}]"
+
+    class Meta:
+        indexes = [
+            # The ingest worker looks for the oldest pending report
+            models.Index(
+                fields=['id'],
+                name='galv_ingestjob_pending',
+                condition=models.Q(state=IngestJobState.PENDING)
+            )
+        ]
+
+
 class Equipment(models.Model):
     name = models.TextField(
         null=False,
@@ -404,6 +468,116 @@ class UnsupportedTimeseriesDataTypeError(TypeError):
     pass
 
 
+# Each upload of data for a Column is stored as a separate chunk,
+# so that appending data never reads or rewrites the data already stored.
+
+def _timeseries_chunk_column_field():
+    return models.ForeignKey(
+        to=DataColumn,
+        on_delete=models.CASCADE,
+        help_text="Column whose data are listed"
+    )
+
+
+def _timeseries_chunk_seq_field():
+    return models.PositiveIntegerField(null=False, help_text="Position of this chunk in the Column's data")
+
+
+def _timeseries_chunk_start_sample_field():
+    return models.PositiveBigIntegerField(
+        null=False,
+        help_text="Position of the first value in this chunk in the Column's data"
+    )
+
+
+def _timeseries_chunk_str(self):
+    return f"{self.column_id}[{self.seq}]: {self.start_sample}+{len(self.values or [])}"
+
+
+class TimeseriesChunkFloat(models.Model):
+    column = _timeseries_chunk_column_field()
+    seq = _timeseries_chunk_seq_field()
+    start_sample = _timeseries_chunk_start_sample_field()
+    values = ArrayField(models.FloatField(null=True), help_text="Row values (floats) for Column")
+    __str__ = _timeseries_chunk_str
+    __repr__ = _timeseries_repr
+
+    class Meta:
+        unique_together = [['column', 'seq']]
+
+
+class TimeseriesChunkInt(models.Model):
+    column = _timeseries_chunk_column_field()
+    seq = _timeseries_chunk_seq_field()
+    start_sample = _timeseries_chunk_start_sample_field()
+    values = ArrayField(models.BigIntegerField(null=True), help_text="Row values (integers) for Column")
+    __str__ = _timeseries_chunk_str
+    __repr__ = _timeseries_repr
+
+    class Meta:
+        unique_together = [['column', 'seq']]
+
+
+class TimeseriesChunkStr(models.Model):
+    column = _timeseries_chunk_column_field()
+    seq = _timeseries_chunk_seq_field()
+    start_sample = _timeseries_chunk_start_sample_field()
+    values = ArrayField(models.TextField(null=True), help_text="Row values (str) for Column")
+    __str__ = _timeseries_chunk_str
+    __repr__ = _timeseries_repr
+
+    class Meta:
+        unique_together = [['column', 'seq']]
+
+
+class TimeseriesBlob(models.Model):
+    """
+    A chunk of a numeric Column's values, stored as a compressed binary buffer (see galv.blobs).
+
+    The index of sample ranges means that reading part of a Column only decodes the blobs it overlaps.
+    """
+    column = _timeseries_chunk_column_field()
+    seq = _timeseries_chunk_seq_field()
+    start_sample = _timeseries_chunk_start_sample_field()
+    length = models.PositiveIntegerField(null=False, help_text="Number of values in this chunk")
+    dtype = models.TextField(null=False, help_text="NumPy type of the values, e.g. '<f8'")
+    encoding = models.TextField(null=False, help_text="Steps used to encode the values, e.g. 'delta,zstd'")
+    data = models.BinaryField(null=False, help_text="Encoded values")
+    __repr__ = _timeseries_repr
+
+    def __str__(self):
+        return f"{self.column_id}[{self.seq}]: {self.start_sample}+{self.length} ({self.encoding})"
+
+    class Meta:
+        unique_together = [['column', 'seq']]
+
+
+class TimeseriesSummary(models.Model):
+    """
+    One level of a numeric Column's downsample pyramid (see galv.pyramid),
+    summarising each `factor` consecutive values by their minimum, maximum, and mean.
+
+    Summaries are built when a File has been imported, and only used while the Column's data are unchanged.
+    """
+    column = models.ForeignKey(
+        to=DataColumn,
+        on_delete=models.CASCADE,
+        related_name='summaries',
+        help_text="Column whose data are summarised"
+    )
+    factor = models.PositiveIntegerField(null=False, help_text="Number of values summarised by each row")
+    length = models.PositiveBigIntegerField(null=False, help_text="Number of values summarised")
+    version = models.TextField(null=False, help_text="Version of the Column's data that were summarised")
+    encoding = models.TextField(null=False, help_text="Compression applied to the summary rows, e.g. 'zstd'")
+    data = models.BinaryField(null=False, help_text="Encoded summary rows")
+
+    def __str__(self):
+        return f"{self.column_id}/{self.factor}: {self.length} values ({self.version})"
+
+    class Meta:
+        unique_together = [['column', 'factor']]
+
+
 def get_timeseries_handler_by_type(data_type: str) -> Type[TimeseriesDataFloat | TimeseriesDataStr | TimeseriesDataInt]:
     """
     Returns the appropriate TimeseriesData model for the given data type.
@@ -417,6 +591,19 @@ def get_timeseries_handler_by_type(data_type: str) -> Type[TimeseriesDataFloat |
     raise UnsupportedTimeseriesDataTypeError
 
 
+def get_timeseries_chunk_handler_by_type(data_type: str) -> Type[TimeseriesChunkFloat | TimeseriesChunkStr | TimeseriesChunkInt]:
+    """
+    Returns the appropriate TimeseriesChunk model for the given data type.
+    """
+    if data_type == "float":
+        return TimeseriesChunkFloat
+    if data_type == "str":
+        return TimeseriesChunkStr
+    if data_type == "int":
+        return TimeseriesChunkInt
+    raise UnsupportedTimeseriesDataTypeError
+
+
 class TimeseriesRangeLabel(models.Model):
     dataset = models.ForeignKey(
         to=Dataset,
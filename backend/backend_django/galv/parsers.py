@@ -0,0 +1,60 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import json
+import struct
+import numpy as np
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class ColumnReportParser(BaseParser):
+    """
+    Parse harvester reports whose columns of data are sent as binary buffers.
+
+    A report is made up of
+        MAGIC
+        the length of the header in bytes, as a little-endian uint32
+        the header: the report as UTF-8 JSON, in which the values of each numeric
+            column in content['data'] are replaced by 'values_dtype' and 'values_length'
+        the values of each of those columns in turn, as little-endian bytes
+
+    The values of numeric columns are decoded into NumPy arrays.
+    """
+    media_type = 'application/x-galv-columns'
+    MAGIC = b'GALVCOL1'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        body = stream.read()
+        if not body.startswith(self.MAGIC):
+            raise ParseError('Binary report does not start with the expected header')
+        offset = len(self.MAGIC)
+        try:
+            header_length, = struct.unpack_from('<I', body, offset)
+            offset += 4
+            data = json.loads(body[offset:offset + header_length].decode('utf-8'))
+        except (struct.error, ValueError) as e:
+            raise ParseError(f'Binary report header is malformed: {e}')
+        offset += header_length
+
+        content = data.get('content') if isinstance(data, dict) else None
+        columns = content.get('data') if isinstance(content, dict) else None
+        for column in columns or []:
+            if 'values_dtype' not in column:
+                continue
+            try:
+                dtype = np.dtype(column.pop('values_dtype'))
+                length = int(column.pop('values_length'))
+            except (TypeError, ValueError, KeyError) as e:
+                raise ParseError(f'Binary report column description is malformed: {e}')
+            if dtype.kind not in 'iuf' or dtype.byteorder == '>' or length < 0:
+                raise ParseError(f'Unsupported binary report column type {dtype.str}')
+            end = offset + length * dtype.itemsize
+            if end > len(body):
+                raise ParseError('Binary report is shorter than its header describes')
+            column['values'] = np.frombuffer(body, dtype=dtype, count=length, offset=offset)
+            offset = end
+        if offset != len(body):
+            raise ParseError('Binary report is longer than its header describes')
+        return data
@@ -0,0 +1,189 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Downsample pyramids of numeric Columns, so that zoomed-out charts need not read every value.
+
+Each level of a pyramid is a TimeseriesSummary with a row for every `factor` values, holding
+their minimum, maximum, and mean, the number of values that are not missing,
+and the positions of the minimum and maximum.
+Pyramids are built by the ingest worker once a File has been imported, and are deleted with the Column's values.
+"""
+
+import logging
+import numpy as np
+
+from .blobs import COMPRESSORS
+from .models import DataColumn, ObservedFile, TimeseriesSummary
+from .storage import iter_values, get_values_version, count_values
+
+logger = logging.getLogger(__name__)
+
+# Each factor must divide the next
+PYRAMID_FACTORS = [16, 256, 4096]
+SUMMARY_COMPRESSION = 'zstd'
+SUMMARY_DTYPE = np.dtype([
+    ('min', '<f8'),
+    ('max', '<f8'),
+    ('mean', '<f8'),
+    ('count', '<i8'),
+    ('argmin', '<i8'),
+    ('argmax', '<i8'),
+])
+EMPTY_SUMMARY = np.array((np.nan, np.nan, np.nan, 0, -1, -1), dtype=SUMMARY_DTYPE)
+# Number of values summarised at a time while building a pyramid
+BUILD_BLOCK_LENGTH = PYRAMID_FACTORS[-1] * 64
+
+
+def _reduce(groups: np.ndarray) -> np.ndarray:
+    """
+    Combine each row of a 2D array of summaries into one
+    """
+    summary = np.empty(len(groups), dtype=SUMMARY_DTYPE)
+    valid = groups['count'] > 0
+    low = np.where(valid, groups['min'], np.inf).argmin(axis=1)
+    high = np.where(valid, groups['max'], -np.inf).argmax(axis=1)
+    index = np.arange(len(groups))
+    summary['min'] = groups['min'][index, low]
+    summary['max'] = groups['max'][index, high]
+    summary['argmin'] = groups['argmin'][index, low]
+    summary['argmax'] = groups['argmax'][index, high]
+    summary['count'] = groups['count'].sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['mean'] = np.where(valid, groups['mean'] * groups['count'], 0).sum(axis=1) / summary['count']
+    summary[summary['count'] == 0] = EMPTY_SUMMARY
+    return summary
+
+
+def summarise(values: np.ndarray, offset: int, factor: int) -> np.ndarray:
+    """
+    Summarise each `factor` values, where the first value is sample `offset`.
+    The last row summarises any remaining values.
+    """
+    n = -(-len(values) // factor)
+    padded = np.full(n * factor, np.nan)
+    padded[:len(values)] = values
+    # Each value is the summary of itself
+    leaves = np.empty(n * factor, dtype=SUMMARY_DTYPE)
+    leaves['min'] = leaves['max'] = leaves['mean'] = padded
+    leaves['count'] = np.isfinite(padded)
+    leaves['argmin'] = leaves['argmax'] = offset + np.arange(n * factor)
+    return _reduce(leaves.reshape(n, factor))
+
+
+def coarsen(summary: np.ndarray, ratio: int) -> np.ndarray:
+    """
+    Combine each `ratio` rows of a summary
+    """
+    n = -(-len(summary) // ratio)
+    padded = np.full(n * ratio, EMPTY_SUMMARY)
+    padded[:len(summary)] = summary
+    return _reduce(padded.reshape(n, ratio))
+
+
+def _summarise_levels(values: np.ndarray, offset: int) -> list[np.ndarray]:
+    levels = [summarise(values, offset, PYRAMID_FACTORS[0])]
+    for factor, next_factor in zip(PYRAMID_FACTORS, PYRAMID_FACTORS[1:]):
+        levels.append(coarsen(levels[-1], next_factor // factor))
+    return levels
+
+
+def build_pyramid(column: DataColumn):
+    """
+    Build (or rebuild) the downsample pyramid of a numeric Column.
+
+    Values are read a block at a time, so building a pyramid needs little memory however long the Column is.
+    """
+    TimeseriesSummary.objects.filter(column=column).delete()
+    version = get_values_version(column)
+    length = count_values(column)
+    levels = [[] for _ in PYRAMID_FACTORS]
+    blocks = []
+    buffered = 0
+    summarised = 0
+
+    def flush(n: int):
+        nonlocal blocks, buffered, summarised
+        values = np.concatenate(blocks)
+        for level, summary in zip(levels, _summarise_levels(values[:n], summarised)):
+            level.append(summary)
+        blocks = [values[n:]]
+        buffered -= n
+        summarised += n
+
+    for values in iter_values(column, 0, length):
+        blocks.append(np.asarray(values, dtype=np.float64))
+        buffered += len(blocks[-1])
+        if buffered >= BUILD_BLOCK_LENGTH:
+            # Summarise whole rows of the coarsest level, so that rows never span blocks
+            flush(buffered - buffered % PYRAMID_FACTORS[-1])
+    if buffered:
+        flush(buffered)
+    compress = COMPRESSORS[SUMMARY_COMPRESSION][0]
+    TimeseriesSummary.objects.bulk_create([
+        TimeseriesSummary(
+            column=column,
+            factor=factor,
+            length=summarised,
+            version=version,
+            encoding=SUMMARY_COMPRESSION,
+            data=compress(np.concatenate(level).tobytes() if level else b'')
+        ) for factor, level in zip(PYRAMID_FACTORS, levels)
+    ])
+
+
+def build_file_pyramids(file: ObservedFile):
+    """
+    Build the downsample pyramids of the numeric Columns in a File's Datasets.
+
+    Pyramids only make reading faster, so failing to build one is logged rather than raised.
+    """
+    for column in DataColumn.objects.filter(dataset__file=file, data_type__in=['float', 'int']):
+        try:
+            build_pyramid(column)
+        except Exception as e:
+            logger.error(f"Failed to build downsample pyramid for {column}: {e}")
+
+
+def decode_summary(summary: TimeseriesSummary) -> np.ndarray:
+    return np.frombuffer(COMPRESSORS[summary.encoding][1](bytes(summary.data)), dtype=SUMMARY_DTYPE)
+
+
+def get_extremes(
+        column: DataColumn,
+        start: int,
+        stop: int,
+        min_rows: int,
+        version: str
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Return the positions and values of the smallest and largest value in each row of the coarsest
+    level of a Column's pyramid with at least `min_rows` rows within values[start:stop],
+    together with every value in the part-rows at either end.
+    Missing values are left out.
+
+    Returns None if the Column has no such level summarising the given version of its data.
+    """
+    factors = [f for f in PYRAMID_FACTORS if (stop - start) // f >= min_rows]
+    summary = TimeseriesSummary.objects\
+        .filter(column=column, version=version, factor__in=factors, length__gte=stop)\
+        .order_by('-factor')\
+        .first()
+    if summary is None:
+        return None
+    factor = summary.factor
+    first, last = -(-start // factor), stop // factor
+    rows = decode_summary(summary)[first:last]
+    rows = rows[rows['count'] > 0]
+    positions = [rows['argmin'], rows['argmax']]
+    values = [rows['min'], rows['max']]
+    for edge_start, edge_stop in [(start, first * factor), (last * factor, stop)]:
+        for block in iter_values(column, edge_start, edge_stop):
+            block = np.asarray(block, dtype=np.float64)
+            valid = np.flatnonzero(np.isfinite(block))
+            values.append(block[valid])
+            positions.append(valid + edge_start)
+            edge_start += len(block)
+    positions, unique = np.unique(np.concatenate(positions), return_index=True)
+    return positions, np.concatenate(values)[unique]
@@ -0,0 +1,289 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import io
+from typing import Iterable, Iterator
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv
+import pyarrow.parquet
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+# Types in which the values of numeric Columns are sent
+COLUMN_DTYPES = {
+    'float': np.dtype('<f8'),
+    'int': np.dtype('<i8'),
+}
+# Integer values cannot be missing, so missing values are sent as this instead
+MISSING_INT = np.iinfo(np.int64).min
+
+
+def get_column_dtype(data_type: str) -> np.dtype | None:
+    return COLUMN_DTYPES.get(data_type)
+
+
+def to_array(values: list | np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """
+    Convert a block of Column values to an array of dtype.
+    Missing floats become NaN, and missing integers become MISSING_INT.
+    """
+    if isinstance(values, np.ndarray):
+        return values.astype(dtype, copy=False)
+    if dtype.kind == 'i' and None in values:
+        values = [MISSING_INT if v is None else v for v in values]
+    return np.array(values, dtype=dtype)
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    Base class for formats whose content is streamed by the view.
+    Other responses, such as errors, are rendered as JSON.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = JSONRenderer.media_type
+        return JSONRenderer().render(data)
+
+
+class StreamSink(io.RawIOBase):
+    """
+    A file that holds what is written to it until it is drained,
+    while reporting its position as if everything written were still there.
+    """
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class ColumnValuesRenderer(StreamingRenderer):
+    """
+    Base class for the formats in which a Column's values can be sent, using stream().
+    """
+    binary = True
+
+    def get_layout(self, dtype: np.dtype, length: int, names: list[str]) -> tuple[bytes, int] | None:
+        """
+        Return the header of the response body and the number of bytes in each row that follows it,
+        for formats where every row has the same size, or None for other formats
+        """
+        return None
+
+    def get_content_length(self, dtype: np.dtype, length: int, names: list[str]) -> int | None:
+        """
+        Return the length of the response body, if it is known in advance
+        """
+        layout = self.get_layout(dtype, length, names)
+        if layout is None:
+            return None
+        header, row_size = layout
+        return len(header) + length * row_size
+
+    def stream(self, blocks: Iterable, dtype: np.dtype | None, length: int, names: list[str]) -> Iterator[bytes]:
+        """
+        Yield the response body for length rows arriving in blocks.
+
+        Each row has a value for each of the named columns:
+        blocks hold a single column's values, or, for several columns, are 2D arrays with a column for each.
+        dtype is None for Columns that are not numeric.
+        """
+        raise NotImplementedError
+
+
+class ColumnValuesTextRenderer(ColumnValuesRenderer):
+    """
+    Rows separated by newlines, with the values in each row separated by tabs
+    """
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+    binary = False
+
+    def stream(self, blocks, dtype, length, names):
+        for values in blocks:
+            if len(values):
+                if isinstance(values, np.ndarray):
+                    values = values.tolist()
+                if len(names) > 1:
+                    values = ['\t'.join(map(str, row)) for row in values]
+                yield ('\n'.join(map(str, values)) + '\n').encode('utf-8')
+
+
+class ColumnValuesBinaryRenderer(ColumnValuesRenderer):
+    """
+    Values as a raw little-endian buffer, of the type given in the X-Galv-Dtype header.
+    Rows of several columns are sent one after another.
+    """
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+
+    def get_layout(self, dtype, length, names):
+        return b'', len(names) * dtype.itemsize
+
+    def stream(self, blocks, dtype, length, names):
+        for values in blocks:
+            yield to_array(values, dtype).tobytes()
+
+
+class ColumnValuesNpyRenderer(ColumnValuesRenderer):
+    """
+    Values as a NumPy .npy file, with a column for each of several columns
+    """
+    media_type = 'application/x-npy'
+    format = 'npy'
+    charset = None
+
+    def get_header(self, dtype: np.dtype, length: int, names: list[str]) -> bytes:
+        header = io.BytesIO()
+        shape = (length, len(names)) if len(names) > 1 else (length,)
+        np.lib.format.write_array_header_1_0(header, {'descr': dtype.str, 'fortran_order': False, 'shape': shape})
+        return header.getvalue()
+
+    def get_layout(self, dtype, length, names):
+        return self.get_header(dtype, length, names), len(names) * dtype.itemsize
+
+    def stream(self, blocks, dtype, length, names):
+        yield self.get_header(dtype, length, names)
+        for values in blocks:
+            yield to_array(values, dtype).tobytes()
+
+
+class ColumnValuesArrowRenderer(ColumnValuesRenderer):
+    """
+    Values as an Apache Arrow IPC stream, with a field for each column.
+    Missing values are sent as nulls.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+
+    def stream(self, blocks, dtype, length, names):
+        schema = pa.schema([pa.field(name, pa.from_numpy_dtype(dtype)) for name in names])
+        sink = StreamSink()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            yield sink.drain()
+            for values in blocks:
+                if not len(values):
+                    continue
+                if isinstance(values, np.ndarray):
+                    values = values.astype(dtype, copy=False)
+                    arrays = [pa.array(values[:, i]) for i in range(len(names))] if values.ndim > 1 else \
+                        [pa.array(values)]
+                else:
+                    arrays = [pa.array(values, type=schema.field(0).type)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+
+COLUMN_VALUES_RENDERERS = [
+    ColumnValuesTextRenderer,
+    ColumnValuesBinaryRenderer,
+    ColumnValuesNpyRenderer,
+    ColumnValuesArrowRenderer,
+]
+
+
+class DatasetExportRenderer(StreamingRenderer):
+    """
+    Base class for the formats in which a Dataset can be exported, using stream()
+    """
+    charset = None
+
+    def stream(self, batches: Iterable[pa.RecordBatch], schema: pa.Schema) -> Iterator[bytes]:
+        raise NotImplementedError
+
+
+class DatasetParquetRenderer(DatasetExportRenderer):
+    """
+    An Apache Parquet file, with a row group for each batch
+    """
+    media_type = 'application/vnd.apache.parquet'
+    format = 'parquet'
+
+    def stream(self, batches, schema):
+        sink = StreamSink()
+        with pa.parquet.ParquetWriter(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+
+class DatasetArrowRenderer(DatasetExportRenderer):
+    """
+    An Apache Arrow IPC stream
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+
+    def stream(self, batches, schema):
+        sink = StreamSink()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            yield sink.drain()
+            for batch in batches:
+                writer.write_batch(batch)
+                yield sink.drain()
+        yield sink.drain()
+
+
+class DatasetCSVRenderer(DatasetExportRenderer):
+    """
+    Comma-separated values, with a header row of Column names. Missing values are left empty.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def stream(self, batches, schema):
+        sink = StreamSink()
+        with pa.csv.CSVWriter(sink, schema) as writer:
+            for batch in batches:
+                writer.write_batch(batch)
+                yield sink.drain()
+            if not sink.tell():
+                # The header is only written with the first batch
+                writer.write_table(schema.empty_table())
+        yield sink.drain()
+
+
+DATASET_EXPORT_RENDERERS = [
+    DatasetParquetRenderer,
+    DatasetArrowRenderer,
+    DatasetCSVRenderer,
+]
+
+
+class StreamingContentNegotiation(DefaultContentNegotiation):
+    """
+    Use the first of the available formats for clients that accept none of them,
+    unless they asked for a format by name.
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            if format_suffix or request.query_params.get(self.settings.URL_FORMAT_OVERRIDE):
+                raise
+            return renderers[0], renderers[0].media_type
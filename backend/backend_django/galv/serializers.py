@@ -26,6 +26,10 @@ from .models import Harvester, \
     TimeseriesRangeLabel, \
     KnoxAuthToken
 from .utils import get_monitored_paths
+from .parsers import ColumnReportParser
+from .middleware import DECOMPRESSORS
+from .storage import get_last_value
+from .ingest import get_import_progress
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
 from django.conf.global_settings import DATA_UPLOAD_MAX_MEMORY_SIZE
@@ -345,6 +349,14 @@ class ObservedFileSerializer(serializers.HyperlinkedModelSerializer):
     upload_info = serializers.SerializerMethodField(
         help_text="Metadata required for harvester program to resume file parsing"
     )
+    import_progress = serializers.SerializerMethodField(
+        help_text="Numbers of the File's queued import reports that are pending, done, or failed"
+    )
+
+    def get_import_progress(self, instance) -> dict | None:
+        if not self.context.get('with_import_progress'):
+            return None
+        return get_import_progress(instance)
 
     def get_upload_info(self, instance) -> dict | None:
         if not self.context.get('with_upload_info'):
@@ -356,11 +368,20 @@ class ObservedFileSerializer(serializers.HyperlinkedModelSerializer):
             for c in columns:
                 column_data.append({'name': c.name, 'id': c.id})
                 if c.official_sample_counter:
-                    last_record = c.values[:-1] if len(c.values) > 0 else 0
-            return {
+                    last_record = get_last_value(c) or 0
+            upload_info = {
                 'columns': column_data,
                 'last_record_number': last_record
             }
+            if self.context.get('upload_session') is not None:
+                upload_info['upload_session'] = {
+                    'id': self.context['upload_session'].id,
+                    'columns': [
+                        {'id': c.id, 'name': c.name, 'data_type': c.data_type}
+                        for c in self.context.get('upload_session_columns', [])
+                    ]
+                }
+            return upload_info
         except BaseException as e:
             return {'columns': [], 'last_record_number': None, 'error': str(e)}
 
@@ -369,7 +390,7 @@ class ObservedFileSerializer(serializers.HyperlinkedModelSerializer):
         fields = [
             'url', 'id', 'harvester', 'path',
             'state', 'last_observed_time', 'last_observed_size', 'errors',
-            'datasets', 'upload_info'
+            'datasets', 'upload_info', 'import_progress'
         ]
         read_only_fields = [
             'url', 'id', 'harvester', 'path',
@@ -588,6 +609,10 @@ class HarvesterConfigSerializer(HarvesterSerializer):
     standard_units = serializers.SerializerMethodField(help_text="Units recognised by the initial database")
     standard_columns = serializers.SerializerMethodField(help_text="Column Types recognised by the initial database")
     max_upload_bytes = serializers.SerializerMethodField(help_text="Maximum upload size (bytes)")
+    upload_media_types = serializers.SerializerMethodField(help_text="Media types accepted for reports")
+    upload_content_encodings = serializers.SerializerMethodField(
+        help_text="Content-Encodings accepted for reports, in order of preference"
+    )
     deleted_environment_variables = serializers.SerializerMethodField(help_text="Envvars to unset")
     monitored_paths = MonitoredPathSerializer(many=True, read_only=True, help_text="Directories to harvest")
 
@@ -610,6 +635,12 @@ class HarvesterConfigSerializer(HarvesterSerializer):
     def get_max_upload_bytes(self, instance):
         return DATA_UPLOAD_MAX_MEMORY_SIZE
 
+    def get_upload_media_types(self, instance) -> list[str]:
+        return ['application/json', ColumnReportParser.media_type]
+
+    def get_upload_content_encodings(self, instance) -> list[str]:
+        return list(DECOMPRESSORS.keys())
+
     def get_deleted_environment_variables(self, instance):
         return [v.key for v in instance.environment_variables.all() if v.deleted]
 
@@ -617,7 +648,7 @@ class HarvesterConfigSerializer(HarvesterSerializer):
         model = Harvester
         fields = [
             'url', 'id', 'api_key', 'name', 'sleep_time', 'monitored_paths',
-            'standard_units', 'standard_columns', 'max_upload_bytes',
+            'standard_units', 'standard_columns', 'max_upload_bytes', 'upload_media_types', 'upload_content_encodings',
             'environment_variables', 'deleted_environment_variables'
         ]
         read_only_fields = fields
@@ -0,0 +1,487 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Reading and writing the values of DataColumns.
+
+How values are appended depends on settings.TIMESERIES_STORAGE:
+    'chunks': each upload becomes a new TimeseriesChunk row
+    'array': each upload is concatenated onto the Column's TimeseriesData array in the database,
+        unless the Column already has chunks or blobs, when it becomes a new TimeseriesChunk row
+    'blobs': each upload of numeric values becomes one or more compressed TimeseriesBlob rows,
+        and other uploads become TimeseriesChunk rows
+A Column's values are read from its TimeseriesData array, if any, followed by its chunks and blobs
+in order of their positions, so values written with any setting can always be read.
+"""
+
+import heapq
+import io
+import struct
+from typing import Iterator
+import numpy as np
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast, Coalesce
+
+from .models import DataColumn, \
+    ObservedFile, \
+    TimeseriesDataFloat, \
+    TimeseriesDataInt, \
+    TimeseriesDataStr, \
+    TimeseriesChunkFloat, \
+    TimeseriesChunkInt, \
+    TimeseriesChunkStr, \
+    TimeseriesBlob, \
+    TimeseriesSummary, \
+    UnsupportedTimeseriesDataTypeError, \
+    get_timeseries_handler_by_type, \
+    get_timeseries_chunk_handler_by_type
+from .blobs import to_blob_array, encode_blob, decode_blob
+
+
+def _cardinality():
+    return models.Func(models.F('values'), function='cardinality', output_field=models.IntegerField())
+
+
+def _last_element(handler):
+    return models.Func(
+        models.F('values'),
+        template='(%(expressions)s)[cardinality(%(expressions)s)]',
+        output_field=handler._meta.get_field('values').base_field
+    )
+
+
+def _count_array_values(column: DataColumn) -> int:
+    handler = get_timeseries_handler_by_type(column.data_type)
+    return handler.objects.filter(column=column).annotate(length=_cardinality())\
+        .values_list('length', flat=True).first() or 0
+
+
+class ArraySlice(models.Func):
+    """
+    Slice an array in the database, with Python's conventions for start and stop
+    """
+    template = '(%(expressions)s)[%(start)s:%(stop)s]'
+
+    def __init__(self, expression, start: int = 0, stop: int = None, **extra):
+        super().__init__(
+            expression,
+            start=int(start) + 1,
+            stop='' if stop is None else int(stop),
+            **extra
+        )
+
+
+def _get_array_values(column: DataColumn, start: int = 0, stop: int = None):
+    try:
+        handler = get_timeseries_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return None
+    timeseries = handler.objects.filter(column=column)
+    if start > 0 or stop is not None:
+        field = handler._meta.get_field('values')
+        timeseries = timeseries.annotate(window=ArraySlice('values', start, stop, output_field=field))
+        return timeseries.values_list('window', flat=True).first()
+    return timeseries.values_list('values', flat=True).first()
+
+
+def format_array(values: list | np.ndarray, data_type: str) -> str:
+    """
+    Format values as a Postgres array literal, e.g. '{1.5,NULL,2.5}'.
+
+    Values are converted much faster this way than by adapting each one as a query parameter.
+    """
+    if isinstance(values, np.ndarray):
+        if values.dtype.kind == 'f' and data_type == 'float':
+            # repr gives the shortest string that reads back as the same float
+            return '{' + ','.join(map(repr, values.tolist())) + '}'
+        if values.dtype.kind in 'iu' and data_type in ['int', 'float']:
+            return '{' + ','.join(map(str, values.tolist())) + '}'
+    if isinstance(values, np.ndarray):
+        values = values.tolist()
+    if data_type == 'str':
+        def format_value(v):
+            if v is None:
+                return 'NULL'
+            return '"' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+    elif data_type == 'float':
+        def format_value(v):
+            return 'NULL' if v is None else repr(float(v))
+    else:
+        def format_value(v):
+            return 'NULL' if v is None else str(int(v))
+    return '{' + ','.join(map(format_value, values)) + '}'
+
+
+def _copy_escape(text: str) -> str:
+    """
+    Escape text for use as a field in COPY's text format
+    """
+    return text.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+
+
+def append_values(column: DataColumn, values: list | np.ndarray):
+    """
+    Append values to a Column's data.
+    """
+    append_values_bulk([(column, values)])
+
+
+def append_values_bulk(uploads: list[tuple[DataColumn, list | np.ndarray]]):
+    """
+    Append values to the data of several Columns at once.
+
+    Concurrent appends to the same Column are applied one after another.
+    """
+    with transaction.atomic():
+        # Lock the Columns so that concurrent appends cannot overwrite one another.
+        # Locks are taken in a consistent order so that concurrent appends cannot deadlock.
+        list(DataColumn.objects.select_for_update().filter(id__in=[c.id for c, _ in uploads]).order_by('id'))
+        storage = getattr(settings, 'TIMESERIES_STORAGE', 'chunks')
+        if storage == 'array':
+            # Values can only follow chunks or blobs in another chunk, or they would be read out of order
+            chunked = _get_chunked_column_ids([c for c, _ in uploads])
+            for column, values in uploads:
+                if column.id not in chunked:
+                    _append_array_values(column, values)
+            chunk_uploads = [(c, v) for c, v in uploads if c.id in chunked]
+            if chunk_uploads:
+                _append_chunks(chunk_uploads)
+        elif storage == 'blobs':
+            _append_blobs(uploads)
+        else:
+            _append_chunks(uploads)
+
+
+def _get_chunked_column_ids(columns: list[DataColumn]) -> set[int]:
+    """
+    Return the ids of the Columns that have any chunks or blobs
+    """
+    column_ids = [c.id for c in columns]
+    by_model = {TimeseriesBlob: column_ids}
+    for column in columns:
+        by_model.setdefault(get_timeseries_chunk_handler_by_type(column.data_type), []).append(column.id)
+    return {
+        column_id
+        for model, ids in by_model.items()
+        for column_id in model.objects.filter(column_id__in=ids).values_list('column_id', flat=True).distinct()
+    }
+
+
+def _append_array_values(column: DataColumn, values: list | np.ndarray):
+    """
+    Concatenate values onto the Column's TimeseriesData array without reading the stored values
+    """
+    handler = get_timeseries_handler_by_type(column.data_type)
+    field = handler._meta.get_field('values')
+    timeseries, _ = handler.objects.get_or_create(column=column)
+    handler.objects.filter(id=timeseries.id).update(values=models.Func(
+        models.F('values'),
+        Cast(models.Value(format_array(values, column.data_type)), output_field=field),
+        function='array_cat',
+        output_field=field
+    ))
+
+
+# Postgres element type OIDs and big-endian NumPy types for binary array values
+BINARY_ARRAY_TYPES = {
+    'float': (701, '>f8'),
+    'int': (20, '>i8'),
+}
+
+# Big-endian NumPy types for binary integer fields
+BINARY_FIELD_TYPES = {
+    'integer': '>i4',
+    'bigint': '>i8',
+}
+
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_BINARY_TRAILER = struct.pack('>h', -1)
+
+
+def format_binary_array(values: list | np.ndarray, data_type: str) -> bytes | None:
+    """
+    Format values as a Postgres binary array, or return None if they cannot be stored that way
+    """
+    if data_type not in BINARY_ARRAY_TYPES:
+        return None
+    oid, dtype = BINARY_ARRAY_TYPES[data_type]
+    values = np.asarray(values)
+    if values.dtype.kind not in ('biuf' if data_type == 'float' else 'biu'):
+        return None
+    if len(values) == 0:
+        return struct.pack('>iii', 0, 0, oid)
+    if data_type == 'int' and (int(values.min()) < np.iinfo(dtype).min or int(values.max()) > np.iinfo(dtype).max):
+        return None
+    # Each element is its length in bytes followed by its value
+    elements = np.empty(len(values), dtype=[('length', '>i4'), ('value', dtype)])
+    elements['length'] = np.dtype(dtype).itemsize
+    elements['value'] = values
+    return struct.pack('>iiiii', 1, 0, oid, len(values), 1) + elements.tobytes()
+
+
+def _get_positions(model, column_ids: list[int]) -> dict[int, tuple[int, int]]:
+    """
+    Find the seq of the next chunk in model, and the position after the last value in model,
+    for each of the Columns that have chunks in model.
+    """
+    length = models.F('length') if model is TimeseriesBlob else _cardinality()
+    last_chunks = model.objects.filter(column_id__in=column_ids)\
+        .annotate(n=length)\
+        .order_by('column_id', '-seq')\
+        .distinct('column_id')\
+        .values('column_id', 'seq', 'start_sample', 'n')
+    return {c['column_id']: (c['seq'] + 1, c['start_sample'] + (c['n'] or 0)) for c in last_chunks}
+
+
+def _get_append_positions(model, columns: list[DataColumn]) -> dict[int, tuple[int, int]]:
+    """
+    Find the seq and start_sample of the next chunk in model for each Column,
+    so that it follows all the values already stored for the Column.
+    """
+    column_ids = [c.id for c in columns]
+    by_model = {TimeseriesBlob: column_ids}
+    for column in columns:
+        by_model.setdefault(get_timeseries_chunk_handler_by_type(column.data_type), []).append(column.id)
+    seqs = {}
+    ends = {}
+    for chunk_model, ids in by_model.items():
+        for column_id, (seq, end) in _get_positions(chunk_model, ids).items():
+            if chunk_model is model:
+                seqs[column_id] = seq
+            ends[column_id] = max(end, ends.get(column_id, 0))
+    return {
+        c.id: (seqs.get(c.id, 0), ends[c.id] if c.id in ends else _count_array_values(c))
+        for c in columns
+    }
+
+
+def _append_blobs(uploads: list[tuple[DataColumn, list | np.ndarray]]):
+    """
+    Write numeric uploads as compressed blobs of at most settings.TIMESERIES_BLOB_LENGTH values,
+    and other uploads as chunks.
+    """
+    max_length = getattr(settings, 'TIMESERIES_BLOB_LENGTH', 65536)
+    compression = getattr(settings, 'TIMESERIES_BLOB_COMPRESSION', 'zstd')
+    blob_uploads = []
+    chunk_uploads = []
+    for column, values in uploads:
+        array = to_blob_array(values, column.data_type)
+        if array is None:
+            chunk_uploads.append((column, values))
+        else:
+            blob_uploads.append((column, array))
+    positions = _get_append_positions(TimeseriesBlob, [c for c, _ in blob_uploads])
+    blobs = []
+    for column, array in blob_uploads:
+        seq, start_sample = positions[column.id]
+        for offset in range(0, len(array), max_length):
+            values = array[offset:offset + max_length]
+            encoding, data = encode_blob(values, compression)
+            blobs.append(TimeseriesBlob(
+                column=column,
+                seq=seq,
+                start_sample=start_sample + offset,
+                length=len(values),
+                dtype=values.dtype.str,
+                encoding=encoding,
+                data=data
+            ))
+            seq += 1
+        positions[column.id] = (seq, start_sample + len(array))
+    TimeseriesBlob.objects.bulk_create(blobs)
+    if chunk_uploads:
+        _append_chunks(chunk_uploads)
+
+
+def _append_chunks(uploads: list[tuple[DataColumn, list | np.ndarray]]):
+    """
+    Write each upload as a new chunk, using COPY to send all the chunks for each table at once.
+
+    Numeric values are sent in COPY's binary format where possible, and otherwise as text.
+    """
+    by_handler = {}
+    for column, values in uploads:
+        by_handler.setdefault(get_timeseries_chunk_handler_by_type(column.data_type), []).append((column, values))
+    for handler, handler_uploads in by_handler.items():
+        positions = _get_append_positions(handler, [c for c, _ in handler_uploads])
+        rows = []
+        for column, values in handler_uploads:
+            seq, start_sample = positions[column.id]
+            rows.append((column.id, seq, start_sample, values, column.data_type))
+            positions[column.id] = (seq + 1, start_sample + len(values))
+
+        binary_values = [format_binary_array(values, data_type) for *_, values, data_type in rows]
+        if all(v is not None for v in binary_values):
+            field_types = [
+                BINARY_FIELD_TYPES[handler._meta.get_field('column').rel_db_type(connection)],
+                BINARY_FIELD_TYPES[handler._meta.get_field('seq').db_type(connection)],
+                BINARY_FIELD_TYPES[handler._meta.get_field('start_sample').db_type(connection)],
+            ]
+            data = io.BytesIO()
+            data.write(COPY_BINARY_HEADER)
+            for (column_id, seq, start_sample, *_), array in zip(rows, binary_values):
+                data.write(struct.pack('>h', 4))
+                for field_type, value in zip(field_types, [column_id, seq, start_sample]):
+                    data.write(struct.pack('>i', np.dtype(field_type).itemsize))
+                    data.write(np.array(value, dtype=field_type).tobytes())
+                data.write(struct.pack('>i', len(array)))
+                data.write(array)
+            data.write(COPY_BINARY_TRAILER)
+            copy_format = ' WITH (FORMAT binary)'
+        else:
+            data = io.StringIO()
+            for column_id, seq, start_sample, values, data_type in rows:
+                data.write(f"{column_id}\t{seq}\t{start_sample}\t{_copy_escape(format_array(values, data_type))}\n")
+            copy_format = ''
+        data.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {connection.ops.quote_name(handler._meta.db_table)} '
+                f'(column_id, seq, start_sample, "values") FROM STDIN{copy_format}',
+                data
+            )
+
+
+def has_values(column: DataColumn) -> bool:
+    try:
+        chunk_handler = get_timeseries_chunk_handler_by_type(column.data_type)
+        handler = get_timeseries_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return False
+    return chunk_handler.objects.filter(column=column).exists() or \
+        TimeseriesBlob.objects.filter(column=column).exists() or \
+        handler.objects.filter(column=column).exists()
+
+
+def _iter_chunks(column: DataColumn, start: int, stop: int | None) -> Iterator[tuple[int, list]]:
+    handler = get_timeseries_chunk_handler_by_type(column.data_type)
+    chunks = handler.objects.filter(column=column)
+    if start > 0:
+        # Begin with the chunk that contains start, found without reading the values of any chunk
+        first = handler.objects.filter(column=column, start_sample__lte=start).order_by('-seq')
+        chunks = chunks.filter(start_sample__gte=Coalesce(models.Subquery(first.values('start_sample')[:1]), 0))
+    if stop is not None:
+        chunks = chunks.filter(start_sample__lt=stop)
+    yield from chunks.order_by('seq').values_list('start_sample', 'values').iterator(chunk_size=16)
+
+
+def _iter_blobs(column: DataColumn, start: int, stop: int | None) -> Iterator[tuple[int, np.ndarray]]:
+    blobs = TimeseriesBlob.objects.filter(column=column)
+    if start > 0:
+        blobs = blobs.annotate(end=models.F('start_sample') + models.F('length')).filter(end__gt=start)
+    if stop is not None:
+        blobs = blobs.filter(start_sample__lt=stop)
+    blobs = blobs.order_by('seq').values_list('start_sample', 'data', 'dtype', 'encoding')
+    for start_sample, data, dtype, encoding in blobs.iterator(chunk_size=16):
+        yield start_sample, decode_blob(data, dtype, encoding)
+
+
+def iter_values(column: DataColumn, start: int = 0, stop: int = None, step: int = 1) -> Iterator[list | np.ndarray]:
+    """
+    Yield a Column's values in order, in blocks, without loading all of them at once.
+
+    If start, stop or step are given, only values[start:stop:step] are yielded,
+    and only the parts of the stored data that overlap that range are read.
+    """
+    def window(values, position: int):
+        # Take every step-th value, counting from start, from a block beginning at position
+        return values[(start - position) % step::step] if step > 1 else values
+
+    array_values = _get_array_values(column, start, stop)
+    if array_values:
+        yield window(array_values, start)
+    try:
+        get_timeseries_chunk_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return
+    # A Column's values may be split between chunks and blobs if the storage setting changed
+    for start_sample, values in heapq.merge(
+            _iter_chunks(column, start, stop),
+            _iter_blobs(column, start, stop),
+            key=lambda c: c[0]
+    ):
+        values = values[max(start - start_sample, 0):None if stop is None else stop - start_sample]
+        if len(values):
+            yield window(values, max(start, start_sample))
+
+
+def count_values(column: DataColumn) -> int:
+    """
+    Return the number of values in a Column, without reading them.
+    """
+    try:
+        get_timeseries_chunk_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return 0
+    # The next chunk would start after the last value
+    _, end = _get_append_positions(TimeseriesBlob, [column])[column.id]
+    return end
+
+
+def get_values_version(column: DataColumn) -> str:
+    """
+    Return a string that changes whenever values are added to or removed from a Column.
+
+    Values are only ever appended, or deleted and imported again as new rows,
+    so the number of values, the TimeseriesData array's row, and the newest chunk and blob
+    identify the Column's data.
+    """
+    try:
+        chunk_handler = get_timeseries_chunk_handler_by_type(column.data_type)
+        handler = get_timeseries_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return ''
+    array_id = handler.objects.filter(column=column).values_list('id', flat=True).first()
+    last_ids = [
+        model.objects.filter(column=column).order_by('-seq').values_list('id', flat=True).first()
+        for model in [chunk_handler, TimeseriesBlob]
+    ]
+    return '-'.join(str(v) for v in [count_values(column), array_id, *last_ids])
+
+
+def get_values(column: DataColumn) -> list:
+    """
+    Return all of a Column's values in a single list.
+    """
+    return [v for values in iter_values(column) for v in _to_list(values)]
+
+
+def _to_list(values: list | np.ndarray) -> list:
+    return values.tolist() if isinstance(values, np.ndarray) else values
+
+
+def get_last_value(column: DataColumn):
+    """
+    Return the last of a Column's values, or None if it has none.
+
+    Only that value, or the blob containing it, is fetched from the database.
+    """
+    try:
+        chunk_handler = get_timeseries_chunk_handler_by_type(column.data_type)
+        handler = get_timeseries_handler_by_type(column.data_type)
+    except UnsupportedTimeseriesDataTypeError:
+        return None
+    last_blob = TimeseriesBlob.objects.filter(column=column, length__gt=0).order_by('-seq').first()
+    chunks = chunk_handler.objects.filter(column=column, values__len__gt=0).order_by('-seq')
+    last_chunk = chunks.annotate(last=_last_element(chunk_handler)).values_list('start_sample', 'last')[:1]
+    if len(last_chunk) and (last_blob is None or last_chunk[0][0] > last_blob.start_sample):
+        return last_chunk[0][1]
+    if last_blob is not None:
+        return decode_blob(last_blob.data, last_blob.dtype, last_blob.encoding)[-1].item()
+    last = handler.objects.filter(column=column, values__len__gt=0)\
+        .annotate(last=_last_element(handler))\
+        .values_list('last', flat=True)[:1]
+    return last[0] if len(last) else None
+
+
+def delete_file_values(file: ObservedFile):
+    """
+    Delete the values of all Columns in a File's Datasets, and their downsample pyramids.
+    """
+    for handler in [
+        TimeseriesDataFloat, TimeseriesDataInt, TimeseriesDataStr,
+        TimeseriesChunkFloat, TimeseriesChunkInt, TimeseriesChunkStr, TimeseriesBlob, TimeseriesSummary
+    ]:
+        handler.objects.filter(column__dataset__file=file).delete()
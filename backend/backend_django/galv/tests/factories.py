@@ -134,3 +134,31 @@ class EquipmentFactory(factory.django.DjangoModelFactory):
 
     name = factory.Faker('catch_phrase')
     type = factory.Faker('bs')
+
+
+class DataUnitFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = DataUnit
+
+    name = factory.Faker('word')
+    symbol = factory.Faker('lexify', text='??')
+    description = factory.Faker('sentence')
+
+
+class DataColumnTypeFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = DataColumnType
+
+    unit = factory.SubFactory(DataUnitFactory)
+    name = factory.Faker('word')
+    description = factory.Faker('sentence')
+
+
+class DataColumnFactory(factory.django.DjangoModelFactory):
+    class Meta:
+        model = DataColumn
+
+    dataset = factory.SubFactory(DatasetFactory)
+    type = factory.SubFactory(DataColumnTypeFactory)
+    data_type = 'float'
+    name = factory.Faker('word')
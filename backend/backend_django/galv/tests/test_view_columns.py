@@ -0,0 +1,424 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import io
+import unittest
+from unittest import mock
+import numpy as np
+import pyarrow as pa
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+import logging
+
+from .factories import UserFactory, \
+    HarvesterFactory, \
+    DataColumnFactory
+from galv import decimation, pyramid, storage
+from galv.ingest import complete_import, process_next_ingest_job
+from galv.renderers import MISSING_INT
+from galv.models import FileState, ObservedFile, IngestJob, TimeseriesDataFloat, TimeseriesChunkFloat, \
+    TimeseriesChunkStr, TimeseriesBlob, TimeseriesSummary
+from galv.storage import append_values, append_values_bulk, format_binary_array, get_values, get_last_value, \
+    delete_file_values, iter_values, count_values, get_values_version
+
+logger = logging.getLogger(__file__)
+logger.setLevel(logging.INFO)
+
+
+class DataColumnTests(APITestCase):
+    def setUp(self):
+        self.harvester = HarvesterFactory.create(name='Test DataColumn')
+        self.column = DataColumnFactory.create(dataset__file__harvester=self.harvester)
+        self.user = UserFactory.create(username='test_column_user')
+        self.url = reverse('datacolumn-values', args=(self.column.id,))
+
+    def get_values(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [float(v) for v in b''.join(response.streaming_content).decode('utf-8').split()]
+
+    def test_chunks(self):
+        self.client.force_login(self.user)
+        print("Test column without data")
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(get_last_value(self.column))
+        print("OK")
+        print("Test appending chunks")
+        append_values(self.column, [1.0, 2.0, 3.0])
+        append_values(self.column, [4.0, 5.0])
+        chunks = TimeseriesChunkFloat.objects.filter(column=self.column).order_by('seq')
+        self.assertEqual([(c.seq, c.start_sample) for c in chunks], [(0, 0), (1, 3)])
+        self.assertEqual(get_values(self.column), [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(get_last_value(self.column), 5.0)
+        print("OK")
+        print("Test values reassembled from chunks")
+        self.assertEqual(self.get_values(), [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(self.get_values(min=1, max=4, mod=2), [2.0, 4.0])
+        print("OK")
+        print("Test values stored before chunks are read first")
+        TimeseriesDataFloat.objects.create(column=self.column, values=[-1.0, 0.0])
+        self.assertEqual(self.get_values(), [-1.0, 0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+        print("OK")
+        print("Test deleting values")
+        delete_file_values(self.column.dataset.file)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+        print("OK")
+
+    def test_array_storage(self):
+        self.client.force_login(self.user)
+        print("Test appending to arrays in the database")
+        with self.settings(TIMESERIES_STORAGE='array'):
+            append_values(self.column, [1.0, None])
+            append_values(self.column, [])
+            append_values(self.column, np.array([3.0, 4.0]))
+        self.assertFalse(TimeseriesChunkFloat.objects.filter(column=self.column).exists())
+        self.assertEqual(TimeseriesDataFloat.objects.get(column=self.column).values, [1.0, None, 3.0, 4.0])
+        self.assertEqual(get_last_value(self.column), 4.0)
+        print("OK")
+        print("Test reimported arrays of the same length have a new version")
+        version = get_values_version(self.column)
+        delete_file_values(self.column.dataset.file)
+        with self.settings(TIMESERIES_STORAGE='array'):
+            append_values(self.column, [5.0, 6.0, 7.0, 8.0])
+        self.assertNotEqual(get_values_version(self.column), version)
+        self.assertEqual(self.get_values(), [5.0, 6.0, 7.0, 8.0])
+        delete_file_values(self.column.dataset.file)
+        with self.settings(TIMESERIES_STORAGE='array'):
+            append_values(self.column, [1.0, None, 3.0, 4.0])
+        print("OK")
+        print("Test chunks follow the array")
+        append_values(self.column, [5.0])
+        self.assertEqual(TimeseriesChunkFloat.objects.get(column=self.column).start_sample, 4)
+        self.assertEqual(get_values(self.column), [1.0, None, 3.0, 4.0, 5.0])
+        print("OK")
+        print("Test arrays are not appended to after chunks")
+        with self.settings(TIMESERIES_STORAGE='array'):
+            append_values(self.column, [6.0, 7.0])
+        self.assertEqual(len(TimeseriesDataFloat.objects.get(column=self.column).values), 4)
+        self.assertEqual(
+            [c.start_sample for c in TimeseriesChunkFloat.objects.filter(column=self.column).order_by('seq')],
+            [4, 5]
+        )
+        self.assertEqual(get_values(self.column), [1.0, None, 3.0, 4.0, 5.0, 6.0, 7.0])
+        self.assertEqual(count_values(self.column), 7)
+        self.assertEqual(get_last_value(self.column), 7.0)
+        print("OK")
+
+    def test_copy(self):
+        print("Test numeric values copied in binary")
+        ints = DataColumnFactory.create(dataset=self.column.dataset, data_type='int')
+        strs = DataColumnFactory.create(dataset=self.column.dataset, data_type='str')
+        self.assertIsNotNone(format_binary_array(np.array([1.5, np.nan]), 'float'))
+        self.assertIsNone(format_binary_array([1.5, None], 'float'))
+        self.assertIsNotNone(format_binary_array(np.array([2 ** 40]), 'int'))
+        self.assertIsNone(format_binary_array(np.array([2 ** 63], dtype=np.uint64), 'int'))
+        append_values_bulk([
+            (self.column, np.array([0.1, 1e-300, -2.5])),
+            (ints, np.array([1, -2, 2 ** 40], dtype=np.int64)),
+            (strs, ['a', 'b', 'c'])
+        ])
+        self.assertEqual(get_values(self.column), [0.1, 1e-300, -2.5])
+        self.assertEqual(get_values(ints), [1, -2, 2 ** 40])
+        print("OK")
+        print("Test values copied as text")
+        awkward = ['tab\there', 'new\nline', 'back\\slash', '"quoted"', '{braces}', 'NULL', '', None]
+        append_values_bulk([(self.column, [4.0, None]), (ints, [-2 ** 40, None]), (strs, awkward)])
+        self.assertEqual(get_values(self.column), [0.1, 1e-300, -2.5, 4.0, None])
+        self.assertEqual(get_values(ints), [1, -2, 2 ** 40, -2 ** 40, None])
+        self.assertEqual(get_values(strs), ['a', 'b', 'c', *awkward])
+        self.assertEqual(
+            [c.start_sample for c in TimeseriesChunkStr.objects.filter(column=strs).order_by('seq')],
+            [0, 3]
+        )
+        print("OK")
+
+    def test_blob_storage(self):
+        self.client.force_login(self.user)
+        ints = DataColumnFactory.create(dataset=self.column.dataset, data_type='int')
+        print("Test storing values as blobs")
+        times = np.cumsum(np.full(10, 0.1))
+        with self.settings(TIMESERIES_STORAGE='blobs', TIMESERIES_BLOB_LENGTH=4):
+            append_values_bulk([(self.column, times), (ints, [3, -1, 4, 1, 5])])
+            append_values(self.column, [1.0, None])
+            append_values(self.column, [2.5])
+        blobs = TimeseriesBlob.objects.filter(column=self.column).order_by('seq')
+        self.assertEqual([(b.start_sample, b.length) for b in blobs], [(0, 4), (4, 4), (8, 2), (12, 1)])
+        self.assertEqual(blobs[0].encoding, 'delta,zstd')
+        self.assertEqual(blobs[3].encoding, 'zstd')
+        self.assertEqual(TimeseriesChunkFloat.objects.get(column=self.column).start_sample, 10)
+        self.assertEqual(get_values(self.column), [*times.tolist(), 1.0, None, 2.5])
+        self.assertEqual(get_values(ints), [3, -1, 4, 1, 5])
+        self.assertEqual(get_last_value(self.column), 2.5)
+        self.assertEqual(get_last_value(ints), 5)
+        self.assertEqual(self.get_values(min=8, max=2), times[8:].tolist())
+        print("OK")
+        print("Test reading a slice decodes only the blobs involved")
+        with mock.patch.object(storage, 'decode_blob', wraps=storage.decode_blob) as decode_blob:
+            values = [v for block in iter_values(self.column, start=5, stop=11) for v in list(block)]
+        self.assertEqual(values, [*times[5:].tolist(), 1.0])
+        self.assertEqual(decode_blob.call_count, 2)
+        print("OK")
+        print("Test chunks follow blobs")
+        append_values(self.column, [3.5])
+        chunks = TimeseriesChunkFloat.objects.filter(column=self.column).order_by('seq')
+        self.assertEqual([c.start_sample for c in chunks], [10, 13])
+        self.assertEqual(get_values(self.column)[-3:], [None, 2.5, 3.5])
+        delete_file_values(self.column.dataset.file)
+        self.assertFalse(TimeseriesBlob.objects.filter(column=self.column).exists())
+        print("OK")
+
+
+    def test_slicing(self):
+        self.client.force_login(self.user)
+        print("Test slicing values in the database")
+        TimeseriesDataFloat.objects.create(column=self.column, values=[0.0, 1.0, 2.0])
+        append_values(self.column, [3.0, 4.0, 5.0, 6.0])
+        with self.settings(TIMESERIES_STORAGE='blobs', TIMESERIES_BLOB_LENGTH=2):
+            append_values(self.column, [7.0, 8.0, 9.0])
+        append_values(self.column, [10.0, 11.0])
+        everything = [float(v) for v in range(12)]
+        self.assertEqual(self.get_values(), everything)
+        for start in [0, 2, 3, 5, 8, 11, 12, 20]:
+            for count in [None, 0, 1, 4, 9, 20]:
+                for step in [1, 2, 3, 5]:
+                    params = {'min': start, 'mod': step}
+                    if count is not None:
+                        params['max'] = count
+                    stop = None if count is None else start + count
+                    self.assertEqual(self.get_values(**params), everything[start:stop:step], params)
+        print("OK")
+        print("Test slicing reads only the chunks involved")
+        with mock.patch.object(storage, 'decode_blob', wraps=storage.decode_blob) as decode_blob:
+            self.assertEqual(self.get_values(min=4, max=2), [4.0, 5.0])
+        self.assertEqual(decode_blob.call_count, 0)
+        self.assertEqual([s for s, _ in storage._iter_chunks(self.column, 5, 6)], [3])
+        print("OK")
+        print("Test invalid slices")
+        for params in [{'min': -1}, {'max': -1}, {'mod': 0}, {'min': 'x'}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+
+
+    def test_formats(self):
+        self.client.force_login(self.user)
+        ints = DataColumnFactory.create(dataset=self.column.dataset, data_type='int', name='ints')
+        strs = DataColumnFactory.create(dataset=self.column.dataset, data_type='str')
+        append_values_bulk([(self.column, [0.5, 1.5, None]), (ints, [1, None, 3]), (strs, ['a', 'b', 'c'])])
+        with self.settings(TIMESERIES_STORAGE='blobs'):
+            append_values_bulk([(self.column, [2.5]), (ints, [4])])
+        ints_url = reverse('datacolumn-values', args=(ints.id,))
+        strs_url = reverse('datacolumn-values', args=(strs.id,))
+
+        def get(url, accept=None, **params):
+            response = self.client.get(url, params, **({'HTTP_ACCEPT': accept} if accept else {}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, b''.join(response.streaming_content)
+
+        print("Test values sent as text by default")
+        for accept in [None, '*/*', 'application/json']:
+            response, body = get(self.url, accept)
+            self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+            self.assertEqual(body, b'0.5\n1.5\nNone\n2.5\n')
+        print("OK")
+        print("Test raw binary values")
+        response, body = get(self.url, 'application/octet-stream')
+        self.assertEqual(response['X-Galv-Dtype'], '<f8')
+        self.assertEqual(int(response['Content-Length']), len(body))
+        np.testing.assert_array_equal(np.frombuffer(body, dtype='<f8'), [0.5, 1.5, np.nan, 2.5])
+        response, body = get(ints_url, format='bin', min=1)
+        self.assertEqual(np.frombuffer(body, dtype=response['X-Galv-Dtype']).tolist(), [MISSING_INT, 3, 4])
+        print("OK")
+        print("Test .npy values")
+        response, body = get(ints_url, 'application/x-npy', mod=2)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(np.load(io.BytesIO(body)).tolist(), [1, 3])
+        _, body = get(self.url, format='npy', max=100)
+        np.testing.assert_array_equal(np.load(io.BytesIO(body)), [0.5, 1.5, np.nan, 2.5])
+        print("OK")
+        print("Test Arrow values")
+        response, body = get(ints_url, 'application/vnd.apache.arrow.stream')
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.column_names, ['ints'])
+        self.assertEqual(table.column('ints').to_pylist(), [1, None, 3, 4])
+        _, body = get(self.url, format='arrow', min=5)
+        self.assertEqual(pa.ipc.open_stream(body).read_all().num_rows, 0)
+        print("OK")
+        print("Test binary formats rejected for text Columns")
+        response = self.client.get(strs_url, HTTP_ACCEPT='application/x-npy')
+        self.assertEqual(response.status_code, status.HTTP_406_NOT_ACCEPTABLE)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('error', response.json())
+        self.assertEqual(get(strs_url, 'text/plain')[1], b'a\nb\nc\n')
+        print("OK")
+
+    def test_decimation(self):
+        self.client.force_login(self.user)
+        y = np.sin(np.linspace(0, 20, 10000))
+        y[1234] = 50.0
+        y[5000] = np.nan
+        time = DataColumnFactory.create(dataset=self.column.dataset, data_type='float', name='time')
+        strs = DataColumnFactory.create(dataset=self.column.dataset, data_type='str')
+        append_values_bulk([(self.column, y.tolist()), (time, (np.arange(10000) * 0.5).tolist()), (strs, ['a'])])
+
+        def get(**params):
+            response = self.client.get(self.url, {'format': 'npy', **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, b''.join(response.streaming_content)
+
+        print("Test min/max decimation keeps peaks")
+        response, body = get(points=100)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        rows = np.load(io.BytesIO(body))
+        self.assertEqual(rows.shape[1], 2)
+        self.assertLessEqual(len(rows), 100)
+        self.assertIn([1234, 50.0], rows.tolist())
+        self.assertTrue(np.isfinite(rows).all())
+        self.assertTrue((np.diff(rows[:, 0]) > 0).all())
+        print("OK")
+        print("Test LTTB decimation keyed on another Column")
+        _, body = get(format='arrow', points=50, method='lttb', x=time.id, min=1000, max=1000)
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.column_names, ['time', self.column.name])
+        self.assertEqual(table.num_rows, 50)
+        self.assertEqual(table.column('time')[0].as_py(), 500.0)
+        self.assertIn(617.0, table.column('time').to_pylist())
+        _, body = get(format='txt', points=4, min=0, max=3)
+        self.assertEqual(body.decode().splitlines()[0].split('\t'), ['0.0', '0.0'])
+        print("OK")
+        print("Test invalid decimation requested")
+        for params in [
+            {'points': 1}, {'points': 10, 'mod': 2}, {'points': 10, 'method': 'mean'},
+            {'points': 10, 'x': strs.id}, {'points': 10, 'x': 'time'},
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        response = self.client.get(reverse('datacolumn-values', args=(strs.id,)), {'points': 10})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test decimation revalidated with its ETag until values change")
+        etag = get(points=100)[0]['ETag']
+        with mock.patch('galv.decimation.load_values', wraps=decimation.load_values) as load_values:
+            response = self.client.get(self.url, {'format': 'npy', 'points': 100}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            load_values.assert_not_called()
+            append_values(self.column, [-50.0])
+            response = self.client.get(self.url, {'format': 'npy', 'points': 100}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            load_values.assert_called()
+        self.assertIn([10000, -50.0], np.load(io.BytesIO(b''.join(response.streaming_content))).tolist())
+        print("OK")
+
+    def test_pyramid(self):
+        self.client.force_login(self.user)
+        y = np.sin(np.linspace(0, 50, 100000))
+        y[::13] = np.nan
+        y[54321] = 50.0
+        y[99990] = -50.0
+        append_values(self.column, y[:30000].tolist())
+        with self.settings(TIMESERIES_STORAGE='blobs', TIMESERIES_BLOB_LENGTH=7000):
+            append_values(self.column, y[30000:])
+        file = self.column.dataset.file
+        file.state = FileState.IMPORTING
+
+        print("Test pyramid built by the ingest worker when import completes")
+        complete_import(file)
+        self.assertEqual(ObservedFile.objects.get(id=file.id).state, FileState.IMPORTED)
+        self.assertFalse(TimeseriesSummary.objects.filter(column=self.column).exists())
+        with mock.patch('galv.pyramid.BUILD_BLOCK_LENGTH', 10000):
+            self.assertTrue(process_next_ingest_job())
+        self.assertFalse(IngestJob.objects.filter(file=file).exists())
+        summaries = TimeseriesSummary.objects.filter(column=self.column).order_by('factor')
+        self.assertEqual([s.factor for s in summaries], pyramid.PYRAMID_FACTORS)
+        for summary in summaries:
+            self.assertEqual(summary.length, len(y))
+            expected = pyramid.summarise(y, 0, summary.factor)
+            actual = pyramid.decode_summary(summary)
+            for field in ['min', 'max', 'count', 'argmin', 'argmax']:
+                np.testing.assert_array_equal(actual[field], expected[field])
+            np.testing.assert_allclose(actual['mean'], expected['mean'])
+        print("OK")
+        print("Test decimation reads the pyramid")
+        with mock.patch('galv.decimation.load_values', wraps=decimation.load_values) as load_values:
+            response = self.client.get(self.url, {'format': 'npy', 'points': 100})
+            rows = np.load(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertLessEqual(len(rows), 100)
+            self.assertIn([54321, 50.0], rows.tolist())
+            self.assertIn([99990, -50.0], rows.tolist())
+            response = self.client.get(self.url, {'format': 'npy', 'points': 20, 'min': 50003, 'max': 49990})
+            rows = np.load(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertTrue(((rows[:, 0] >= 50003) & (rows[:, 0] < 99993)).all())
+            self.assertEqual(rows[0, 0], 50003)
+            self.assertIn([99990, -50.0], rows.tolist())
+            load_values.assert_not_called()
+            print("OK")
+            print("Test pyramid ignored once values change")
+            append_values(self.column, [100.0])
+            response = self.client.get(self.url, {'format': 'npy', 'points': 100})
+            load_values.assert_called()
+        self.assertIn([100000, 100.0], np.load(io.BytesIO(b''.join(response.streaming_content))).tolist())
+        print("OK")
+        print("Test pyramid deleted on reimport")
+        delete_file_values(file)
+        self.assertFalse(TimeseriesSummary.objects.filter(column=self.column).exists())
+        print("OK")
+
+    def test_conditional(self):
+        self.client.force_login(self.user)
+        append_values(self.column, [0.5, None])
+        with self.settings(TIMESERIES_STORAGE='blobs', TIMESERIES_BLOB_LENGTH=64):
+            append_values(self.column, np.arange(1000.0))
+
+        def get(status_code=status.HTTP_200_OK, **params):
+            headers = {k: params.pop(k) for k in list(params) if k.startswith('HTTP_')}
+            response = self.client.get(self.url, params, **headers)
+            self.assertEqual(response.status_code, status_code)
+            return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+        print("Test values revalidated with ETags")
+        response, _ = get()
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(get()[0]['ETag'], etag)
+        self.assertNotEqual(get(format='npy')[0]['ETag'], etag)
+        self.assertNotEqual(get(min=1)[0]['ETag'], etag)
+        response, body = get(status.HTTP_304_NOT_MODIFIED, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response['ETag'], body), (etag, b''))
+        get(status.HTTP_304_NOT_MODIFIED, points=10, HTTP_IF_NONE_MATCH=get(points=10)[0]['ETag'])
+        append_values(self.column, [1000.0])
+        response, _ = get(HTTP_IF_NONE_MATCH=etag)
+        self.assertNotEqual(response['ETag'], etag)
+        print("OK")
+        print("Test byte ranges of values")
+        for params in [{'format': 'npy'}, {'format': 'bin', 'min': 3, 'mod': 7}, {'format': 'npy', 'points': 50}]:
+            response, body = get(**params)
+            self.assertEqual(response['Accept-Ranges'], 'bytes')
+            etag = response['ETag']
+            length = len(body)
+            for header, first, last in [
+                ('bytes=0-9', 0, 9), ('bytes=5-200', 5, 200), ('bytes=130-', 130, length - 1),
+                ('bytes=-17', length - 17, length - 1), (f'bytes=100-{length * 2}', 100, length - 1),
+                ('bytes=0-', 0, length - 1)
+            ]:
+                response, part = get(status.HTTP_206_PARTIAL_CONTENT, HTTP_RANGE=header, **params)
+                self.assertEqual(part, body[first:last + 1], (params, header))
+                self.assertEqual(response['Content-Range'], f'bytes {first}-{last}/{length}')
+                self.assertEqual(int(response['Content-Length']), last - first + 1)
+            response, _ = get(status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, HTTP_RANGE=f'bytes={length}-', **params)
+            self.assertEqual(response['Content-Range'], f'bytes */{length}')
+            _, part = get(status.HTTP_206_PARTIAL_CONTENT, HTTP_RANGE='bytes=1-2', HTTP_IF_RANGE=etag, **params)
+            self.assertEqual(part, body[1:3])
+            self.assertEqual(get(HTTP_RANGE='bytes=1-2', HTTP_IF_RANGE='"old"', **params)[1], body)
+            self.assertEqual(get(HTTP_RANGE='bytes=1-2,5-6', **params)[1], body)
+        print("OK")
+        print("Test byte ranges ignored for formats without fixed-size rows")
+        for accept in ['text/plain', 'application/vnd.apache.arrow.stream']:
+            response, body = get(HTTP_ACCEPT=accept, HTTP_RANGE='bytes=0-1')
+            self.assertEqual(response['Accept-Ranges'], 'none')
+            self.assertGreater(len(body), 2)
+        print("OK")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,12 @@
 # Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
+import os
+import tempfile
 import unittest
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -10,7 +15,10 @@ import logging
 
 from .factories import UserFactory, \
     HarvesterFactory, \
-    DatasetFactory, MonitoredPathFactory
+    DatasetFactory, MonitoredPathFactory, DataColumnFactory
+from galv.export import iter_export_batches, prune_exports
+from galv.models import FileState
+from galv.storage import append_values_bulk
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.INFO)
@@ -37,6 +45,188 @@ class DatasetTests(APITestCase):
         self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
         print("OK")
 
+    def test_export(self):
+        floats = DataColumnFactory.create(dataset=self.dataset, data_type='float', name='floats')
+        ints = DataColumnFactory.create(dataset=self.dataset, data_type='int', name='ints')
+        strs = DataColumnFactory.create(dataset=self.dataset, data_type='str', name='strs')
+        append_values_bulk([(floats, [0.5, 1.5, None, 3.5]), (ints, [1, 2]), (strs, ['a', 'b', 'c'])])
+        with self.settings(TIMESERIES_STORAGE='blobs', TIMESERIES_BLOB_LENGTH=3):
+            append_values_bulk([(floats, np.arange(4.5, 10)), (ints, [3, 4, 5])])
+        url = reverse('dataset-export', args=(self.dataset.id,))
+        expected = {
+            'floats': [0.5, 1.5, None, 3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5],
+            'ints': [1, 2, 3, 4, 5, None, None, None, None, None],
+            'strs': ['a', 'b', 'c', None, None, None, None, None, None, None],
+        }
+
+        def get(**params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, b''.join(response.streaming_content)
+
+        self.client.force_login(self.user)
+        print("Test rejection of dataset export")
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        print("OK")
+        self.client.force_login(self.admin_user)
+        print("Test dataset export in batches")
+        for batch_length in [1, 3, 4, 100]:
+            table = pa.Table.from_batches(list(iter_export_batches([floats, ints, strs], 0, 10, batch_length)))
+            self.assertEqual(table.to_pydict(), expected)
+        table = pa.Table.from_batches(list(iter_export_batches([strs, floats], 2, 6, 3)))
+        self.assertEqual(table.to_pydict(), {'strs': ['c', None, None, None], 'floats': [None, 3.5, 4.5, 5.5]})
+        print("OK")
+        print("Test dataset export as Parquet")
+        response, body = get()
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        self.assertIn(f'dataset-{self.dataset.id}.parquet', response['Content-Disposition'])
+        self.assertEqual(pa.parquet.read_table(pa.BufferReader(body)).to_pydict(), expected)
+        print("OK")
+        print("Test dataset export as Arrow")
+        _, body = get(format='arrow', columns=f"{ints.id},{floats.id}", min=3, max=4)
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.schema.types, [pa.int64(), pa.float64()])
+        self.assertEqual(table.to_pydict(), {'ints': [4, 5, None, None], 'floats': [3.5, 4.5, 5.5, 6.5]})
+        _, body = get(format='arrow', min=20)
+        self.assertEqual(pa.ipc.open_stream(body).read_all().num_rows, 0)
+        print("OK")
+        print("Test dataset export as CSV")
+        response, body = get(format='csv', columns=strs.id)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(body.decode('utf-8').splitlines(), ['"strs"', '"a"', '"b"', '"c"'])
+        print("OK")
+        print("Test invalid dataset export requested")
+        other = DataColumnFactory.create(data_type='float')
+        for params in [{'columns': other.id}, {'columns': 'floats'}, {'min': -1}, {'max': 'all'}]:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+            self.assertIn('error', response.json())
+        print("OK")
+
+    def test_export_files(self):
+        floats = DataColumnFactory.create(dataset=self.dataset, data_type='float', name='floats')
+        append_values_bulk([(floats, [0.5, 1.5, 2.5])])
+        url = reverse('dataset-export', args=(self.dataset.id,))
+        export_root = tempfile.TemporaryDirectory()
+        self.addCleanup(export_root.cleanup)
+        export_dir = os.path.join(export_root.name, str(self.dataset.id))
+        self.client.force_login(self.admin_user)
+
+        def get(**params):
+            response = self.client.get(url, {'format': 'arrow', **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            return response, body
+
+        with self.settings(EXPORT_ROOT=export_root.name):
+            print("Test exports of Files being imported are not kept")
+            get()
+            self.assertFalse(os.path.exists(export_dir))
+            print("OK")
+            self.dataset.file.state = FileState.IMPORTED
+            self.dataset.file.save()
+            print("Test export kept once File imported")
+            _, body = get()
+            self.assertEqual(len(os.listdir(export_dir)), 1)
+            path = os.path.join(export_dir, os.listdir(export_dir)[0])
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), body)
+            get(min=1)
+            self.assertEqual(len(os.listdir(export_dir)), 1)
+            print("OK")
+            print("Test kept export sent by Django by default")
+            response, body = get()
+            self.assertNotIn('X-Accel-Redirect', response)
+            self.assertEqual(response['Accept-Ranges'], 'bytes')
+            self.assertEqual(pa.ipc.open_stream(body).read_all().to_pydict(), {'floats': [0.5, 1.5, 2.5]})
+            print("OK")
+            with self.settings(EXPORT_ACCEL_REDIRECT_URL='/django_exports/'):
+                print("Test kept export sent by proxy")
+                response, body = get()
+                self.assertEqual(
+                    response['X-Accel-Redirect'],
+                    f"/django_exports/{self.dataset.id}/{os.path.basename(path)}"
+                )
+                self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+                self.assertIn(f'dataset-{self.dataset.id}.arrow', response['Content-Disposition'])
+                self.assertEqual(body, b'')
+                print("OK")
+                print("Test proxy given the headers it sends with parts of kept exports")
+                etag = response['ETag']
+                with self.settings(CORS_ALLOWED_ORIGINS=['http://frontend']):
+                    response = self.client.get(
+                        url, {'format': 'arrow'},
+                        HTTP_RANGE='bytes=10-99', HTTP_IF_RANGE=etag, HTTP_ORIGIN='http://frontend'
+                    )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn('X-Accel-Redirect', response)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(response['Access-Control-Allow-Origin'], 'http://frontend')
+                self.assertIn('ETag', response['Access-Control-Expose-Headers'])
+                print("OK")
+            print("Test kept export revalidated with ETags and sent in parts")
+            response, _ = get()
+            etag = response['ETag']
+            self.assertEqual(get(min=1)[0]['Accept-Ranges'], 'none')
+            response = self.client.get(url, {'format': 'arrow'}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            _, body = get()
+            response = self.client.get(url, {'format': 'arrow'}, HTTP_RANGE='bytes=10-99', HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(response['Content-Range'], f'bytes 10-99/{len(body)}')
+            self.assertEqual(b''.join(response.streaming_content), body[10:100])
+            response = self.client.get(url, {'format': 'arrow'}, HTTP_RANGE=f'bytes={len(body)}-')
+            self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            print("OK")
+            print("Test part of an export not yet kept sent in full, and kept")
+            response = self.client.get(url, {'format': 'csv'}, HTTP_RANGE='bytes=0-7')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Accept-Ranges'], 'none')
+            self.assertEqual(b''.join(response.streaming_content).splitlines()[0], b'"floats"')
+            self.assertEqual(len(os.listdir(export_dir)), 2)
+            response = self.client.get(url, {'format': 'csv'}, HTTP_RANGE='bytes=0-7')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(b''.join(response.streaming_content), b'"floats"')
+            os.remove(os.path.join(export_dir, [f for f in os.listdir(export_dir) if f.endswith('.csv')][0]))
+            print("OK")
+            print("Test new export replaces the kept one when values change")
+            append_values_bulk([(floats, [3.5])])
+            _, body = get()
+            self.assertEqual(pa.ipc.open_stream(body).read_all().num_rows, 4)
+            self.assertEqual(len(os.listdir(export_dir)), 1)
+            print("OK")
+            print("Test exports of some Columns not kept")
+            ints = DataColumnFactory.create(dataset=self.dataset, data_type='int', name='ints')
+            append_values_bulk([(ints, [1, 2])])
+            for columns in [f"{floats.id}", f"{ints.id},{floats.id}"]:
+                response, _ = get(columns=columns)
+                self.assertEqual(response['Accept-Ranges'], 'none')
+            self.assertEqual(len(os.listdir(export_dir)), 1)
+            get(columns=f"{floats.id},{ints.id}")
+            self.assertEqual(len(os.listdir(export_dir)), 1)
+            self.assertEqual(get()[0]['Accept-Ranges'], 'bytes')
+            print("OK")
+            print("Test oldest kept exports deleted once they are too large")
+            with self.settings(EXPORT_MAX_SIZE=1):
+                get(format='parquet')
+            paths = {name.split('.')[-1]: os.path.join(export_dir, name) for name in os.listdir(export_dir)}
+            self.assertEqual(sorted(paths.keys()), ['arrow', 'parquet'])
+            os.utime(paths['arrow'], (0, 0))
+            with self.settings(EXPORT_MAX_SIZE=os.path.getsize(paths['parquet'])):
+                prune_exports()
+            self.assertEqual(os.listdir(export_dir), [os.path.basename(paths['parquet'])])
+            with self.settings(EXPORT_MAX_SIZE=1):
+                get(format='csv')
+                self.assertEqual(len(os.listdir(export_dir)), 2)
+                prune_exports()
+            self.assertEqual(os.listdir(export_dir), [])
+            print("OK")
+            print("Test kept exports deleted on reimport")
+            response = self.client.get(reverse('observedfile-reimport', args=(self.dataset.file.id,)))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertFalse(os.path.exists(export_dir))
+            print("OK")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -37,7 +37,14 @@ class ObservedFileTests(APITestCase):
         print("OK")
         self.client.force_login(self.admin_user)
         print("Test view path")
-        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['import_progress'], {'pending': 0, 'done': 0, 'failed': 0})
+        print("OK")
+        print("Test list leaves out import progress")
+        response = self.client.get(reverse('observedfile-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f['import_progress'] for f in response.json()], [None] * len(self.files))
         print("OK")
 
     def test_reimport(self):
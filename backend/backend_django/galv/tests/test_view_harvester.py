@@ -2,7 +2,13 @@
 # Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
+import gzip
+import json
+import struct
 import unittest
+import numpy as np
+import zstandard
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 import logging
@@ -10,7 +16,8 @@ import logging
 from .utils import GalvTestCase
 from .factories import UserFactory, \
     HarvesterFactory, \
-    MonitoredPathFactory
+    MonitoredPathFactory, \
+    DataColumnTypeFactory
 from galv.models import Harvester, \
     HarvesterEnvVar, \
     HarvestError, \
@@ -19,7 +26,11 @@ from galv.models import Harvester, \
     Dataset, \
     FileState, \
     DataColumn, \
-    TimeseriesDataInt
+    IngestJob, \
+    IngestJobState
+from galv.ingest import process_next_ingest_job
+from galv.parsers import ColumnReportParser
+from galv.storage import get_values
 
 logger = logging.getLogger(__file__)
 logger.setLevel(logging.INFO)
@@ -304,6 +315,228 @@ class HarvesterTests(GalvTestCase):
         self.assertEqual(response.json()['state'], FileState.IMPORTED)
         print("OK")
 
+    @override_settings(QUEUE_HARVESTER_UPLOADS=False)
+    def test_report_binary(self):
+        harvester = HarvesterFactory.create(name='Test Binary Report')
+        monitored_path = MonitoredPathFactory.create(harvester=harvester)
+        url = reverse('harvester-report', args=(harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {harvester.api_key}"}
+        body = {'status': 'success', 'monitored_path_id': monitored_path.id, 'path': '/a/binary/file.ext'}
+        for content in [
+            {'task': 'file_size', 'size': 1024},
+            {'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {}}
+        ]:
+            response = self.client.post(url, {**body, 'content': content}, format='json', **headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        def encode(report, *buffers):
+            header = json.dumps(report).encode('utf-8')
+            return b''.join([ColumnReportParser.MAGIC, struct.pack('<I', len(header)), header, *buffers])
+
+        values = np.array([1.5, 2.5, 3.5], dtype='<f8')
+        report = {**body, 'content': {
+            'task': 'import',
+            'status': 'in_progress',
+            'test_date': 1024.0,
+            'data': [{
+                'column_name': 'x',
+                'unit_symbol': 'bx',
+                'data_type': 'float',
+                'values_dtype': values.dtype.str,
+                'values_length': len(values)
+            }]
+        }}
+        print("Test binary report with truncated values")
+        response = self.client.post(
+            url, encode(report, values.tobytes()[:-1]), content_type=ColumnReportParser.media_type, **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test binary report")
+        response = self.client.post(
+            url, encode(report, values.tobytes()), content_type=ColumnReportParser.media_type, **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        column = DataColumn.objects.get(dataset__file__path='/a/binary/file.ext', name='x')
+        self.assertEqual(get_values(column), [1.5, 2.5, 3.5])
+        print("OK")
+
+    @override_settings(QUEUE_HARVESTER_UPLOADS=False)
+    def test_report_upload_session(self):
+        harvester = HarvesterFactory.create(name='Test Upload Session')
+        monitored_path = MonitoredPathFactory.create(harvester=harvester)
+        column_type = DataColumnTypeFactory.create()
+        url = reverse('harvester-report', args=(harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {harvester.api_key}"}
+        body = {'status': 'success', 'monitored_path_id': monitored_path.id, 'path': '/a/session/file.ext'}
+        response = self.client.post(
+            url, {**body, 'content': {'task': 'file_size', 'size': 1024}}, format='json', **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        print("Test columns resolved when import begins")
+        response = self.client.post(url, {**body, 'content': {
+            'task': 'import',
+            'status': 'begin',
+            'test_date': 1024.0,
+            'core_metadata': {},
+            'extra_metadata': {},
+            'columns': [
+                {'column_id': column_type.id, 'data_type': 'int', 'official_sample_counter': True},
+                {'column_name': 'y', 'unit_symbol': 'by', 'data_type': 'float'}
+            ]
+        }}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload_session = response.json()['upload_info']['upload_session']
+        x, y = upload_session['columns']
+        self.assertEqual(x['name'], column_type.name)
+        self.assertEqual(y['name'], 'y')
+        self.assertEqual(y['data_type'], 'float')
+        self.assertEqual(DataColumn.objects.filter(dataset__file__path='/a/session/file.ext').count(), 2)
+        print("OK")
+        print("Test upload referring to columns by id")
+        content = {'task': 'import', 'status': 'in_progress', 'upload_session': upload_session['id']}
+        response = self.client.post(url, {**body, 'content': {**content, 'data': [
+            {'column': x['id'], 'values': [1, 2]},
+            {'column': y['id'], 'values': [0.5, 1.5]}
+        ]}}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(get_values(DataColumn.objects.get(id=y['id'])), [0.5, 1.5])
+        print("OK")
+        print("Test upload referring to a column outside the session")
+        other = DataColumn.objects.exclude(dataset__file__path='/a/session/file.ext').first()
+        response = self.client.post(url, {**body, 'content': {**content, 'data': [
+            {'column': other.id if other else 0, 'values': [3]}
+        ]}}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test upload to an unknown session")
+        response = self.client.post(url, {**body, 'content': {
+            **content, 'upload_session': upload_session['id'] + 1, 'data': []
+        }}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test resume information")
+        response = self.client.post(url, {**body, 'content': {
+            'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {},
+            'columns': []
+        }}, format='json', **headers)
+        self.assertEqual(response.json()['upload_info']['last_record_number'], 2)
+        self.assertNotEqual(response.json()['upload_info']['upload_session']['id'], upload_session['id'])
+        print("OK")
+
+    def test_report_queued(self):
+        harvester = HarvesterFactory.create(name='Test Queued Report')
+        monitored_path = MonitoredPathFactory.create(harvester=harvester)
+        url = reverse('harvester-report', args=(harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {harvester.api_key}"}
+        path = '/a/queued/file.ext'
+        body = {'status': 'success', 'monitored_path_id': monitored_path.id, 'path': path}
+        begin = {
+            'task': 'import', 'status': 'begin', 'test_date': 1024.0, 'core_metadata': {}, 'extra_metadata': {},
+            'columns': [{'column_name': 'y', 'unit_symbol': 'qy', 'data_type': 'float'}]
+        }
+        self.client.post(url, {**body, 'content': {'task': 'file_size', 'size': 1024}}, format='json', **headers)
+        response = self.client.post(url, {**body, 'content': begin}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        upload_session = response.json()['upload_info']['upload_session']
+        column_id = upload_session['columns'][0]['id']
+        content = {'task': 'import', 'status': 'in_progress', 'upload_session': upload_session['id']}
+
+        print("Test reports carrying data are queued")
+        response = self.client.post(url, {**body, 'content': {**content, 'data': [
+            {'column': column_id, 'values': [0.5, 1.5]}
+        ]}}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        values = np.array([2.5, 3.5], dtype='<f8')
+        header = json.dumps({**body, 'content': {**content, 'data': [
+            {'column': column_id, 'values_dtype': values.dtype.str, 'values_length': len(values)}
+        ]}}).encode('utf-8')
+        compressed = zstandard.ZstdCompressor().compress(
+            b''.join([ColumnReportParser.MAGIC, struct.pack('<I', len(header)), header, values.tobytes()])
+        )
+        response = self.client.post(
+            url, compressed, content_type=ColumnReportParser.media_type, HTTP_CONTENT_ENCODING='zstd', **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = IngestJob.objects.filter(file__path=path).latest('id')
+        self.assertEqual((job.content_encoding, bytes(job.body)), ('zstd', compressed))
+        response = self.client.post(url, {**body, 'content': {
+            'task': 'import', 'status': 'complete', 'upload_session': upload_session['id']
+        }}, format='json', **headers)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.json()['state'], FileState.IMPORTING)
+        self.assertEqual(response.json()['import_progress'], {'pending': 3, 'done': 0, 'failed': 0})
+        self.assertEqual(get_values(DataColumn.objects.get(id=column_id)), [])
+        print("OK")
+
+        print("Test queued reports are applied in order")
+        while process_next_ingest_job():
+            pass
+        self.assertEqual(get_values(DataColumn.objects.get(id=column_id)), [0.5, 1.5, 2.5, 3.5])
+        file = ObservedFile.objects.get(path=path)
+        self.assertEqual(file.state, FileState.IMPORTED)
+        self.assertFalse(IngestJob.objects.filter(file=file).exists())
+        print("OK")
+
+        print("Test a failed report fails the reports queued after it")
+        response = self.client.post(url, {**body, 'content': begin}, format='json', **headers)
+        self.assertIsNone(response.json()['import_progress'])
+        upload_session = response.json()['upload_info']['upload_session']
+        content['upload_session'] = upload_session['id']
+        for data in [[{'column': 0, 'values': [1.0]}], [{'column': column_id, 'values': [4.5]}]]:
+            response = self.client.post(url, {**body, 'content': {**content, 'data': data}}, format='json', **headers)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(process_next_ingest_job())
+        self.assertFalse(process_next_ingest_job())
+        file.refresh_from_db()
+        self.assertEqual(file.state, FileState.IMPORT_FAILED)
+        self.assertEqual(IngestJob.objects.filter(file=file, state=IngestJobState.FAILED).count(), 2)
+        self.assertTrue(HarvestError.objects.filter(file=file).exists())
+        self.assertEqual(get_values(DataColumn.objects.get(id=column_id)), [0.5, 1.5, 2.5, 3.5])
+        print("OK")
+
+    def test_report_compressed(self):
+        harvester = HarvesterFactory.create(name='Test Compressed Report')
+        monitored_path = MonitoredPathFactory.create(harvester=harvester)
+        url = reverse('harvester-report', args=(harvester.id,))
+        headers = {'HTTP_AUTHORIZATION': f"Harvester {harvester.api_key}"}
+        body = json.dumps({
+            'status': 'success',
+            'monitored_path_id': monitored_path.id,
+            'path': '/a/compressed/file.ext',
+            'content': {'task': 'file_size', 'size': 1024}
+        }).encode('utf-8')
+        for encoding, compress in [
+            ('gzip', gzip.compress),
+            ('zstd', lambda b: zstandard.ZstdCompressor().compress(b))
+        ]:
+            print(f"Test {encoding} report")
+            response = self.client.post(
+                url, compress(body), content_type='application/json', HTTP_CONTENT_ENCODING=encoding, **headers
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['last_observed_size'], 1024)
+            print("OK")
+        print("Test corrupt compressed report")
+        response = self.client.post(
+            url, body, content_type='application/json', HTTP_CONTENT_ENCODING='gzip', **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        print("OK")
+        print("Test unsupported Content-Encoding")
+        response = self.client.post(
+            url, body, content_type='application/json', HTTP_CONTENT_ENCODING='br', **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        print("OK")
+        print("Test decompressed size limit")
+        with self.settings(DATA_UPLOAD_MAX_DECOMPRESSED_SIZE=len(body) - 1):
+            response = self.client.post(
+                url, gzip.compress(body), content_type='application/json', HTTP_CONTENT_ENCODING='gzip', **headers
+            )
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        print("OK")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,10 +3,13 @@
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
 import datetime
+import itertools
 import re
 
 import knox.auth
+import numpy as np
 import os
+from django.conf import settings
 from django.db.models import Q
 
 from .serializers import HarvesterSerializer, \
@@ -38,26 +41,56 @@ from .models import Harvester, \
     Equipment, \
     DataUnit, \
     DataColumnType, \
-    TimeseriesDataFloat, \
-    TimeseriesDataInt, \
-    TimeseriesDataStr, \
     DataColumn, \
-    UnsupportedTimeseriesDataTypeError, \
-    get_timeseries_handler_by_type, \
+    UploadSession, \
+    IngestJob, \
     TimeseriesRangeLabel, \
     FileState, \
     VouchFor, \
     KnoxAuthToken
 from .permissions import HarvesterAccess, ReadOnlyIfInUse, MonitoredPathAccess
+from .parsers import ColumnReportParser
+from .storage import count_values, delete_file_values, get_values_version, has_values, iter_values
+from .renderers import COLUMN_VALUES_RENDERERS, \
+    DATASET_EXPORT_RENDERERS, \
+    StreamingContentNegotiation, \
+    get_column_dtype, \
+    to_array
+from .conditional import RangeNotSatisfiable, \
+    make_etag, \
+    not_modified, \
+    get_range, \
+    range_not_satisfiable_response, \
+    set_content_range, \
+    slice_stream, \
+    iter_file_range
+from .export import get_export_schema, \
+    iter_export_batches, \
+    get_export_version, \
+    get_export_path, \
+    export_exists, \
+    write_export, \
+    delete_file_exports
+from .decimation import DECIMATION_METHODS, MAX_DECIMATION_POINTS, decimate_column
+from .ingest import IngestError, \
+    QUEUEABLE_MEDIA_TYPES, \
+    check_column_data_type, \
+    complete_import, \
+    deserialize_datetime, \
+    get_or_create_column, \
+    has_queued_reports, \
+    queue_report, \
+    store_import_data
 from .utils import get_files_from_path
 from django.contrib.auth.models import User, Group
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.core import validators
-from django.http import StreamingHttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, serializers, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from knox.views import LoginView as KnoxLoginView
 from knox.views import LogoutView as KnoxLogoutView
 from knox.views import LogoutAllView as KnoxLogoutAllView
@@ -89,12 +122,86 @@ def error_response(error: str, status: int = 400) -> Response:
     return Response({'error': error}, status=status)
 
 
-def deserialize_datetime(serialized_value: str | float) -> timezone.datetime:
-    if isinstance(serialized_value, str):
-        return timezone.make_aware(timezone.datetime.fromisoformat(serialized_value))
-    if isinstance(serialized_value, float):
-        return timezone.make_aware(timezone.datetime.fromtimestamp(serialized_value))
-    raise TypeError
+def get_content_type(renderer) -> str:
+    return renderer.media_type if renderer.charset is None else f"{renderer.media_type}; charset={renderer.charset}"
+
+
+def streaming_response(renderer, content) -> StreamingHttpResponse:
+    return StreamingHttpResponse(content, content_type=get_content_type(renderer))
+
+
+def export_file_response(request, renderer, path: str, etag: str) -> HttpResponse:
+    """
+    Send an export file kept under settings.EXPORT_ROOT,
+    by asking the proxy to send it (X-Accel-Redirect) if it can, in which case the proxy handles Range requests.
+    The proxy must keep this response's ETag and CORS headers, as nginx-proxy/default does,
+    so that If-Range is checked against the ETag.
+    """
+    content_type = get_content_type(renderer)
+    if settings.EXPORT_ACCEL_REDIRECT_URL:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = f"{settings.EXPORT_ACCEL_REDIRECT_URL.rstrip('/')}/{path}"
+        return response
+    full_path = os.path.join(settings.EXPORT_ROOT, path)
+    length = os.path.getsize(full_path)
+    try:
+        byte_range = get_range(request, etag, length)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable_response(length)
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(iter_file_range(full_path, *byte_range), content_type=content_type)
+        set_content_range(response, *byte_range, length)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def stream_values_response(
+        request,
+        renderer,
+        etag: str,
+        read_rows,
+        dtype: np.dtype | None,
+        length: int,
+        names: list[str]
+):
+    """
+    Stream rows of Column values in the format of a ColumnValuesRenderer.
+
+    read_rows(first, last) returns the blocks of values in rows first to last (exclusive).
+    For formats where every row has the same size, a byte range of the response can be requested,
+    and only the rows it overlaps are read.
+    """
+    layout = renderer.get_layout(dtype, length, names) if dtype is not None else None
+    byte_range = None
+    if layout is not None:
+        header, row_size = layout
+        content_length = renderer.get_content_length(dtype, length, names)
+        try:
+            byte_range = get_range(request, etag, content_length)
+        except RangeNotSatisfiable:
+            return range_not_satisfiable_response(content_length)
+    if byte_range is None:
+        response = streaming_response(renderer, renderer.stream(read_rows(0, length), dtype, length, names))
+        if layout is not None:
+            response['Content-Length'] = content_length
+    else:
+        first, last = byte_range
+        first_row = max(first - len(header), 0) // row_size
+        last_row = -(-max(last + 1 - len(header), 0) // row_size)
+        chunks = itertools.chain(
+            [header] if first < len(header) else [],
+            (to_array(values, dtype).tobytes() for values in read_rows(first_row, last_row))
+        )
+        offset = 0 if first < len(header) else len(header) + first_row * row_size
+        response = streaming_response(renderer, slice_stream(chunks, first - offset, last - first + 1))
+        set_content_range(response, first, last, content_length)
+    if dtype is not None:
+        response['X-Galv-Dtype'] = dtype.str
+    response['Accept-Ranges'] = 'none' if layout is None else 'bytes'
+    response['ETag'] = etag
+    return response
 
 
 @extend_schema(
@@ -363,6 +470,22 @@ The harvester programs use the report endpoint for all information they send to
 (except initial self-registration).
 Reports will be file size reports, file parsing reports, or error reports.
 File parsing reports may contain metadata or data to store.
+
+Reports are JSON, or, where they carry columns of data, may be sent as `application/x-galv-columns`:
+a JSON header describing the report followed by the values of its numeric columns as little-endian binary.
+
+A report beginning an import may describe the file's columns in `columns`.
+Those Columns are then created straight away, and the response's `upload_info` includes an `upload_session`
+listing their ids, so that reports carrying data can refer to each Column by its id
+and give the `upload_session` id instead of a `test_date`.
+
+Reports carrying data are normally queued, and answered with HTTP 202 once they are stored.
+Their data are then saved by the ingest worker (`manage.py ingest_worker`),
+which applies each File's reports in the order they arrived.
+A report completing an import is queued too if earlier reports are still waiting.
+Once a File is imported, the ingest worker builds downsample pyramids of its numeric Columns.
+The File's `import_progress`, included when a report is queued, counts its queued reports
+that are pending, done, or failed. Once an import is complete its reports are deleted.
         """,
         request=inline_serializer('HarvesterReportSerializer', {
             # TODO
@@ -426,7 +549,7 @@ class HarvesterViewSet(viewsets.ModelViewSet):
             context={'request': request}
         ).data)
 
-    @action(detail=True, methods=['POST'])
+    @action(detail=True, methods=['POST'], parser_classes=[*api_settings.DEFAULT_PARSER_CLASSES, ColumnReportParser])
     def report(self, request, pk: int = None):
         """
         Process a Harvester's report on its activity.
@@ -434,6 +557,8 @@ class HarvesterViewSet(viewsets.ModelViewSet):
 
         Only Harvesters are authorised to issue reports.
         """
+        # Keep the report as received in case it is queued
+        content_encoding, body = getattr(request, 'encoded_body', (None, request.body))
         harvester = get_object_or_404(Harvester, id=pk)
         self.check_object_permissions(self.request, harvester)
         harvester.last_check_in = timezone.now()
@@ -517,6 +642,10 @@ class HarvesterViewSet(viewsets.ModelViewSet):
                     file = ObservedFile.objects.get(harvester=harvester, path=path)
                 except ObservedFile.DoesNotExist:
                     return error_response("ObservedFile does not exist")
+                # Reports carrying data are queued for the ingest worker where possible
+                queue_uploads = settings.QUEUE_HARVESTER_UPLOADS and request.content_type in QUEUEABLE_MEDIA_TYPES
+                upload_session = None
+                session_columns = None
                 if content['status'] in ['begin', 'in_progress', 'complete']:
                     try:
                         if content['status'] == 'begin':
@@ -544,70 +673,36 @@ class HarvesterViewSet(viewsets.ModelViewSet):
                                 file=file,
                                 date=date
                             )
+                            # Reports queued from an earlier attempt are superseded by this one
+                            IngestJob.objects.filter(file=file).delete()
+                            delete_file_exports(file)
+                            if content.get('columns') is not None:
+                                # Resolve the Columns now, so that later reports can refer to them by id
+                                UploadSession.objects.filter(file=file).delete()
+                                upload_session = UploadSession.objects.create(file=file, dataset=dataset)
+                                session_columns = []
+                                for column_data in content['columns']:
+                                    column = get_or_create_column(dataset, column_data)
+                                    try:
+                                        check_column_data_type(column)
+                                    except IngestError as e:
+                                        return error_response(str(e))
+                                    session_columns.append(column)
+                        elif queue_uploads and (content['status'] == 'in_progress' or has_queued_reports(file)):
+                            # Data are stored by the ingest worker, and the import is complete
+                            # once the reports queued before it have been applied
+                            queue_report(file, request.content_type, body, content_encoding)
+                            return Response(ObservedFileSerializer(file, context={
+                                'request': self.request,
+                                'with_import_progress': True
+                            }).data, status=202)
                         elif content['status'] == 'complete':
-                            if file.state == FileState.IMPORTING:
-                                file.state = FileState.IMPORTED
+                            complete_import(file)
                         else:
-                            time_start = time.time()
-                            date = deserialize_datetime(content['test_date'])
-                            dataset = Dataset.objects.get(file=file, date=date)
-                            for column_data in content['data']:
-                                time_col_start = time.time()
-                                logger.warning(f"Column {column_data.get('column_name', column_data.get('column_id'))}")
-                                try:
-                                    data_type = column_data.get('data_type')
-                                except KeyError:
-                                    return error_response(f"Could not find sample data for column {column_data}")
-                                try:
-                                    column_type = DataColumnType.objects.get(id=column_data['column_id'])
-                                    column, _ = DataColumn.objects.get_or_create(
-                                        name=column_type.name,
-                                        data_type=data_type,
-                                        type=column_type,
-                                        dataset=dataset,
-                                        official_sample_counter=column_data.get('official_sample_counter', False)
-                                    )
-                                except KeyError:
-                                    if 'unit_id' in column_data:
-                                        unit = DataUnit.objects.get(id=column_data['unit_id'])
-                                    else:
-                                        unit, _ = DataUnit.objects.get_or_create(symbol=column_data['unit_symbol'])
-                                    try:
-                                        column_type = DataColumnType.objects.get(unit=unit)
-                                    except DataColumnType.DoesNotExist:
-                                        column_type = DataColumnType.objects.create(
-                                            name=column_data['column_name'],
-                                            unit=unit
-                                        )
-                                    column, _ = DataColumn.objects.get_or_create(
-                                        name=column_data['column_name'],
-                                        data_type=data_type,
-                                        type=column_type,
-                                        dataset=dataset,
-                                        official_sample_counter=column_data.get('official_sample_counter', False)
-                                    )
-
-                                time_ts_prep = time.time()
-                                # get timeseries handler
-                                try:
-                                    handler = get_timeseries_handler_by_type(column.data_type)
-                                except UnsupportedTimeseriesDataTypeError:
-                                    return error_response(
-                                        f'Unsupported variable type {column.data_type} in column {column.name}'
-                                    )
-                                try:
-                                    # insert values
-                                    timeseries, _ = handler.objects.get_or_create(column=column)
-                                    data = timeseries.values if timeseries.values is not None else []
-                                    data = [*data, *column_data["values"]]
-                                    timeseries.values = data
-                                    timeseries.save()
-                                except Exception as e:
-                                    return error_response(f"Error saving column {column_data['column_name']}. {type(e)}: {e.args[0]}")
-                                checkpoint('created timeseries data', time_ts_prep)
-                                checkpoint('column complete', time_col_start)
-
-                            checkpoint('complete', time_start)
+                            try:
+                                store_import_data(file, content)
+                            except IngestError as e:
+                                return error_response(str(e))
                     except BaseException as e:
                         file.state = FileState.IMPORT_FAILED
                         HarvestError.objects.create(harvester=harvester, file=file, error=str(e))
@@ -620,7 +715,9 @@ class HarvesterViewSet(viewsets.ModelViewSet):
 
                 return Response(ObservedFileSerializer(file, context={
                     'request': self.request,
-                    'with_upload_info': content['status'] == 'begin'
+                    'with_upload_info': content['status'] == 'begin',
+                    'upload_session': upload_session,
+                    'upload_session_columns': session_columns
                 }).data)
             else:
                 return error_response('Unrecognised task')
@@ -789,6 +886,10 @@ class ObservedFileViewSet(viewsets.ModelViewSet):
         ids = [file.id for file in files]
         return ObservedFile.objects.filter(id__in=ids).order_by('-last_observed_time', '-id')
 
+    def get_serializer_context(self):
+        # Counting queued reports takes a query for each File, so lists leave it out
+        return {**super().get_serializer_context(), 'with_import_progress': self.detail}
+
     @action(detail=True, methods=['GET'])
     def reimport(self, request, pk: int = None):
         try:
@@ -796,12 +897,12 @@ class ObservedFileViewSet(viewsets.ModelViewSet):
             self.check_object_permissions(self.request, file)
         except ObservedFile.DoesNotExist:
             return error_response('Requested file not found')
-        TimeseriesDataFloat.objects.filter(column__dataset__file=file).delete()
-        TimeseriesDataInt.objects.filter(column__dataset__file=file).delete()
-        TimeseriesDataStr.objects.filter(column__dataset__file=file).delete()
+        IngestJob.objects.filter(file=file).delete()
+        delete_file_values(file)
+        delete_file_exports(file)
         file.state = FileState.RETRY_IMPORT
         file.save()
-        return Response(self.get_serializer(file, context={'request': request}).data)
+        return Response(self.get_serializer(file).data)
 
 
 @extend_schema_view(
@@ -830,6 +931,32 @@ Update a Dataset's metadata to associate it with the Cell or Experimental equipm
 used in the experiment that generated the data, describe that experiment's purpose,
 or amend an incorrect name or file type value.
         """
+    ),
+    export=extend_schema(
+        summary="Download a Dataset's data as a single table",
+        description="""
+Download the values of a Dataset's Columns in one table, with a column for each Column
+and a row for each sample. Columns with fewer values are padded with missing values.
+
+The format is chosen with the Accept header, or the `format` parameter:
+- `application/vnd.apache.parquet` (`format=parquet`, default): an Apache Parquet file
+- `application/vnd.apache.arrow.stream` (`format=arrow`): an Apache Arrow IPC stream
+- `text/csv` (`format=csv`): comma-separated values with a header row; missing values are left empty
+
+The table is built and sent in batches of rows, so Datasets of any size can be exported.
+Once a File has been imported, the first export of all of its Dataset's Columns in each format is kept,
+and later requests for it are served from the kept copy until the File is reimported
+(or the copy is deleted to make room for others).
+
+Responses have an ETag that changes when the Columns' values do, so clients can revalidate copies
+with If-None-Match. Byte ranges of kept exports can be requested with Range (and If-Range),
+for example to resume a download.
+
+Query parameters:
+- `columns`: comma-separated ids of the Columns to include, in order (default: all of the Dataset's Columns)
+- `min`: first sample to include
+- `max`: maximum number of samples to include
+        """
     )
 )
 class DatasetViewSet(viewsets.ModelViewSet):
@@ -857,6 +984,61 @@ class DatasetViewSet(viewsets.ModelViewSet):
 
         return Dataset.objects.filter(file__in=files).order_by('-date', '-id')
 
+    @action(
+        detail=True,
+        methods=['GET'],
+        renderer_classes=DATASET_EXPORT_RENDERERS,
+        content_negotiation_class=StreamingContentNegotiation
+    )
+    def export(self, request, pk: int = None):
+        try:
+            dataset = self.get_queryset().get(id=pk)
+            self.check_object_permissions(self.request, dataset)
+        except Dataset.DoesNotExist:
+            return error_response('Requested dataset not found', 404)
+        columns = DataColumn.objects.filter(dataset=dataset).order_by('id')
+        try:
+            if 'columns' in request.query_params:
+                ids = [int(i) for i in request.query_params['columns'].split(',')]
+                columns_by_id = columns.in_bulk(ids)
+                if len(columns_by_id) != len(set(ids)):
+                    return error_response('columns must be the ids of Columns in this Dataset')
+                columns = [columns_by_id[i] for i in ids]
+            start = int(request.query_params.get('min', 0))
+            count = int(request.query_params['max']) if 'max' in request.query_params else None
+        except ValueError:
+            return error_response('columns must be a comma-separated list of integers, and min and max integers')
+        if start < 0 or (count is not None and count < 0):
+            return error_response('min and max must not be negative')
+        columns = list(columns)
+        total = max([count_values(c) for c in columns], default=0)
+        stop = total if count is None else min(start + count, total)
+        renderer = request.accepted_renderer
+        version = get_export_version(columns)
+        etag = make_etag('export', dataset.id, version, renderer.format, start, stop)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+
+        def stream():
+            return renderer.stream(iter_export_batches(columns, start, stop), get_export_schema(columns))
+
+        # Whole Columns of imported Files only change on reimport, so exports of all of them are kept
+        path = None
+        if start == 0 and count is None and dataset.file.state == FileState.IMPORTED and \
+                [c.id for c in columns] == list(dataset.columns.order_by('id').values_list('id', flat=True)):
+            path = get_export_path(dataset, version, renderer.format)
+        # Parts of an export can only be sent from its kept file,
+        # so Range requests are sent the whole export, which is kept as it is sent
+        if path is not None and export_exists(path):
+            response = export_file_response(request, renderer, path, etag)
+        else:
+            response = streaming_response(renderer, stream() if path is None else write_export(path, stream()))
+            response['Accept-Ranges'] = 'none'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="dataset-{dataset.id}.{renderer.format}"'
+        return response
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -1158,7 +1340,31 @@ View the TimeseriesData contents of the Column.
 
 Data are presented as a stream of values separated by newlines.
 
-Can be filtered with querystring parameters `min` and `max`, and `mod` (modulo) by specifying a sample number.
+Can be filtered with querystring parameters `min` (the first sample to include), `max` (the number of samples
+from `min` to include), and `mod` (include only every `mod`th sample).
+Only the requested samples are read from the database.
+
+Values are sent as text unless another format is requested with the Accept header, or the `format` parameter:
+- `application/octet-stream` (`format=bin`): a raw little-endian buffer of the type in the `X-Galv-Dtype` header
+- `application/x-npy` (`format=npy`): a NumPy .npy file
+- `application/vnd.apache.arrow.stream` (`format=arrow`): an Apache Arrow IPC stream
+
+Binary formats are available for numeric Columns.
+Floats are sent as float64 and integers as int64; missing integers are sent as the smallest int64.
+
+Numeric Columns can be reduced to about `points` samples for charting, which keeps their peaks and troughs,
+unlike `mod`. The `method` may be
+- `minmax` (default): the lowest and highest values in each of `points`/2 equal ranges of x
+- `lttb`: Largest-Triangle-Three-Buckets
+where x is the Column with the id given in `x`, from the same Dataset, or else the sample number.
+The response then has two columns, x and the Column's values, both as float64:
+tab-separated in text, and as the columns of a 2D array in binary formats.
+Once a File has been imported, points keyed on the sample number are selected from the extremes in
+a precomputed downsample pyramid, so long Columns are not read in full.
+
+Responses have an ETag that changes when the Column's values do, so clients can revalidate copies
+with If-None-Match. Byte ranges of the `bin` and `npy` formats can be requested with Range (and If-Range),
+for example to resume a download.
         """
     )
 )
@@ -1181,30 +1387,91 @@ class DataColumnViewSet(viewsets.ReadOnlyModelViewSet):
             files = {*files, *get_files_from_path(path)}
         return DataColumn.objects.filter(dataset__file__in=files).order_by('-dataset_id', '-id')
 
-    @action(methods=['GET'], detail=True)
+    @action(
+        methods=['GET'],
+        detail=True,
+        renderer_classes=COLUMN_VALUES_RENDERERS,
+        content_negotiation_class=StreamingContentNegotiation
+    )
     def values(self, request, pk: int = None):
         """
         Fetch the data for this column in an 'observations' dictionary of record_id: observed_value pairs.
         """
         column = get_object_or_404(DataColumn, id=pk)
         self.check_object_permissions(self.request, column)
-        handlers = [TimeseriesDataFloat, TimeseriesDataInt, TimeseriesDataStr]
-        for handler in handlers:
-            if handler.objects.filter(column=column).exists():
-                values = handler.objects.get(column=column).values
-                # Handle querystring parameters
-                if 'min' in request.query_params:
-                    values = values[int(request.query_params['min']):]
-                if 'max' in request.query_params:
-                    values = values[:int(request.query_params['max'])]
-                if 'mod' in request.query_params:
-                    values = values[::int(request.query_params['mod'])]
-
-                def stream():
-                    for v in values:
-                        yield v
-                        yield '\n'.encode('utf-8')
-                return StreamingHttpResponse(stream())
+        if has_values(column):
+            renderer = request.accepted_renderer
+            dtype = get_column_dtype(column.data_type)
+            if renderer.binary and dtype is None:
+                return error_response(f'Values of {column.data_type} Columns are only available as text', 406)
+            # Handle querystring parameters
+            try:
+                start = int(request.query_params.get('min', 0))
+                count = int(request.query_params['max']) if 'max' in request.query_params else None
+                step = int(request.query_params.get('mod', 1))
+                points = int(request.query_params['points']) if 'points' in request.query_params else None
+            except ValueError:
+                return error_response('min, max, mod, and points must be integers')
+            if start < 0 or (count is not None and count < 0) or step < 1:
+                return error_response('min and max must not be negative, and mod must be positive')
+            # Values appended while the response is sent are left out, so that its length is known in advance
+            total = count_values(column)
+            stop = total if count is None else min(start + count, total)
+            if points is None:
+                etag = make_etag('values', column.id, get_values_version(column), renderer.format, start, stop, step)
+                response = not_modified(request, etag)
+                if response is not None:
+                    return response
+
+                def read_rows(first: int, last: int):
+                    if last <= first:
+                        return []
+                    return iter_values(column, start + first * step, start + (last - 1) * step + 1, step)
+
+                return stream_values_response(
+                    request,
+                    renderer,
+                    etag,
+                    read_rows,
+                    dtype,
+                    len(range(start, stop, step)),
+                    [column.name]
+                )
+
+            if dtype is None:
+                return error_response(f'Values of {column.data_type} Columns cannot be decimated')
+            if not 2 <= points <= MAX_DECIMATION_POINTS or step != 1:
+                return error_response(
+                    f'points must be between 2 and {MAX_DECIMATION_POINTS}, and cannot be used with mod'
+                )
+            method = request.query_params.get('method', 'minmax')
+            if method not in DECIMATION_METHODS:
+                return error_response(f"method must be one of {', '.join(DECIMATION_METHODS.keys())}")
+            x_column = None
+            if 'x' in request.query_params:
+                try:
+                    x_column = DataColumn.objects.get(id=int(request.query_params['x']), dataset=column.dataset)
+                except (ValueError, DataColumn.DoesNotExist):
+                    return error_response('x must be the id of a Column in the same Dataset')
+                if get_column_dtype(x_column.data_type) is None:
+                    return error_response(f'Values of {x_column.data_type} Columns cannot be used as x')
+            etag = make_etag(
+                'values', column.id, get_values_version(column), renderer.format, start, stop, points, method,
+                x_column.id if x_column else None, get_values_version(x_column) if x_column else None
+            )
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+            rows = decimate_column(column, x_column, start, stop, points, method)
+            return stream_values_response(
+                request,
+                renderer,
+                etag,
+                lambda first, last: [rows[first:last]],
+                np.dtype('<f8'),
+                len(rows),
+                [x_column.name if x_column else 'sample', column.name]
+            )
         return error_response('No data found for this column.', 404)
 
 
@@ -39,6 +39,8 @@ python manage.py loaddata galv/fixtures/DataColumnType.json
 >&2 echo "Initialisation complete - starting server"
 
 if [ -z "${DJANGO_TEST}" ]; then
+  >&2 echo "Starting ingest worker"
+  python manage.py ingest_worker &
   if [ "${DJANGO_SETTINGS}" = "dev" ]; then
     >&2 echo "Launching dev server"
     python manage.py runserver 0.0.0.0:80
@@ -20,13 +20,11 @@ export default function GetDatasetMatlab({dataset}) {
 % 2022-11-21
 %
 % Download datasets from the REST API.
-% Downloads all data for all columns for the dataset and reads them
+% Downloads all data for all columns for the dataset as CSV and reads them
 % into a cell array. Data are under datasets{x} as Tables.
-% Column names are coerced to valid MATLAB variable names using
-% matlab.lang.makeValidName.
+% Column names are coerced to valid MATLAB variable names by readtable.
 %
-% Dataset and column metadata are under dataset_metadata{x} and 
-% column_metadata{x} respectively.
+% Dataset metadata are under dataset_metadata{x}.
 %
 % SPDX-License-Identifier: BSD-2-Clause
 % Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
@@ -46,7 +44,6 @@ dataset_ids = [${dataset.id}]; % add additional dataset ids here if required
 %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 n = max(dataset_ids);
 dataset_metadata = cell(n, 1);
-column_metadata = cell(n, 1);
 datasets = cell(n, 1);
 
 dataset_ids = unique(dataset_ids);
@@ -54,26 +51,16 @@ dataset_ids = unique(dataset_ids);
 for i = 1:length(dataset_ids)
     d = dataset_ids(i);
     
-    % get data
+    % get metadata
     dsURL = strcat(apiURL, '/', num2str(d), '/');
     meta = webread(dsURL, options);
     dataset_metadata{d} = meta;
     
-    column_metadata{i} = cell(length(meta.columns), 1);
-    datasets{i} = table();
-    
-    % append column data in columns
-    for c = 1:length(meta.columns)
-        cURL = meta.columns{c};
-        stream = webread(cURL, options);
-        column_metadata{i}{c} = stream;
-        column_content = webread(stream.values, options);
-        % drop final newline
-        column_content = regexprep(column_content, '\n$', '');
-        column_content = strsplit(column_content, '\n');
-        column_content = arrayfun(@(c) str2num(c{1}), column_content);
-        datasets{i}.(matlab.lang.makeValidName(stream.name)) = rot90(column_content, -1);        
-    end
+    % get data for all columns at once;
+    % add e.g. &columns=1,2 to get only some columns, or &min=0&max=1000 for some rows
+    csvFile = websave(strcat(tempname, '.csv'), strcat(dsURL, 'export/?format=csv'), options);
+    datasets{d} = readtable(csvFile);
+    delete(csvFile);
 end
 `
 
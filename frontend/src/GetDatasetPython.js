@@ -20,7 +20,7 @@ export default function GetDatasetPython({dataset}) {
         Promise.all(dataset.columns.map(column =>
             Connection.fetch(column)
                 .then(r => r.content)
-                .then(col => `      '${col.name}': ${col.id},`)
+                .then(col => `#   ${col.id}: ${col.name}`)
         ))
             .then(cols => setColumns(cols.join('\n')))
     }, [dataset])
@@ -38,12 +38,17 @@ export default function GetDatasetPython({dataset}) {
 # By Matt Jaquiery <matt.jaquiery@dtc.ox.ac.uk>
 
 # Download datasets from the REST API.
-# Downloads all data for all columns for the dataset and reads them
-# into a Dict object. Data are under datasets[x] as DataFrames.
+# Downloads all data for all columns for the dataset in a single
+# Parquet file, and reads them into a Dict object.
+# Data are under datasets[x] as DataFrames.
 #
-# Dataset and column metadata are under dataset_metadata[x] and 
-# column_metadata[x] respectively.
+# Dataset metadata are under dataset_metadata[x].
+# Columns in the dataset are:
+${columns}
 
+import io
+import time
+import pandas  # install via pip if not available; reading Parquet also needs pyarrow
 import urllib3  # install via pip if not available
 
 host = "${host}"
@@ -51,13 +56,10 @@ headers = {'Authorization': 'Bearer ${token}'}
 
 # Configuration
 verbose = True
-if verbose:
-    import time
 
 # Add additional dataset ids to download additional datasets
 dataset_ids = [${dataset.id}]
 dataset_metadata = {}  # Will have keys=dataset_id, values=Dict of dataset metadata
-column_metadata = {}  # Will have keys=dataset_id, values=Dict of column metadata
 datasets = {}  # Will have keys=dataset_id, values=pandas DataFrame of data
 
 # Download data
@@ -78,40 +80,15 @@ for dataset_id in dataset_ids:
     if r.status != 200:
         print(f"Error downloading dataset {dataset_id}: {r.status}")
         continue
-    columns = json.get('columns', [])
-    json['columns'] = []
-
     dataset_metadata[dataset_id] = json
 
-    if verbose:
-        print(f"Dataset {dataset_id} has {len(columns)} columns to download")
-    # Download the data from all columns in the dataset
-    datasets[dataset_id] = pandas.DataFrame()
-    for i, column in enumerate(columns):
-        if verbose:
-            print(f"Downloading dataset {dataset_id} column {i}")
-        r = urllib3.request('GET', column, headers=headers)
-        try:
-            json = r.json()
-        except:
-            print(f"Non-JSON response while downloading from {column}: {r.status}")
-            continue
-        if r.status != 200:
-            print(f"Error downloading column {dataset_id}: {r.status}")
-            continue
-
-        # Download the data from all rows in the column
-        v = urllib3.request('GET', json.get('values'), headers=headers)
-        if v.status != 200:
-            print(f"Error downloading values for dataset {dataset_id} column {json.get('name')}: {v.status}")
-            continue
-        try:
-            datasets[dataset_id][json.get('name')] = v.data.decode('utf-8').split('\\n')
-        except:
-            print(f"Cannot translate JSON response into DataFrame for column values {json.get['values']}")
-            continue
-
-        column_metadata[dataset_id] = json
+    # Download the data from all columns in the dataset at once.
+    # Add e.g. &columns=1,2 to download only some columns, or &min=0&max=1000 for some rows.
+    r = urllib3.request('GET', f"{host}/datasets/{dataset_id}/export/?format=parquet", headers=headers)
+    if r.status != 200:
+        print(f"Error downloading data for dataset {dataset_id}: {r.status}")
+        continue
+    datasets[dataset_id] = pandas.read_parquet(io.BytesIO(r.data))
 
     if verbose:
         print(f"Finished downloading dataset {dataset_id} in {time.time() - dataset_start_time} seconds")
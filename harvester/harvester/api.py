@@ -4,20 +4,104 @@
 
 import os
 import json
+import logging
 from .utils import NpEncoder
+from .encoding import MEDIA_TYPE, binary_upload_accepted, encode_report, get_upload_content_encoding, compress
 import requests
-from .settings import get_setting, get_settings, get_settings_file, get_logger, update_envvars
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .settings import (
+    get_setting, get_settings, get_settings_file, get_logger, update_envvars, settings_store, get_env_setting
+)
 import time
 
 logger = get_logger(__file__)
 
 
+class HarvesterRetry(Retry):
+    """
+    Retry idempotent requests on server errors, and other requests only when
+    the server cannot have processed them.
+
+    Repeating a POST that the server has processed would upload data twice,
+    so POSTs are only retried on connection errors and the status codes below.
+    """
+    UNPROCESSED_STATUS_CODES = frozenset([429, 502, 503])
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method.upper() == 'POST' and status_code in self.UNPROCESSED_STATUS_CODES:
+            return self.total is None or self.total > 0
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+_session = None
+_session_config = None
+
+
+def get_session() -> requests.Session:
+    """
+    Return a Session shared by all API calls, so that connections to the server are kept alive and reused.
+
+    The Session is replaced if the retry settings are changed.
+    """
+    global _session, _session_config
+    config = (
+        get_env_setting('HARVESTER_HTTP_RETRIES', 5),
+        get_env_setting('HARVESTER_HTTP_BACKOFF_SECONDS', 0.5),
+    )
+    if _session is None or config != _session_config:
+        retries, backoff = config
+        retry = HarvesterRetry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=[500, 502, 503, 504],
+            respect_retry_after_header=True,
+            # Return the last response rather than raising once retries run out
+            raise_on_status=False,
+        )
+        session = requests.Session()
+        session.mount('http://', HTTPAdapter(max_retries=retry))
+        session.mount('https://', HTTPAdapter(max_retries=retry))
+        if _session is not None:
+            _session.close()
+        _session, _session_config = session, config
+    return _session
+
+
+def _reset_session():
+    global _session, _session_config
+    _session, _session_config = None, None
+
+
+# Sockets cannot be shared with forked import processes, so they make their own Session
+os.register_at_fork(after_in_child=_reset_session)
+
+
+def api_request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Make a request to the server using the shared Session, with connect and read timeouts
+    """
+    kwargs.setdefault('timeout', (
+        get_env_setting('HARVESTER_HTTP_CONNECT_TIMEOUT', 10.0),
+        get_env_setting('HARVESTER_HTTP_READ_TIMEOUT', 300.0),
+    ))
+    return get_session().request(method, url, **kwargs)
+
+
 def report_harvest_result(
         path: os.PathLike|str,
         monitored_path_id: int,
         content=None,
-        error: BaseException = None
+        error: BaseException = None,
+        upload_stats: dict = None
 ):
+    """
+    Send a report to the server.
+
+    Reports carrying data are compressed if the server accepts compressed reports.
+    If upload_stats is given, the sizes of the report before and after compression are
+    stored in it under 'raw_bytes' and 'sent_bytes'.
+    """
     start = time.time()
     try:
         if error is not None:
@@ -26,15 +110,28 @@ def report_harvest_result(
             data = {'status': 'success', 'content': content}
         data['path'] = path
         data['monitored_path_id'] = monitored_path_id
-        logger.debug(f"{get_setting('url')}report/; {json.dumps(data, cls=NpEncoder)}")
-        out = requests.post(
-            f"{get_setting('url')}report/",
-            headers={
-                'Authorization': f"Harvester {get_setting('api_key')}"
-            },
-            # encode then decode to ensure np values are converted to standard types
-            json=json.loads(json.dumps(data, cls=NpEncoder))
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"{get_setting('url')}report/; {json.dumps(data, cls=NpEncoder)}")
+        if isinstance(content, dict) and content.get('data') and binary_upload_accepted():
+            body = encode_report(data)
+            content_type = MEDIA_TYPE
+        else:
+            # NpEncoder converts np values to standard types
+            body = json.dumps(data, cls=NpEncoder).encode('utf-8')
+            content_type = 'application/json'
+        headers = {
+            'Authorization': f"Harvester {get_setting('api_key')}",
+            'Content-Type': content_type
+        }
+        raw_bytes = len(body)
+        content_encoding = get_upload_content_encoding()
+        if isinstance(content, dict) and content.get('data') and content_encoding is not None:
+            body = compress(body, content_encoding)
+            headers['Content-Encoding'] = content_encoding
+        if upload_stats is not None:
+            upload_stats['raw_bytes'] = raw_bytes
+            upload_stats['sent_bytes'] = len(body)
+        out = api_request('POST', f"{get_setting('url')}report/", headers=headers, data=body)
         try:
             out.json()
         except json.JSONDecodeError:
@@ -55,7 +152,7 @@ def update_config():
     try:
         url = get_setting('url')
         key = get_setting('api_key')
-        result = requests.get(f"{url}config/", headers={'Authorization': f"Harvester {key}"})
+        result = api_request('GET', f"{url}config/", headers={'Authorization': f"Harvester {key}"})
         if result.status_code == 200:
             dirty = False
             new = result.json()
@@ -85,6 +182,7 @@ def update_config():
             if dirty:
                 with open(get_settings_file(), 'w+') as f:
                     json.dump(result.json(), f)
+                settings_store.invalidate()
                 update_envvars()
         else:
             logger.error(f"Unable to fetch {url}config/ -- received HTTP {result.status_code}")
@@ -0,0 +1,78 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+import os
+import sqlite3
+import time
+
+from .settings import get_cache_file, get_logger
+
+logger = get_logger(__file__)
+
+
+class FileCache:
+    """
+        A local record of what the harvester last learned about each file it has seen.
+
+        Files whose size and modification time are unchanged since they were cached
+        do not need to be checked again.
+    """
+
+    def __init__(self, path: os.PathLike | str = None):
+        self.path = path or get_cache_file()
+        try:
+            self.connection = sqlite3.connect(self.path)
+        except sqlite3.Error as e:
+            logger.error(f"Cannot open cache file {self.path}, files will be checked every cycle: {e}")
+            self.connection = sqlite3.connect(":memory:")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, "
+            "format TEXT, "
+            "state TEXT, "
+            "checked REAL NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+
+    def get(self, path: str, stat: os.stat_result) -> dict | None:
+        """
+            Return the cached record for a file, or None if there is none or the file has changed
+        """
+        row = self.connection.execute(
+            "SELECT format, state, checked FROM files WHERE path = ? AND size = ? AND mtime = ?",
+            (path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'format': row[0], 'state': row[1], 'checked': row[2]}
+
+    def set(self, path: str, stat: os.stat_result, format: str | None, state: str | None = None):
+        """
+            Record a file's detected format and last known server state.
+
+            Changes are saved when commit is called.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime, format, state, checked) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, format, state, time.time())
+        )
+
+    def set_state(self, path: str, state: str):
+        """
+            Record the server state of a cached file
+        """
+        self.connection.execute(
+            "UPDATE files SET state = ?, checked = ? WHERE path = ?",
+            (state, time.time(), path)
+        )
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: BSD-2-Clause
+# Copyright  (c) 2020-2023, The Chancellor, Masters and Scholars of the University
+# of Oxford, and the 'Galv' Developers. All rights reserved.
+
+"""
+Binary encoding of reports that carry columns of data.
+
+An encoded report is made up of
+    MAGIC
+    the length of the header in bytes, as a little-endian uint32
+    the header: the report as UTF-8 JSON, in which the values of each numeric
+        column in content['data'] are replaced by 'values_dtype' and 'values_length'
+    the values of each of those columns in turn, as little-endian bytes
+
+Columns of strings are left in the header as JSON lists.
+"""
+
+import gzip
+import json
+import struct
+import numpy as np
+import zstandard
+
+from .settings import get_setting
+from .utils import NpEncoder
+
+MEDIA_TYPE = 'application/x-galv-columns'
+MAGIC = b'GALVCOL1'
+
+
+# Content-Encodings the harvester can compress reports with, in order of preference
+COMPRESSORS = {
+    'zstd': lambda body: zstandard.ZstdCompressor(level=3).compress(body),
+    'gzip': lambda body: gzip.compress(body, compresslevel=6),
+}
+
+
+def get_upload_content_encoding() -> str | None:
+    """
+        Return the preferred compression that the server accepts for reports, or None if it accepts none
+    """
+    accepted = get_setting('upload_content_encodings') or []
+    for encoding in COMPRESSORS.keys():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    return COMPRESSORS[encoding](body)
+
+
+def binary_upload_accepted() -> bool:
+    """
+        Whether the server has said that it accepts binary reports
+    """
+    return MEDIA_TYPE in (get_setting('upload_media_types') or [])
+
+
+def is_binary_encodable(values) -> bool:
+    return isinstance(values, np.ndarray) and values.dtype.kind in 'iuf'
+
+
+def estimate_binary_size(values: np.ndarray) -> int:
+    """
+        Return the number of bytes each value in an array occupies in a binary report
+    """
+    return values.dtype.itemsize
+
+
+def encode_report(data: dict) -> bytes:
+    """
+        Encode a report as a header followed by the values of its numeric columns
+    """
+    buffers = []
+    columns = []
+    for column in data.get('content', {}).get('data', []):
+        values = column.get('values')
+        if is_binary_encodable(values):
+            values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+            column = {k: v for k, v in column.items() if k != 'values'}
+            column['values_dtype'] = values.dtype.str
+            column['values_length'] = len(values)
+            buffers.append(np.ascontiguousarray(values).tobytes())
+        columns.append(column)
+    if 'content' in data and 'data' in data['content']:
+        data = {**data, 'content': {**data['content'], 'data': columns}}
+    header = json.dumps(data, cls=NpEncoder).encode('utf-8')
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header, *buffers])
@@ -3,12 +3,16 @@
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
 import datetime
+import itertools
 import os
+import queue
+import threading
 import time
-import sys
 import json
+import numpy as np
 
-from .utils import NpEncoder
+from .utils import NpEncoder, get_data_type
+from .encoding import binary_upload_accepted, is_binary_encodable, estimate_binary_size
 
 from .parse.exceptions import UnsupportedFileTypeError
 from .parse.ivium_input_file import IviumInputFile
@@ -19,7 +23,7 @@ from .parse.maccor_input_file import (
     MaccorRawInputFile,
 )
 
-from .settings import get_logger, get_setting, get_standard_units, get_standard_columns
+from .settings import get_logger, get_setting, get_standard_units, get_standard_columns, get_env_setting
 from .api import report_harvest_result
 
 logger = get_logger(__file__)
@@ -50,11 +54,30 @@ def serialize_datetime(v):
     return v
 
 
+def estimate_json_size(values: np.ndarray, sample_size: int = 100) -> float:
+    """
+    Estimate the number of bytes each value in an array occupies once serialized to JSON
+    """
+    if not len(values):
+        return 0
+    sample = values[::max(1, len(values) // sample_size)]
+    return len(json.dumps(sample, cls=NpEncoder)) / len(sample)
+
+
+def get_input_file_classes(file_path: str) -> list:
+    """
+        Get the registered parsers whose cheap signature check matches the given file.
+
+        Raises OSError if the file cannot be read, e.g. while it is locked by the software writing it.
+    """
+    return [input_file_cls for input_file_cls in registered_input_files if input_file_cls.sniff(file_path)]
+
+
 def get_import_file_handler(file_path: str):
     """
-        Get the handler for the given file by iterating through parsers until one hits
+        Get the handler for the given file by iterating through matching parsers until one hits
     """
-    for input_file_cls in registered_input_files:
+    for input_file_cls in get_input_file_classes(file_path):
         try:
             logger.debug('Tried input reader {}'.format(input_file_cls))
             input_file = input_file_cls(
@@ -91,9 +114,78 @@ def import_file(path: str, monitored_path: dict) -> bool:
         # corresponding data since the import might fail while reading the data
         # anyway
         input_file = get_import_file_handler(file_path=path)
+        core_metadata, extra_metadata = input_file.metadata, input_file.column_info
+        mapping = input_file.get_file_column_to_standard_column_mapping()
+        max_size = max_upload_size
+        binary_upload = binary_upload_accepted()
+
+        def estimate_size(values: np.ndarray) -> float:
+            if binary_upload and is_binary_encodable(values):
+                return estimate_binary_size(values)
+            return estimate_json_size(values)
+
+        # max_upload_bytes limits the compressed size of each upload.
+        # Chunks are sized by assuming that they compress no better than the least
+        # compressible chunk so far did, with a margin in case the data change.
+        # Until a chunk has been compressed, assume compression does not help.
+        compression = {'ratio': None}
+
+        def get_chunk_size_limit() -> float:
+            return max_size / (compression['ratio'] or 1.0)
+
+        # Find out if there's a Sample number column, otherwise we use the row number
+        record_number_column = [
+            k for k, v in mapping.items()
+            if v == default_column_ids['Sample Number'] and input_file.column_info.get(k, {}).get('has_data')
+        ]
+        if len(record_number_column):
+            record_number_column = record_number_column[0]
+            column_data = {}
+        else:
+            record_number_column = None
+            column_data = {"Sample Number": {
+                "column_id": default_column_ids["Sample Number"],
+                "official_sample_counter": True,
+                "data_type": "int"
+            }}
+        sample_number_column = record_number_column or "Sample Number"
+
+        def describe_column(k: str, values: np.ndarray) -> bool:
+            """
+                Describe a column for the server, using its values to determine its type
+            """
+            column_data[k] = {}
+            if k in mapping:
+                column_data[k]['column_id'] = mapping[k]
+            else:
+                column_data[k]['column_name'] = k
+                if 'unit' in input_file.column_info[k]:
+                    column_data[k]['unit_symbol'] = input_file.column_info[k].get('unit')
+                else:
+                    column_data[k]['unit_id'] = default_units['Unitless']
+            column_data[k]['data_type'] = get_data_type(values)
+            if k == record_number_column:
+                sample_counters = [k for k, v in column_data.items() if v.get('official_sample_counter')]
+                if len(sample_counters) > 0:
+                    logger.error(f"Cannot set more than one official_sample_counter column ({[*sample_counters, k]})")
+                    return False
+                column_data[k]['official_sample_counter'] = True
+            return True
+
+        # TODO: is this actually determined correctly? Seems there are actually lots of data columns we miss??
+        # Anyway, leaving this as instructed because everyone's happy with it as is.
+        columns_with_data = [c for c in input_file.column_info.keys() if input_file.column_info[c].get('has_data')]
+        # The first block of data shows the type of each column,
+        # so that the server can set up every column when the import begins
+        blocks = input_file.load_columns(columns_with_data)
+        first_block = next(blocks, None)
+        if first_block is not None:
+            blocks = itertools.chain([first_block], blocks)
+            for k, v in first_block.items():
+                if k not in column_data and not describe_column(k, v):
+                    return False
 
         # Send metadata
-        core_metadata, extra_metadata = input_file.load_metadata()
         report = report_harvest_result(
             path=path,
             monitored_path_id=monitored_path_id,
@@ -102,7 +194,8 @@ def import_file(path: str, monitored_path: dict) -> bool:
                 'status': 'begin',
                 'core_metadata': serialize_datetime(core_metadata),
                 'extra_metadata': serialize_datetime(extra_metadata),
-                'test_date': serialize_datetime(core_metadata['Date of Test'])
+                'test_date': serialize_datetime(core_metadata['Date of Test']),
+                'columns': list(column_data.values())
             }
         )
         if report is None:
@@ -116,129 +209,159 @@ def import_file(path: str, monitored_path: dict) -> bool:
             return False
         upload_info = report.json()['upload_info']
         last_uploaded_record = upload_info.get('last_record_number')
-        columns = upload_info.get('columns')
-
-        # Figure out column data
-        if len(columns):
-            mapping = {c.get('name'): c.get('id') for c in columns}
-        else:
-            mapping = input_file.get_file_column_to_standard_column_mapping()
-        # limit size of requests. 1kb/column is an arbitrary buffer size.
-        size = 0
-        max_size = max_upload_size
-        nth_part = 0
-        start_row = last_uploaded_record if last_uploaded_record is not None else 0
-        # Find out if there's a Sample number column, otherwise we use the row number
-        record_number_column = [k for k, v in mapping.items() if v == default_column_ids['Sample Number']]
-        if len(record_number_column):
-            record_number_column = record_number_column[0]
-            column_data = {}
+        # Servers that support upload sessions resolve the columns up front,
+        # and uploads then refer to each column by its id
+        upload_session = upload_info.get('upload_session')
+        if upload_session is not None:
+            column_ids = {k: c['id'] for k, c in zip(column_data.keys(), upload_session['columns'])}
+            upload_session_id = upload_session['id']
         else:
-            record_number_column = None
-            column_data = {"Sample Number": {
-                "column_id": default_column_ids["Sample Number"],
-                "official_sample_counter": True,
-                "values": []
-            }}
+            column_ids = {}
+            upload_session_id = None
 
-        # TODO: is this actually determined correctly? Seems there are actually lots of data columns we miss??
-        # Anyway, leaving this as instructed because everyone's happy with it as is.
-        columns_with_data = [c for c in input_file.column_info.keys() if input_file.column_info[c].get('has_data')]
-        generator = input_file.load_data(input_file.file_path, columns_with_data)
-        start = time.process_time()
-        new_row = {}
-        for i, r in enumerate(generator):
-            if start_row > 0 and int(r.get(record_number_column, i)) <= start_row:
-                continue
-            # Data are stored up in rows and shipped out when
-            # adding the current row would exceed the server data
-            # size limit.
-            # If sent, sent data are wiped from column_data.
-            # New row data are added to column_data below.
-            size += sys.getsizeof(json.dumps(new_row, cls=NpEncoder))
-            if size > max_size:
-                if start_row == i:
-                    logger.error(f"Row too large to upload {len(r.keys())} columns, size={sys.getsizeof(r)}")
-                    return False
-                logger.info(f"Upload part {nth_part} (rows {start_row}-{i - 1}; {size}bytes)")
-                logger.info(f"Read took {time.process_time() - start}")
-                nth_part += 1
-                start_row = i
-                report = report_harvest_result(
-                    path=path,
-                    monitored_path_id=monitored_path_id,
-                    content={
+        def column_upload(k: str, values: np.ndarray) -> dict:
+            if k in column_ids:
+                return {'column': column_ids[k], 'values': values}
+            return {**column_data[k], 'values': values}
+
+        def upload(data: list, **kwargs) -> bool:
+            upload_stats = {}
+            report = report_harvest_result(
+                path=path,
+                monitored_path_id=monitored_path_id,
+                content={
                     'task': 'import',
                     'status': 'in_progress',
-                    'data': [v for v in column_data.values()],
-                    'test_date': serialize_datetime(core_metadata['Date of Test'])
-                })
-                if report is None:
-                    logger.error(f"API Error")
-                    return False
-                if not report.ok:
-                    try:
-                        logger.error(f"API responded with Error: {report.json()['error']}")
-                    except BaseException:
-                        logger.error(f"API Error: {report.status_code}")
+                    'data': data,
+                    **kwargs,
+                    'test_date': serialize_datetime(core_metadata['Date of Test']),
+                    'upload_session': upload_session_id
+                },
+                upload_stats=upload_stats
+            )
+            if upload_stats.get('raw_bytes'):
+                ratio = min(1.0, 1.5 * upload_stats['sent_bytes'] / upload_stats['raw_bytes'])
+                if compression['ratio'] is None or ratio > compression['ratio']:
+                    compression['ratio'] = ratio
+            if report is None:
+                logger.error(f"API Error")
+                return False
+            if not report.ok:
+                try:
+                    logger.error(f"API responded with Error: {report.json()['error']}")
+                except BaseException:
+                    logger.error(f"API Error: {report.status_code}")
+                return False
+            return True
+
+        def read_chunks(send) -> bool:
+            """
+                Read the file into chunks that should be no larger than max_size once compressed,
+                and pass them to send
+            """
+            # Data are read in blocks of column arrays and stored up until adding
+            # more rows would exceed the server data size limit.
+            # Stored rows are then shipped out and wiped from pending.
+            pending = {}
+            pending_rows = 0
+            pending_size = 0
+            rows_read = 0
+            nth_part = 0
+            start = time.process_time()
+            for block in blocks:
+                block_rows = len(next(iter(block.values()), []))
+                if block_rows == 0:
+                    continue
+                if record_number_column is None:
+                    # Make sure we send record numbers to the server
+                    block = {"Sample Number": np.arange(rows_read, rows_read + block_rows), **block}
+                rows_read += block_rows
+                # Skip rows the server already has
+                if last_uploaded_record:
+                    keep = block[sample_number_column].astype(np.int64) > last_uploaded_record
+                    if not keep.any():
+                        continue
+                    block = {k: v[keep] for k, v in block.items()}
+                    block_rows = int(keep.sum())
+
+                for k, v in block.items():
+                    if v.dtype.kind == 'b':
+                        block[k] = v.astype(np.int8)
+                    if k not in column_data and not describe_column(k, block[k]):
+                        return False
+
+                row_size = sum(estimate_size(v) for v in block.values())
+                if row_size > max_size:
+                    logger.error(f"Row too large to upload {len(block.keys())} columns, size={row_size}")
                     return False
-                for k in column_data.keys():
-                    column_data[k]['values'] = []
-                start = time.process_time()
-                size = 0
-
-            if i > 0:
-                for k, v in new_row.items():
-                    column_data[k]['values'].append(v)
-
-            # Make sure we send record numbers to the server
-            new_row = {"Sample Number": i} if record_number_column is None else {}
-
-            for k, v in r.items():
-                if k not in column_data:
-                    column_data[k] = {}
-                    if k in mapping:
-                        column_data[k]['column_id'] = mapping[k]
-                    else:
-                        column_data[k]['column_name'] = k
-                        if 'unit' in input_file.column_info[k]:
-                            column_data[k]['unit_symbol'] = input_file.column_info[k].get('unit')
-                        else:
-                            column_data[k]['unit_id'] = default_units['Unitless']
-                    column_data[k]['values'] = []
-                    if k == record_number_column:
-                        sample_counters = [k for k, v in column_data.items() if v.get('official_sample_counter')]
-                        if len(sample_counters) > 0:
-                            logger.error(f"Cannot set more than one official_sample_counter column ({[*sample_counters, k]})")
+                offset = 0
+                while offset < block_rows:
+                    n = min(int((get_chunk_size_limit() - pending_size) // row_size), block_rows - offset)
+                    if n <= 0:
+                        logger.info(f"Upload part {nth_part} ({pending_rows} rows; {pending_size}bytes)")
+                        logger.info(f"Read took {time.process_time() - start}")
+                        nth_part += 1
+                        if not send([
+                            column_upload(k, np.concatenate(v)) for k, v in pending.items()
+                        ]):
                             return False
-                        column_data[k]['official_sample_counter'] = True
-                new_row[k] = v
+                        pending = {}
+                        pending_rows = 0
+                        pending_size = 0
+                        start = time.process_time()
+                        continue
+                    for k, v in block.items():
+                        pending.setdefault(k, []).append(v[offset:offset + n])
+                    offset += n
+                    pending_rows += n
+                    pending_size += n * row_size
 
-            if i == 1:
-                # Determine data types from first row via json serialization
-                types_row = json.loads(json.dumps(new_row, cls=NpEncoder))
-                for k in column_data.keys():
-                    column_data[k]['data_type'] = type(types_row[k]).__name__
+            return send(
+                [column_upload(k, np.concatenate(v)) for k, v in pending.items()],
+                labels=tuple(input_file.get_data_labels())
+            )
 
-        # Send data
-        report = report_harvest_result(
-            path=path,
-            monitored_path_id=monitored_path_id,
-            content={
-            'task': 'import',
-            'status': 'in_progress',
-            'data': [v for v in column_data.values()],
-            'labels': tuple(input_file.get_data_labels()),
-            'test_date': serialize_datetime(core_metadata['Date of Test'])
-        })
-        if report is None:
-            logger.error(f"API Error")
-            return False
-        if not report.ok:
-            try:
-                logger.error(f"API responded with Error: {report.json()['error']}")
-            except BaseException:
-                logger.error(f"API Error: {report.status_code}")
+        # Chunks are uploaded in order by a separate thread while the following ones are read.
+        # Reading waits when the queue holds as many chunks as allowed.
+        # An exception raised while uploading is raised again here once the uploader has stopped.
+        chunks = queue.Queue(maxsize=max(1, get_env_setting('HARVESTER_UPLOAD_QUEUE_SIZE', 2)))
+        cancelled = threading.Event()
+        upload_errors = []
+
+        def upload_chunks():
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                # Keep taking chunks after a failure so that reading never blocks
+                if cancelled.is_set():
+                    continue
+                data, kwargs = chunk
+                try:
+                    if not upload(data, **kwargs):
+                        cancelled.set()
+                except Exception as e:
+                    upload_errors.append(e)
+                    cancelled.set()
+
+        def send(data: list, **kwargs) -> bool:
+            chunks.put((data, kwargs))
+            return not cancelled.is_set()
+
+        uploader = threading.Thread(target=upload_chunks, name=f"upload {path}", daemon=True)
+        uploader.start()
+        try:
+            if not read_chunks(send):
+                cancelled.set()
+        except BaseException:
+            cancelled.set()
+            raise
+        finally:
+            chunks.put(None)
+            uploader.join()
+        if upload_errors:
+            raise upload_errors[0]
+        if cancelled.is_set():
             return False
 
         logger.info("File successfully imported")
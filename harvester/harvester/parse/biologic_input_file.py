@@ -4,9 +4,10 @@
 
 import os
 import ntpath
+import numpy as np
 from galvani import BioLogic
 from .exceptions import UnsupportedFileTypeError
-from .input_file import InputFile
+from .input_file import InputFile, read_file_head
 
 
 class BiologicMprInputFile(InputFile):
@@ -21,6 +22,11 @@ class BiologicMprInputFile(InputFile):
         super().__init__(file_path, **kwargs)
         self.logger.info("Type is BioLogic")
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        return file_path.endswith(".mpr") and \
+            read_file_head(file_path, len(BioLogic.MPR_MAGIC)) == BioLogic.MPR_MAGIC
+
     def get_file_column_to_standard_column_mapping(self) -> dict:
         """
         Return a dict with a key of the column name in the file that maps to
@@ -51,10 +57,22 @@ class BiologicMprInputFile(InputFile):
                 for col_idx in columns_of_interest
             }
 
+    def load_columns(self, columns, block_size: int = None):
+        """
+            Slice the columns of the MPR structured array into blocks.
+
+            Blocks are views on the array galvani has already read, so no data are copied.
+        """
+        data = self.mpr_file.data
+        block_size = block_size or self.block_size
+        column_names = [name for name in data.dtype.names if name in columns]
+        for start in range(0, len(data), block_size):
+            yield {name: data[name][start:start + block_size] for name in column_names}
+
     def get_data_labels(self):
         modes = self.mpr_file.get_flag('mode')
         Ns_changes = self.mpr_file.get_flag('Ns changes')
-        Ns_index = self.mpr_file.data.dtype.names.index('Ns')
+        Ns = self.mpr_file.data['Ns']
         mode_labels = {
             1: 'CC',
             2: 'CV',
@@ -65,41 +83,43 @@ class BiologicMprInputFile(InputFile):
         column_names = self.mpr_file.data.dtype.names
         time_col = next((i for i, c in enumerate(column_names) if c.startswith("time")), 3)
         cont_col = next((i for i, c in enumerate(column_names) if c.startswith("control")), 4)
+        times = self.mpr_file.data[column_names[time_col]]
+        controls = self.mpr_file.data[column_names[cont_col]]
         prev_time = 0
 
-        for i in range(len(self.mpr_file.data)):
+        # Only rows where Ns changes produce labels, so skip straight to them
+        for i in np.flatnonzero(Ns_changes):
+            i = int(i)
             last_mode = modes[i-1]
-            last_Ns = self.mpr_file.data[i-1][Ns_index]
-            Ns_change = Ns_changes[i]
-            if Ns_change:
-                time = self.mpr_file.data[i][time_col]
-                mode_label = mode_labels.get(last_mode)
-                if mode_label.casefold() == "rest":
-                    experiment_label = "Rest "
-                else:
-                    control = self.mpr_file.data[i - 1][cont_col]
-                    if control > 0:
-                        experiment_label = "Charge "
-                    else:
-                        experiment_label = "Discharge "
-
-                    is_const_curr = mode_label.casefold() == "cc"
-                    experiment_label += f"at {control} {'mA' if is_const_curr else 'V'} "
-                experiment_label += f"for {time - prev_time} seconds"
-
-                if last_mode in mode_labels:
-                    data_label = (
-                        f"Ns_{last_Ns}_{mode_label}", (last_Ns_change, i - 1), experiment_label
-                    )
+            last_Ns = Ns[i-1]
+            time = times[i]
+            mode_label = mode_labels.get(last_mode)
+            if mode_label.casefold() == "rest":
+                experiment_label = "Rest "
+            else:
+                control = controls[i - 1]
+                if control > 0:
+                    experiment_label = "Charge "
                 else:
-                    data_label = (
-                        f"Ns_{last_Ns}", (last_Ns_change, i - 1), experiment_label
-                    )
+                    experiment_label = "Discharge "
+
+                is_const_curr = mode_label.casefold() == "cc"
+                experiment_label += f"at {control} {'mA' if is_const_curr else 'V'} "
+            experiment_label += f"for {time - prev_time} seconds"
+
+            if last_mode in mode_labels:
+                data_label = (
+                    f"Ns_{last_Ns}_{mode_label}", (last_Ns_change, i - 1), experiment_label
+                )
+            else:
+                data_label = (
+                    f"Ns_{last_Ns}", (last_Ns_change, i - 1), experiment_label
+                )
 
-                last_Ns_change = i
-                prev_time = time
+            last_Ns_change = i
+            prev_time = time
 
-                yield data_label
+            yield data_label
 
 
     def load_metadata(self):
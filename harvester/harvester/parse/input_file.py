@@ -4,11 +4,48 @@
 
 from .exceptions import UnsupportedFileTypeError
 import traceback
+import numpy as np
 from ..settings import get_logger
 
 # see https://gist.github.com/jsheedy/ed81cdf18190183b3b7d
 # https://stackoverflow.com/a/30721460
 
+# Data types in order of increasing generality
+NUMPY_DATA_TYPES = {
+    'int': np.int64,
+    'float': np.float64,
+    'str': np.str_,
+}
+
+
+def parse_column(values: list, data_type: str = 'int') -> np.ndarray:
+    """
+        Convert a column of strings to an array of the narrowest type that holds all of them.
+
+        Types are tried in the order of NUMPY_DATA_TYPES, starting from data_type.
+        Blank strings are missing values, so a numeric column with blanks is float, with NaN for the blanks.
+    """
+    data_types = list(NUMPY_DATA_TYPES.keys())
+    for name in data_types[data_types.index(data_type):-1]:
+        try:
+            return np.array(values, dtype=NUMPY_DATA_TYPES[name])
+        except (ValueError, OverflowError):
+            continue
+    if data_type != 'str':
+        try:
+            return np.array([value if value.strip() else 'nan' for value in values], dtype=np.float64)
+        except ValueError:
+            pass
+    return np.array(values, dtype=np.str_)
+
+
+def read_file_head(file_path: str, size: int = 4096) -> bytes:
+    """
+        Return the first size bytes of a file, for checking its signature
+    """
+    with open(file_path, "rb") as f:
+        return f.read(size)
+
 
 class InputFile:
     """
@@ -18,6 +55,8 @@ class InputFile:
         'mA': 1e-3,
         'mA.h': 1e-3
     }
+    # Maximum number of rows in each block yielded by load_columns
+    block_size = 100_000
 
     def __init__(self, file_path, standard_columns: dict, standard_units: dict):
         self.file_path = file_path
@@ -26,6 +65,16 @@ class InputFile:
         self.logger = get_logger(f"InputFile({self.file_path})")
         self.metadata, self.column_info = self.load_metadata()
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        """
+            Cheaply check whether a file looks like it is in this format.
+
+            Only the file name and the first few bytes of the file should be read.
+            Formats that cannot tell without parsing the file return True.
+        """
+        return True
+
     def get_columns(self):
         name_to_type_id = self.get_file_column_to_standard_column_mapping()
 
@@ -130,6 +179,28 @@ class InputFile:
     def load_data(self, file_path, available_desired_columns):
         raise UnsupportedFileTypeError()
 
+    def load_columns(self, columns, block_size: int = None):
+        """
+            Load data as blocks of columns.
+
+            Yields dicts mapping column names to NumPy arrays of up to block_size rows.
+            This implementation gathers the rows yielded by load_data;
+            formats that can read whole columns should override it.
+        """
+        block_size = block_size or self.block_size
+        block = {}
+        rows = 0
+        for row in self.load_data(self.file_path, columns):
+            for name, value in row.items():
+                block.setdefault(name, []).append(value)
+            rows += 1
+            if rows == block_size:
+                yield {name: np.asarray(values) for name, values in block.items()}
+                block = {}
+                rows = 0
+        if rows:
+            yield {name: np.asarray(values) for name, values in block.items()}
+
     def get_data_labels(self):
         raise UnsupportedFileTypeError()
 
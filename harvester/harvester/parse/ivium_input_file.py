@@ -6,7 +6,8 @@ import os
 import ntpath
 import re
 from datetime import datetime
-from .input_file import InputFile
+from itertools import islice
+from .input_file import InputFile, parse_column, read_file_head
 from .exceptions import (
     UnsupportedFileTypeError,
     InvalidDataInFileError,
@@ -25,6 +26,11 @@ class IviumInputFile(InputFile):
         super().__init__(file_path, **kwargs)
         self.logger.info("Type is IVIUM")
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        return file_path.endswith(".idf") and \
+            read_file_head(file_path, len(IDF_HEADER)) == IDF_HEADER
+
     def get_file_column_to_standard_column_mapping(self) -> dict:
         """
             Return a dict with a key of the column name in the file that maps to
@@ -38,19 +44,13 @@ class IviumInputFile(InputFile):
             "test_time": self.standard_columns['Time']
         }
 
-    def load_data(self, file_path, columns):
+    def _read_samples(self, file_path):
         """
-            Load data in a ivium text file"
+            Yield the [test_time, amps, volts] strings of each sample in an ivium text file
         """
-
         with open(file_path, "rb") as f:
             for i in range(self._sample_rows[0]):
                 line = f.readline()
-            columns_of_interest = []
-            column_names = ["test_time", "amps", "volts"]
-            for col_idx, column_name in enumerate(column_names):
-                if column_name in columns:
-                    columns_of_interest.append(col_idx)
 
             current_line = self._sample_rows[0] - 1
             for sample_row in self._sample_rows:
@@ -66,27 +66,55 @@ class IviumInputFile(InputFile):
                             "Incorrect line length on line {} was {} expected {}"
                         ).format(current_line, len(line), 40)
                     )
-                row = [line[:12].strip(), line[13:25].strip(), line[26:].strip()]
-                yield {
-                    column_names[col_idx]: row[col_idx]
-                    for col_idx in columns_of_interest
-                }
+                yield [line[:12].strip(), line[13:25].strip(), line[26:].strip()]
+
+    def load_data(self, file_path, columns):
+        """
+            Load data in a ivium text file"
+        """
+        columns_of_interest = []
+        column_names = ["test_time", "amps", "volts"]
+        for col_idx, column_name in enumerate(column_names):
+            if column_name in columns:
+                columns_of_interest.append(col_idx)
+        for row in self._read_samples(file_path):
+            yield {
+                column_names[col_idx]: float(row[col_idx])
+                for col_idx in columns_of_interest
+            }
+
+    def load_columns(self, columns, block_size: int = None):
+        """
+            Load blocks of float columns from a ivium text file
+        """
+        block_size = block_size or self.block_size
+        column_names = ["test_time", "amps", "volts"]
+        columns_of_interest = [i for i, name in enumerate(column_names) if name in columns]
+        samples = self._read_samples(self.file_path)
+        while True:
+            rows = list(islice(samples, block_size))
+            if not rows:
+                return
+            yield {
+                column_names[col_idx]: parse_column([row[col_idx] for row in rows], 'float')
+                for col_idx in columns_of_interest
+            }
 
     def _get_end_task_function(self, task):
         def duration(row):
-            return row['test_time'] > task['Duration']
+            return row['test_time'] > float(task['Duration'])
 
         def E_greater_than(row):
-            return row['volts'] > task['E>']
+            return row['volts'] > float(task['E>'])
 
         def E_less_than(row):
-            return row['volts'] < task['E<']
+            return row['volts'] < float(task['E<'])
 
         def I_greater_than(row):
-            return row['amps'] > task['I<']
+            return row['amps'] > float(task['I>'])
 
         def I_less_than(row):
-            return row['amps'] < task['I<']
+            return row['amps'] < float(task['I<'])
 
         end_funcs = []
         for end_key in ['End1', 'End2', 'End3', 'End4']:
@@ -292,16 +320,19 @@ class IviumInputFile(InputFile):
             'amps': {
                 'has_data': True,
                 'is_numeric': True,
+                'data_type': 'float',
                 'unit': 'A',
             },
             'volts': {
                 'has_data': True,
                 'is_numeric': True,
+                'data_type': 'float',
                 'unit': 'V',
             },
             'test_time': {
                 'has_data': True,
                 'is_numeric': True,
+                'data_type': 'float',
                 'unit': 's',
             },
         }
@@ -4,18 +4,28 @@
 
 import os
 import csv
+import itertools
 import ntpath
 import re
+import shutil
+import tempfile
+import weakref
 from datetime import datetime
+from itertools import islice
+import numpy as np
 import xlrd
 import maya
-from .input_file import InputFile
+from .input_file import InputFile, parse_column, read_file_head, NUMPY_DATA_TYPES
+from ..utils import get_data_type
 from .exceptions import (
     UnsupportedFileTypeError,
     EmptyFileError,
     InvalidDataInFileError
 )
 
+# Numeric columns whose runs of values are labelled, as well as the non-numeric columns
+LABELLED_NUMERIC_COLUMNS = {"Step", "ES"}
+
 
 class MaccorInputFile(InputFile):
     """
@@ -27,62 +37,103 @@ class MaccorInputFile(InputFile):
         super().__init__(file_path, **kwargs)
         self.logger.info("Type is MACCOR")
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        if not (file_path.endswith(".csv") or file_path.endswith(".txt")):
+            return False
+        line = read_file_head(file_path, 256).decode("ascii", errors="replace")
+        date_regex = r"\d\d\/\d\d\/\d\d\d\d \d?\d:\d\d:\d\d [AP]M"
+        return any(
+            re.match("Today''s Date" + delimiter + date_regex, line)
+            for delimiter in [',', '\t']
+        )
+
     def identify_columns(self, reader):
         """
             Identifies columns in a maccor csv or tsv file"
+
+            This is the only pass over the data rows: the typed blocks of every column
+            are written to a temporary file as they are read, and the files of the
+            columns that have data are kept for load_columns and get_data_labels.
+            Columns that are labelled by their values (see get_data_labels) are also
+            written as the text in the file, so that labels name values as they are written.
         """
         headers = [header for header in next(reader) if header != ""]
-        correct_number_of_columns = len(headers)
-        try:
-            recno_col = headers.index("Rec#")
-        except ValueError:
-            recno_col = -1
         column_has_data = [False for column in headers]
-        row_idx = 1
-        first_data = next(reader)
-        first_data = handle_recno(
-            first_data, correct_number_of_columns, recno_col, row_idx
-        )
-        column_is_numeric = [isfloat(column) for column in first_data]
-        self.logger.debug(column_is_numeric)
-        numeric_columns = []
-        for i in range(0, len(column_is_numeric)):
-            if column_is_numeric[i]:
-                numeric_columns.append(i)
+        column_is_numeric = None
+        data_types = ['int' for column in headers]
+        # The files are deleted along with this object
+        self._block_dir = tempfile.mkdtemp(prefix="galv-maccor-")
+        weakref.finalize(self, shutil.rmtree, self._block_dir, ignore_errors=True)
+        block_paths = [
+            os.path.join(self._block_dir, f"{i}.npy") for i in range(len(headers))
+        ]
+        text_paths = {}
+        text_files = {}
+        total_rows = 0
+        num_blocks = 0
+        first_data = None
+        files = [open(path, "wb") for path in block_paths]
+        try:
+            for block in read_column_blocks(reader, headers, self.block_size):
+                if first_data is None:
+                    first_data = [block[header][0] for header in headers]
+                    column_is_numeric = [isfloat(column) for column in first_data]
+                    self.logger.debug(column_is_numeric)
+                    for i, header in enumerate(headers):
+                        if header in LABELLED_NUMERIC_COLUMNS or not column_is_numeric[i]:
+                            text_paths[header] = os.path.join(self._block_dir, f"{i}.txt.npy")
+                            text_files[header] = open(text_paths[header], "wb")
+                for header, file in text_files.items():
+                    np.save(file, np.array(block[header], dtype=np.str_))
+                for i, header in enumerate(headers):
+                    # Widen the type as far as the whole column requires
+                    values = parse_column(block[header], data_types[i])
+                    data_types[i] = get_data_type(values)
+                    np.save(files[i], values)
+                    if column_has_data[i]:
+                        continue
+                    if not column_is_numeric[i] or data_types[i] == 'str':
+                        # Failed to cast a string to float so it is a value
+                        column_has_data[i] = True
+                    else:
+                        nonzero = np.flatnonzero(values != 0)
+                        if len(nonzero):
+                            column_has_data[i] = True
+                            self.logger.debug(
+                                "Found data in col {} ( {} ) : {} on row {}".format(
+                                    i, header, values[nonzero[0]], total_rows + nonzero[0] + 1
+                                )
+                            )
+                total_rows += len(block[headers[0]])
+                num_blocks += 1
+                last_data = [block[header][-1] for header in headers]
+        finally:
+            for file in [*files, *text_files.values()]:
+                file.close()
+        if first_data is None:
+            raise EmptyFileError()
+
+        # Columns without data are never loaded, so only keep the rest.
+        self._num_blocks = num_blocks
+        self._block_paths = {}
+        self._text_paths = {}
+        for i, header in enumerate(headers):
+            if column_has_data[i] or header == "Cyc#":
+                self._block_paths[header] = (block_paths[i], data_types[i])
             else:
-                column_has_data[i] = True
-        for row_idx, row in enumerate(reader, 1):
-            row = handle_recno(row, correct_number_of_columns, recno_col, row_idx)
-            for col in numeric_columns[:]:
-                data_detected = False
-                is_float = True
-                try:
-                    data_detected = float(row[col]) != 0.0
-                except ValueError:
-                    # Failed to cast a string to float so it is a value
-                    data_detected = True
-                    is_float = False
-                if data_detected:
-                    column_has_data[col] = True
-                    numeric_columns.remove(col)
-                    self.logger.debug(
-                        "Found data in col {} ( {} ) : {}{} on row {}".format(
-                            col,
-                            headers[col],
-                            row[col],
-                            (
-                                (" as float: " + str(float(row[col])))
-                                if is_float
-                                else ""
-                            ),
-                            row_idx,
-                        )
-                    )
+                os.remove(block_paths[i])
+            if header in text_paths:
+                if column_has_data[i]:
+                    self._text_paths[header] = text_paths[header]
+                else:
+                    os.remove(text_paths[header])
 
         column_info = {
             headers[i]: {
                 "has_data": column_has_data[i],
                 "is_numeric": column_is_numeric[i],
+                "data_type": data_types[i],
             }
             for i in range(0, len(headers))
         }
@@ -104,15 +155,14 @@ class MaccorInputFile(InputFile):
             if name in known_units:
                 column_info[name]['unit'] = known_units[name]
 
-        # account for 0 based indexing
-        total_rows = row_idx + 1
-        if recno_col == -1:
+        if "Rec#" not in headers:
             # No Rec# , make up numbers
             first_rec = 1  # Maccor count from 1
             last_rec = total_rows
         else:
+            recno_col = headers.index("Rec#")
             first_rec = int(first_data[recno_col])
-            last_rec = int(row[recno_col])
+            last_rec = int(last_data[recno_col])
         self.logger.debug(column_info)
         self.logger.debug("Num rows {}".format(total_rows))
         return column_info, total_rows, first_rec, last_rec
@@ -168,49 +218,74 @@ class MaccorInputFile(InputFile):
         """
             Load data in a maccor csv or tsv file"
         """
+        for block in self.load_columns(columns):
+            names = list(block.keys())
+            for row in zip(*[block[name].tolist() for name in names]):
+                yield dict(zip(names, row))
 
-        with open(file_path, "r") as csvfile:
-            # get rid of metadata rows
-            csvfile.readline()
-            if self.num_header_rows > 1:
-                csvfile.readline()
+    def load_columns(self, columns, block_size: int = None):
+        """
+            Load typed blocks of columns from a maccor csv or tsv file.
 
-            # remainder is csv format
-            reader = csv.reader(csvfile, delimiter=self.delimiter)
-            columns_of_interest = []
-            column_names = [header for header in next(reader) if header != ""]
-            correct_number_of_columns = len(column_names)
-            try:
-                recno_col = column_names.index("Rec#")
-            except ValueError:
-                recno_col = -1
-            for col_idx, column_name in enumerate(column_names):
-                if column_name in columns:
-                    columns_of_interest.append(col_idx)
-            for row_idx, row in enumerate(reader):
-                row = handle_recno(
-                    row, correct_number_of_columns, recno_col, row_idx
-                )
-                yield {
-                    column_names[col_idx]: row[col_idx]
-                    for col_idx in columns_of_interest
-                }
+            The blocks are read back from the files written by identify_columns,
+            so only columns with data (and Cyc#) are available.
+        """
+        block_size = block_size or self.block_size
+        names = [name for name in self._block_paths.keys() if name in columns]
+        blocks = (
+            dict(zip(names, values))
+            for values in zip(*[self.read_column_blocks(name) for name in names])
+        )
+        if block_size != self.block_size:
+            blocks = resize_blocks(blocks, block_size)
+        yield from blocks
+
+    def read_column_blocks(self, name: str):
+        """
+            Yield the blocks of a column written by identify_columns.
+            Blocks read before the column's type was widened are cast to its final type.
+        """
+        path, data_type = self._block_paths[name]
+        with open(path, "rb") as file:
+            for _ in range(self._num_blocks):
+                values = np.load(file)
+                if data_type == 'str' and values.dtype.kind == 'f':
+                    # Blank cells read as missing numbers are blank again
+                    yield np.where(np.isnan(values), '', values.astype(np.str_))
+                else:
+                    yield values.astype(NUMPY_DATA_TYPES[data_type], copy=False)
+
+    def read_text_blocks(self, name: str):
+        """
+            Yield the blocks of a labelled column as the text written in the file
+        """
+        with open(self._text_paths[name], "rb") as file:
+            for _ in range(self._num_blocks):
+                yield np.load(file)
+
+    def load_label_columns(self, columns, text_columns):
+        """
+            Yield pairs of blocks of columns, and of text_columns as the text written in the file
+        """
+        names = [name for name in columns if name in self._block_paths]
+        readers = [self.read_column_blocks(name) for name in names]
+        readers += [self.read_text_blocks(name) for name in text_columns]
+        for values in zip(*readers):
+            yield dict(zip(names, values)), dict(zip(text_columns, values[len(names):]))
 
     def get_data_labels(self):
-        file_path = self.file_path
         column_info = self.column_info
-        columns = [
+        available_columns = {
             column
             for column, info in column_info.items()
             if info["has_data"] or column == "Cyc#"
-        ]
-        data_generator = self.load_data(file_path, columns)
+        }
 
         # Generate labels for some specific numeric columns
         numeric_columns = [
             column
             for column, info in column_info.items()
-            if column in {"Step", "ES"} and info["is_numeric"]
+            if column in LABELLED_NUMERIC_COLUMNS and info["is_numeric"] and column in available_columns
         ]
 
         non_numeric_columns = [
@@ -219,110 +294,62 @@ class MaccorInputFile(InputFile):
             if info["has_data"] and not info["is_numeric"] and column != "DPt Time"
         ]
 
-        # note ranges returned are inclusive lower bound, exclusive upper bound
-        cyc_no = None
-        cyc_no_start = None
-        cyc_amps = 0
-        numeric_value = {column: None for column in numeric_columns}
-        numeric_start = {column: 0 for column in numeric_columns}
-        numeric_value_counts = {column: {} for column in numeric_columns}
-        non_numeric_value = {column: None for column in non_numeric_columns}
-        non_numeric_start = {column: 0 for column in non_numeric_columns}
-        non_numeric_value_counts = {column: {} for column in non_numeric_columns}
-        for row_idx, row in enumerate(data_generator, 1):
-            rec_no = int(row.get("Rec#", row_idx))
-
-            # Generate ranges for cycles
-            if "Cyc#" in row:
-                row_cyc = int(row["Cyc#"])
-                if cyc_no is None:
-                    cyc_no = row_cyc
-                    cyc_no_start = rec_no
-                elif cyc_no < row_cyc:
-                    # on a new cycle
-                    yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no = row_cyc
-                    cyc_no_start = rec_no
-            elif "Amps" in row:
-                # This file doesn't have cycles recorded, try and detect them from
-                # amps
-                amps = float(row["Amps"])
-                cyc_begin = cyc_amps <= 0 and amps > 0.0
-                cyc_mid = cyc_amps > 0 and amps < 0.0
-                cyc_end = cyc_amps < 0 and amps >= 0.0
-                # a <=0 to positive amps edge
-                if cyc_begin:
-                    cyc_amps = 1
-                    if cyc_no_start is not None:
-                        yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no_start = rec_no
-                    cyc_no = 0 if cyc_no is None else cyc_no + 1
-                # a <0 to 0 change
-                elif cyc_end:  # cycle ended at zero amps, not start of a new cycle
-                    yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-                    cyc_no_start = None
-                    cyc_amps = 0
-                elif cyc_mid:
-                    # positive to 0 or negative
-                    cyc_amps = -1
+        # Cycles are found from the values of a column,
+        # and runs of values are labelled with the values as they are written
+        labellers = []
+        if "Cyc#" in available_columns:
+            labellers.append(("Cyc#", False, lambda blocks: iter_cycle_labels(
+                (values.astype(np.int64), rec_nos) for values, rec_nos in blocks
+            )))
+        elif "Amps" in available_columns:
+            # This file doesn't have cycles recorded, try and detect them from
+            # amps
+            labellers.append(("Amps", False, lambda blocks: iter_amps_cycle_labels(
+                (values.astype(np.float64), rec_nos) for values, rec_nos in blocks
+            )))
+        text_columns = numeric_columns + non_numeric_columns
+        for column in text_columns:
+            labellers.append((column, True, lambda blocks, column=column: iter_value_labels(column, blocks)))
+        if not labellers:
+            return
 
-            # Handle ranges for specific numeric data
-            for column in numeric_columns:
-                prev_val = numeric_value[column]
-                col_val = row[column]
-                # handle first iteration
-                if prev_val is None:
-                    numeric_value[column] = col_val
-                    numeric_start[column] = rec_no
-                elif prev_val != col_val:
-                    # value has changed, end range
-                    count = numeric_value_counts[column].get(prev_val, -1) + 1
-                    numeric_value_counts[column][prev_val] = count
-                    yield f"{column}_{prev_val}_{count}", (
-                        numeric_start[column],
-                        rec_no + 1,
-                    )
-                    numeric_value[column] = col_val
-                    numeric_start[column] = rec_no
-
-            # Handle ranges for non-numeric data
-            for column in non_numeric_columns:
-                prev_val = non_numeric_value[column]
-                col_val = row[column]
-                # handle first iteration
-                if prev_val is None:
-                    non_numeric_value[column] = col_val
-                    non_numeric_start[column] = rec_no
-                elif prev_val != col_val:
-                    # value has changed, end range
-                    count = non_numeric_value_counts[column].get(prev_val, -1) + 1
-                    non_numeric_value_counts[column][prev_val] = count
-                    yield f"{column}_{prev_val}_{count}", (
-                        non_numeric_start[column],
-                        rec_no + 1,
-                    )
-                    non_numeric_value[column] = col_val
-                    non_numeric_start[column] = rec_no
-
-        # return any partial ranges
-        if cyc_no_start is not None:
-            yield "cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1)
-        for column in numeric_columns:
-            prev_val = numeric_value[column]
-            if numeric_start[column] is not None:
-                count = numeric_value_counts[column].get(prev_val, -1) + 1
-                yield f"{column}_{prev_val}_{count}", (
-                    numeric_start[column],
-                    rec_no + 1,
-                )
-        for column in non_numeric_columns:
-            prev_val = non_numeric_value[column]
-            if non_numeric_start[column] is not None:
-                count = non_numeric_value_counts[column].get(prev_val, -1) + 1
-                yield f"{column}_{prev_val}_{count}", (
-                    non_numeric_start[column],
-                    rec_no + 1,
-                )
+        def read_blocks():
+            """
+                Yield blocks of the labelled columns, with their record numbers
+            """
+            rows = 0
+            columns = [column for column, is_text, _ in labellers if not is_text]
+            for block, text_block in self.load_label_columns([*columns, "Rec#"], text_columns):
+                block_rows = len(next(iter([*block.values(), *text_block.values()])))
+                if "Rec#" in block:
+                    rec_nos = block["Rec#"].astype(np.int64)
+                else:
+                    rec_nos = np.arange(rows + 1, rows + block_rows + 1)
+                rows += block_rows
+                yield block, text_block, rec_nos
+
+        # Labels are found column by column, each with the row that ends its range
+        # so that they can be returned in the order the rows are read.
+        # The columns are read in step a block at a time, and each labeller
+        # yields the labels that end in each block, then the labels of any last runs.
+        # note ranges returned are inclusive lower bound, exclusive upper bound
+        def read_column(column: str, is_text: bool, blocks):
+            for block, text_block, rec_nos in blocks:
+                yield (text_block if is_text else block)[column], rec_nos
+
+        streams = itertools.tee(read_blocks(), len(labellers))
+        labels_by_column = [
+            labeller(read_column(column, is_text, stream))
+            for (column, is_text, labeller), stream in zip(labellers, streams)
+        ]
+        for block_labels in zip(*labels_by_column):
+            labels = [
+                (row_idx, order, label)
+                for order, column_labels in enumerate(block_labels)
+                for row_idx, label in column_labels
+            ]
+            for _, _, label in sorted(labels, key=lambda label: label[:2]):
+                yield label
 
     def is_maccor_text_file(self, file_path, delimiter):
         with open(file_path, "r") as f:
@@ -373,6 +400,26 @@ class MaccorExcelInputFile(MaccorInputFile):
         self.validate_file(file_path)
         super().__init__(file_path)
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        if file_path.endswith(".xls"):
+            # OLE2 compound document
+            return read_file_head(file_path, 8) == b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+        if file_path.endswith(".xlsx"):
+            # zip archive
+            return read_file_head(file_path, 4) == b"PK\x03\x04"
+        return False
+
+    # Excel cells are already typed, so gather them row by row
+    load_columns = InputFile.load_columns
+
+    def load_label_columns(self, columns, text_columns):
+        """
+            Yield pairs of blocks of columns and of text_columns, both with the values of the cells
+        """
+        for block in self.load_columns([*columns, *text_columns]):
+            yield block, block
+
     def identify_columns(self, wbook):
         """
             Identifies columns in a maccor excel file"
@@ -566,6 +613,11 @@ class MaccorRawInputFile(MaccorInputFile):
         super().__init__(file_path)
         self.delimiter = '\t'
 
+    @classmethod
+    def sniff(cls, file_path: str) -> bool:
+        line = read_file_head(file_path, 256).decode("ascii", errors="replace")
+        return re.match(r"Today's Date \d\d\/\d\d\/\d\d\d\d  Date of Test:\t", line) is not None
+
     def load_metadata(self):
         """
             Load metadata in a maccor raw file"
@@ -660,6 +712,200 @@ def isfloat(value):
         return False
 
 
+def get_cycle_labels(cyc_nos: np.ndarray, rec_nos: np.ndarray) -> list:
+    """
+        Return (row index, label) pairs for each cycle in a column of cycle numbers.
+    """
+    return [label for labels in iter_cycle_labels([(cyc_nos, rec_nos)]) for label in labels]
+
+
+def iter_cycle_labels(blocks):
+    """
+        Yield a list of the (row index, label) pairs of the cycles that end in each block
+        of (cycle numbers, record numbers), then a list with the label of the last cycle.
+
+        A cycle ends where the cycle number exceeds every number before it.
+    """
+    rows = 0
+    highest = None
+    cyc_no = None
+    cyc_no_start = None
+    last_rec_no = None
+    for cyc_nos, rec_nos in blocks:
+        labels = []
+        if len(cyc_nos):
+            if highest is None:
+                highest = cyc_nos[0]
+                cyc_no = int(cyc_nos[0])
+                cyc_no_start = int(rec_nos[0])
+            # The highest cycle number before each row
+            before = np.maximum.accumulate(np.concatenate(([highest], cyc_nos[:-1])))
+            for i in np.flatnonzero(cyc_nos > before):
+                rec_no = int(rec_nos[i])
+                labels.append((rows + i, ("cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1))))
+                cyc_no = int(cyc_nos[i])
+                cyc_no_start = rec_no
+            highest = max(highest, cyc_nos.max())
+            last_rec_no = int(rec_nos[-1])
+            rows += len(cyc_nos)
+        yield labels
+    if cyc_no is None:
+        yield []
+    else:
+        yield [(rows, ("cycle_{}".format(cyc_no), (cyc_no_start, last_rec_no + 1)))]
+
+
+def get_amps_cycle_labels(amps: np.ndarray, rec_nos: np.ndarray) -> list:
+    """
+        Return (row index, label) pairs for cycles detected from changes in the sign of the current.
+    """
+    return [label for labels in iter_amps_cycle_labels([(amps, rec_nos)]) for label in labels]
+
+
+def iter_amps_cycle_labels(blocks):
+    """
+        Yield a list of the (row index, label) pairs of the cycles that end in each block
+        of (amps, record numbers), then a list with the label of any partial cycle.
+
+        A cycle begins on a <=0 to positive amps edge, and ends on the next
+        negative to zero edge or at the beginning of the next cycle.
+    """
+    rows = 0
+    cyc_no = None
+    cyc_no_start = None
+    cyc_amps = 0
+    last_sign = None
+    last_rec_no = None
+    for amps, rec_nos in blocks:
+        labels = []
+        if len(amps):
+            # Cycles can only begin or end on the first row with a new sign
+            sign = np.sign(amps)
+            first_changed = last_sign is None or sign[0] != last_sign
+            for i in np.flatnonzero(np.concatenate(([first_changed], sign[1:] != sign[:-1]))):
+                amp = amps[i]
+                rec_no = int(rec_nos[i])
+                cyc_begin = cyc_amps <= 0 and amp > 0.0
+                cyc_mid = cyc_amps > 0 and amp < 0.0
+                cyc_end = cyc_amps < 0 and amp >= 0.0
+                # a <=0 to positive amps edge
+                if cyc_begin:
+                    cyc_amps = 1
+                    if cyc_no_start is not None:
+                        labels.append((rows + i, ("cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1))))
+                    cyc_no_start = rec_no
+                    cyc_no = 0 if cyc_no is None else cyc_no + 1
+                # a <0 to 0 change
+                elif cyc_end:  # cycle ended at zero amps, not start of a new cycle
+                    labels.append((rows + i, ("cycle_{}".format(cyc_no), (cyc_no_start, rec_no + 1))))
+                    cyc_no_start = None
+                    cyc_amps = 0
+                elif cyc_mid:
+                    # positive to 0 or negative
+                    cyc_amps = -1
+            last_sign = sign[-1]
+            last_rec_no = int(rec_nos[-1])
+            rows += len(amps)
+        yield labels
+    # return any partial cycle
+    if cyc_no_start is None:
+        yield []
+    else:
+        yield [(rows, ("cycle_{}".format(cyc_no), (cyc_no_start, last_rec_no + 1)))]
+
+
+def get_value_labels(column: str, values: np.ndarray, rec_nos: np.ndarray) -> list:
+    """
+        Return (row index, label) pairs for each run of a value in a column.
+    """
+    return [label for labels in iter_value_labels(column, [(values, rec_nos)]) for label in labels]
+
+
+def iter_value_labels(column: str, blocks):
+    """
+        Yield a list of the (row index, label) pairs of the runs of a value that end in each block
+        of (values, record numbers), then a list with the label of the last run.
+
+        Labels are named after the column, the value and how many times the value has occurred before.
+        Runs end on the first row of the next run, or on the last row.
+    """
+    rows = 0
+    value = None
+    start_rec_no = None
+    last_rec_no = None
+    value_counts = {}
+
+    def run_label(row_idx: int, rec_no: int):
+        count = value_counts.get(value, -1) + 1
+        value_counts[value] = count
+        return row_idx, (f"{column}_{value}_{count}", (start_rec_no, rec_no + 1))
+
+    for values, rec_nos in blocks:
+        labels = []
+        if len(values):
+            if start_rec_no is None:
+                value = values[0].item()
+                start_rec_no = int(rec_nos[0])
+                first_changed = False
+            else:
+                first_changed = values[0] != value
+            for i in np.flatnonzero(np.concatenate(([first_changed], values[1:] != values[:-1]))):
+                rec_no = int(rec_nos[i])
+                labels.append(run_label(rows + i, rec_no))
+                value = values[i].item()
+                start_rec_no = rec_no
+            last_rec_no = int(rec_nos[-1])
+            rows += len(values)
+        yield labels
+    if start_rec_no is None:
+        yield []
+    else:
+        yield [run_label(rows, last_rec_no)]
+
+
+def resize_blocks(blocks, block_size: int):
+    """
+        Yield the rows of blocks of columns again, in blocks of block_size rows
+    """
+    pending = []
+    rows = 0
+    for block in blocks:
+        pending.append(block)
+        rows += len(next(iter(block.values()), []))
+        while rows >= block_size:
+            values = {name: np.concatenate([b[name] for b in pending]) for name in block.keys()}
+            yield {name: v[:block_size] for name, v in values.items()}
+            pending = [{name: v[block_size:] for name, v in values.items()}]
+            rows -= block_size
+    if rows:
+        yield {name: np.concatenate([b[name] for b in pending]) for name in pending[0].keys()}
+
+
+def read_column_blocks(reader, headers: list, block_size: int):
+    """
+        Read the rows of a maccor csv or tsv file in blocks,
+        yielding dicts of column name to list of string values
+    """
+    correct_number_of_columns = len(headers)
+    try:
+        recno_col = headers.index("Rec#")
+    except ValueError:
+        recno_col = -1
+    row_idx = 0
+    while True:
+        rows = list(islice(reader, block_size))
+        if not rows:
+            return
+        for i, row in enumerate(rows):
+            if len(row) > correct_number_of_columns:
+                rows[i] = handle_recno(row, correct_number_of_columns, recno_col, row_idx + i)
+        row_idx += len(rows)
+        block = {header: [row[i] for row in rows] for i, header in enumerate(headers)}
+        if recno_col >= 0:
+            block["Rec#"] = [value.replace(",", "") for value in block["Rec#"]]
+        yield block
+
+
 def handle_recno(row, correct_number_of_columns, recno_col, row_idx):
     if len(row) > correct_number_of_columns:
         if recno_col >= 0:
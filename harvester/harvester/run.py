@@ -5,11 +5,12 @@
 import os.path
 import re
 import time
+from concurrent.futures import ProcessPoolExecutor, wait, ALL_COMPLETED, FIRST_COMPLETED
 
-from .parse.exceptions import UnsupportedFileTypeError
-from .settings import get_logger, get_setting
+from .settings import get_logger, get_setting, get_env_setting
 from .api import report_harvest_result, update_config
-from .harvest import import_file, get_import_file_handler
+from .harvest import import_file, get_input_file_classes
+from .cache import FileCache
 
 logger = get_logger(__file__)
 
@@ -32,13 +33,105 @@ def harvest():
 
     logger.debug(paths)
 
-    for path in paths:
-        if path.get('active'):
-            harvest_path(path)
+    cache = FileCache()
+    pool = ImportPool(cache)
+    try:
+        for path in paths:
+            if path.get('active'):
+                harvest_path(path, cache, pool)
+            else:
+                logger.info(f"Skipping inactive path {path.get('path')} {path.get('regex')}")
+    finally:
+        pool.close()
+        cache.close()
+
+
+class ImportPool:
+    """
+    Imports files in worker processes, so that one large file does not hold up the others.
+
+    At most HARVESTER_MAX_IMPORTS files are imported at once, and at most
+    HARVESTER_MAX_IMPORTS_PER_PATH from any one monitored path.
+    With a single worker, each file is imported in this process as soon as it is submitted.
+    """
+
+    def __init__(self, cache: FileCache):
+        self.cache = cache
+        self.max_workers = max(1, get_env_setting('HARVESTER_MAX_IMPORTS', 1))
+        self.max_per_path = max(1, get_env_setting('HARVESTER_MAX_IMPORTS_PER_PATH', self.max_workers))
+        self.executor = ProcessPoolExecutor(self.max_workers) if self.max_workers > 1 else None
+        # future => (full_path, file_path, monitored_path)
+        self.running = {}
+
+    def submit(self, full_path: str, file_path: str, monitored_path: dict):
+        logger.info(f"Parsing file {file_path}")
+        if self.executor is None:
+            self.finish(full_path, file_path, monitored_path, import_file(full_path, monitored_path))
+            return
+        while len(self.running) >= self.max_workers or self.count_running(monitored_path) >= self.max_per_path:
+            self.wait(FIRST_COMPLETED)
+        future = self.executor.submit(import_file, full_path, monitored_path)
+        self.running[future] = (full_path, file_path, monitored_path)
+
+    def count_running(self, monitored_path: dict) -> int:
+        return len([m for _, _, m in self.running.values() if m.get('id') == monitored_path.get('id')])
+
+    def wait(self, return_when=ALL_COMPLETED):
+        """
+        Wait for running imports to finish, and report their results
+        """
+        done, _ = wait(list(self.running.keys()), return_when=return_when)
+        for future in done:
+            full_path, file_path, monitored_path = self.running.pop(future)
+            try:
+                succeeded = future.result()
+            except BaseException as e:
+                logger.error(e)
+                report_harvest_result(
+                    path=full_path,
+                    monitored_path_id=monitored_path.get('id'),
+                    error=e
+                )
+                continue
+            self.finish(full_path, file_path, monitored_path, succeeded)
+
+    def finish(self, full_path: str, file_path: str, monitored_path: dict, succeeded: bool):
+        if succeeded:
+            report_harvest_result(
+                path=full_path,
+                monitored_path_id=monitored_path.get('id'),
+                content={'task': 'import', 'status': 'complete'}
+            )
+            self.cache.set_state(full_path, 'IMPORTED')
+            logger.info(f"Successfully parsed file {file_path}")
         else:
-            logger.info(f"Skipping inactive path {path.get('path')} {path.get('regex')}")
+            logger.warn(f"FAILED parsing file {file_path}")
+            report_harvest_result(
+                path=full_path,
+                monitored_path_id=monitored_path.get('id'),
+                content={'task': 'import', 'status': 'failed'}
+            )
+            self.cache.set_state(full_path, 'IMPORT FAILED')
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
 
-def harvest_path(monitored_path: dict):
+def harvest_path(monitored_path: dict, cache: FileCache = None, pool: ImportPool = None):
+    if cache is None:
+        cache = FileCache()
+    if pool is None:
+        pool = ImportPool(cache)
+        try:
+            return harvest_path(monitored_path, cache, pool)
+        finally:
+            pool.close()
+    # Imported and failed files are reported again after this long, in case a reimport was requested
+    recheck_seconds = get_env_setting('HARVESTER_CACHE_RECHECK_SECONDS', 3600)
     path = monitored_path.get('path')
     regex_str = monitored_path.get('regex')
     if regex_str is not None:
@@ -55,10 +148,29 @@ def harvest_path(monitored_path: dict):
                     logger.debug(f"Skipping {file_path} as it does not match regex {regex}")
                     continue
                 try:
-                    get_import_file_handler(full_path)
-                except UnsupportedFileTypeError:
+                    stat = os.stat(full_path)
+                except OSError as e:
+                    logger.debug(f"Skipping {file_path} as it cannot be read: {e}")
+                    continue
+                cached = cache.get(full_path, stat)
+                if cached is None:
+                    # Only check the file's signature here: it is parsed if it is due for import
+                    try:
+                        input_file_classes = get_input_file_classes(full_path)
+                    except OSError as e:
+                        # Not cached, so that the file is checked again next cycle
+                        logger.debug(f"Skipping {file_path} as it cannot be read: {e}")
+                        continue
+                    file_format = input_file_classes[0].__name__ if input_file_classes else None
+                    cache.set(full_path, stat, file_format)
+                    cached = {'format': file_format, 'state': None}
+                if cached['format'] is None:
                     logger.debug(f"Skipping unsupported file {file_path}")
                     continue
+                if cached['state'] in ['IMPORTED', 'IMPORT FAILED'] and \
+                        time.time() - cached['checked'] < recheck_seconds:
+                    logger.debug(f"Skipping unchanged file {file_path} with status '{cached['state']}'")
+                    continue
                 try:
                     logger.info(f"Reporting stats for {file_path}")
                     result = report_harvest_result(
@@ -66,29 +178,16 @@ def harvest_path(monitored_path: dict):
                         monitored_path_id=monitored_path.get('id'),
                         content={
                             'task': 'file_size',
-                            'size': os.stat(full_path).st_size
+                            'size': stat.st_size
                         }
                     )
                     if result is not None:
                         result = result.json()
                         status = result['state']
                         logger.info(f"Server assigned status '{status}'")
+                        cache.set_state(full_path, status)
                         if status in ['STABLE', 'RETRY IMPORT']:
-                            logger.info(f"Parsing file {file_path}")
-                            if import_file(full_path, monitored_path):
-                                report_harvest_result(
-                                    path=full_path,
-                                    monitored_path_id=monitored_path.get('id'),
-                                    content={'task': 'import', 'status': 'complete'}
-                                )
-                                logger.info(f"Successfully parsed file {file_path}")
-                            else:
-                                logger.warn(f"FAILED parsing file {file_path}")
-                                report_harvest_result(
-                                    path=full_path,
-                                    monitored_path_id=monitored_path.get('id'),
-                                    content={'task': 'import', 'status': 'failed'}
-                                )
+                            pool.submit(full_path, file_path, monitored_path)
                 except BaseException as e:
                     logger.error(e)
                     report_harvest_result(
@@ -96,6 +195,7 @@ def harvest_path(monitored_path: dict):
                         monitored_path_id=monitored_path.get('id'),
                         error=e
                     )
+            cache.commit()
         logger.info(f"Completed directory walking of {path}")
     except BaseException as e:
         logger.error(e)
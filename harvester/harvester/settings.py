@@ -39,18 +39,74 @@ def get_settings_file() -> pathlib.Path:
     return pathlib.Path(os.getenv('SETTINGS_FILE', "/harvester_files/.harvester.json"))
 
 
-def get_settings():
+def get_cache_file() -> pathlib.Path:
+    return pathlib.Path(os.getenv('CACHE_FILE', get_settings_file().parent / ".harvester_cache.sqlite3"))
+
+
+def get_env_setting(key: str, default: float) -> float:
+    """
+    Return a numeric setting from an environment variable, which may be pushed from the server
+    """
+    value = os.getenv(key)
+    if value is None:
+        return default
     try:
-        with open(get_settings_file(), 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError as e:
-                logger.error(f"Error decoding json file {f.name}", e)
-                f.seek(0)
-                logger.error(f.readlines())
-    except FileNotFoundError:
-        logger.error(f'No config file at {get_settings_file()}')
-    return None
+        return type(default)(value)
+    except ValueError:
+        logger.error(f"Ignoring invalid value '{value}' for envvar {key}")
+        return default
+
+
+class SettingsStore:
+    """
+    The contents of the settings file, read once and kept in memory.
+
+    The file is read again when its modification time or size changes,
+    or after invalidate is called.
+    """
+
+    def __init__(self):
+        self.settings = None
+        self.file_state = None
+
+    def invalidate(self):
+        self.settings = None
+        self.file_state = None
+
+    def get(self):
+        settings_file = get_settings_file()
+        try:
+            stat = os.stat(settings_file)
+        except FileNotFoundError:
+            logger.error(f'No config file at {settings_file}')
+            self.invalidate()
+            return None
+        file_state = (str(settings_file), stat.st_mtime_ns, stat.st_size)
+        if self.settings is None or file_state != self.file_state:
+            self.settings = self.load(settings_file)
+            self.file_state = file_state if self.settings is not None else None
+        return self.settings
+
+    @staticmethod
+    def load(settings_file: pathlib.Path):
+        try:
+            with open(settings_file, 'r') as f:
+                try:
+                    return json.load(f)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Error decoding json file {f.name}: {e}")
+                    f.seek(0)
+                    logger.error(f.readlines())
+        except FileNotFoundError:
+            logger.error(f'No config file at {settings_file}')
+        return None
+
+
+settings_store = SettingsStore()
+
+
+def get_settings():
+    return settings_store.get()
 
 
 def get_setting(*args):
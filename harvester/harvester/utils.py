@@ -8,8 +8,22 @@ class NpEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.integer):
             return int(obj)
+        # JSON has no NaN or infinity, so missing values are sent as null
         if isinstance(obj, np.floating):
-            return float(obj)
+            return float(obj) if np.isfinite(obj) else None
         if isinstance(obj, np.ndarray):
+            if obj.dtype.kind == 'f' and not np.isfinite(obj).all():
+                return np.where(np.isfinite(obj), obj, None).tolist()
             return obj.tolist()
         return super(NpEncoder, self).default(obj)
+
+
+def get_data_type(values: np.ndarray) -> str:
+    """
+    Return the name of the server-side storage type for an array of values
+    """
+    if values.dtype.kind in 'iub':
+        return 'int'
+    if values.dtype.kind == 'f':
+        return 'float'
+    return 'str'
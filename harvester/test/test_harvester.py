@@ -3,13 +3,32 @@
 # of Oxford, and the 'Galv' Developers. All rights reserved.
 
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
 import os
+import threading
+import time
+import json
+import gzip
+import struct
+import tempfile
 from pathlib import Path
+import numpy as np
 
-from harvester.harvester.parse.input_file import InputFile
+from harvester.harvester.parse.input_file import InputFile, parse_column
+from harvester.harvester.parse.maccor_input_file import (
+    MaccorInputFile,
+    get_amps_cycle_labels,
+    get_cycle_labels,
+    get_value_labels,
+)
 import harvester.harvester.run
+from harvester.harvester.cache import FileCache
+from harvester.harvester.api import HarvesterRetry
+from harvester.harvester.utils import NpEncoder
+from harvester.harvester.encoding import encode_report, compress, get_upload_content_encoding, MAGIC
 import harvester.harvester.harvest
+import harvester.harvester.settings
 
 def get_test_file_path():
     return os.getenv('TEST_DIR', "/usr/test_data")
@@ -158,7 +177,7 @@ def fail(e, *kwargs):
 
 
 class TestHarvester(unittest.TestCase):
-    @patch('requests.get')
+    @patch('requests.Session.request')
     @patch('harvester.harvester.api.logger')
     @patch('harvester.harvester.run.logger')
     @patch('harvester.harvester.api.get_settings_file')
@@ -246,6 +265,298 @@ class TestHarvester(unittest.TestCase):
             if not 'values' in row:
                 raise AssertionError(f"'data' contains no 'values' field")
 
+    @patch('harvester.harvester.harvest.binary_upload_accepted')
+    @patch('harvester.harvester.harvest.report_harvest_result')
+    @patch('harvester.harvester.harvest.logger')
+    @patch('harvester.harvester.settings.get_settings')
+    def test_upload_failure(self, mock_settings, mock_logger, mock_report, mock_binary):
+        mock_settings.return_value = {**ConfigResponse().json(), 'max_upload_bytes': 1000}
+        mock_binary.return_value = False
+        error = ConnectionError('Upload failed')
+
+        def report(**kwargs):
+            content = kwargs.get('content', {})
+            if content.get('status') == 'begin':
+                return JSONResponse(200, {'upload_info': {'last_record_number': 0}})
+            if content.get('status') == 'in_progress':
+                raise error
+            return JSONResponse()
+
+        mock_report.side_effect = report
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.csv')
+            with open(path, 'w') as f:
+                f.write("Today''s Date,04/01/2021 1:00:00 PM\nDate of Test:,03/01/2021 1:00:00 PM\n")
+                f.write("Rec#,Cyc#,Step,TestTime,Amps,Volts\n")
+                for i in range(2000):
+                    f.write(f"{i + 1},{i // 100},{i // 50},{i / 2},{i % 7 - 3},3.{i}\n")
+            with patch.object(MaccorInputFile, 'get_data_labels') as mock_labels:
+                self.assertFalse(harvester.harvester.harvest.import_file(path, {'id': 1}))
+            # Reading stopped before the end of the file
+            mock_labels.assert_not_called()
+        uploads = [c for c in mock_report.call_args_list if c.kwargs.get('content', {}).get('status') == 'in_progress']
+        self.assertEqual(len(uploads), 1)
+        mock_report.assert_called_with(path=path, monitored_path_id=1, error=error)
+
+    def test_load_columns(self):
+        class RowInputFile(InputFile):
+            def load_metadata(self):
+                return {}, {}
+
+            def load_data(self, file_path, columns):
+                for i in range(5):
+                    yield {'a': i, 'b': i / 2, 'c': str(i)}
+
+        input_file = RowInputFile(file_path='rows', standard_columns={}, standard_units={})
+        blocks = list(input_file.load_columns(['a', 'b', 'c'], block_size=2))
+        self.assertEqual([len(b['a']) for b in blocks], [2, 2, 1])
+        self.assertEqual([blocks[0][k].dtype.kind for k in 'abc'], ['i', 'f', 'U'])
+        self.assertEqual(blocks[2]['b'][0], 2.0)
+
+    def test_parse_column(self):
+        self.assertEqual(parse_column(['1', '-2', '3']).dtype.kind, 'i')
+        self.assertEqual(parse_column(['1', '2.5', '1e3']).dtype.kind, 'f')
+        self.assertEqual(parse_column(['1', '2', '3'], 'float').dtype.kind, 'f')
+        self.assertEqual(parse_column(['1', '', 'C']).dtype.kind, 'U')
+        self.assertTrue(np.isnan(parse_column(['1', ' ', '3'])[1]))
+        self.assertEqual(parse_column(['1.5', 'x'], 'float').tolist(), ['1.5', 'x'])
+
+    def test_maccor_labels(self):
+        rec_nos = np.arange(1, 7)
+        self.assertEqual(
+            [label for _, label in get_cycle_labels(np.array([0, 0, 1, 0, 2, 2]), rec_nos)],
+            [('cycle_0', (1, 4)), ('cycle_1', (3, 6)), ('cycle_2', (5, 7))]
+        )
+        self.assertEqual(
+            [label for _, label in get_amps_cycle_labels(np.array([0., 1., -1., 0., 2., 2.]), rec_nos)],
+            [('cycle_0', (2, 5)), ('cycle_1', (5, 7))]
+        )
+        self.assertEqual(
+            get_value_labels('Step', np.array([1, 1, 2, 1, 1, 1]), rec_nos),
+            [(2, ('Step_1_0', (1, 4))), (3, ('Step_2_0', (3, 5))), (6, ('Step_1_1', (4, 7)))]
+        )
+
+    def test_maccor_blocks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.csv')
+            with open(path, 'w') as f:
+                f.write("Today''s Date,04/01/2021 1:00:00 PM\nDate of Test:,03/01/2021 1:00:00 PM\n")
+                f.write("Rec#,Cyc#,Step,TestTime,Amps,Volts,State,Zero\n")
+                for i, (cyc, step, amps, state) in enumerate(zip(
+                        [0, 0, 1, 0, 2, 2, 2], [1, 1, 2, 1, 1, 3, 3], [0, 1, -1, 0, 2, 2, 1.5], 'RRCCDDR'
+                )):
+                    f.write(f"{i + 1},{cyc},{step},{i / 2},{amps},3.{i},{state},0\n")
+            whole = MaccorInputFile(path, standard_columns={}, standard_units={})
+            with patch.object(MaccorInputFile, 'block_size', 2):
+                blocks = MaccorInputFile(path, standard_columns={}, standard_units={})
+            self.assertFalse(blocks.column_info['Zero']['has_data'])
+            # Step and State are also kept as text, for labels
+            self.assertEqual(
+                sorted(os.listdir(blocks._block_dir)),
+                sorted([*[f"{i}.npy" for i in range(7)], "2.txt.npy", "6.txt.npy"])
+            )
+            self.assertEqual(list(blocks.get_data_labels()), list(whole.get_data_labels()))
+            self.assertEqual(list(blocks.load_data(path, ['Amps', 'Zero'])), list(whole.load_data(path, ['Amps'])))
+            self.assertEqual(
+                [len(b['Rec#']) for b in blocks.load_columns(['Rec#', 'Amps'], block_size=3)], [3, 3, 1]
+            )
+
+    def test_maccor_label_text(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.csv')
+            with open(path, 'w') as f:
+                f.write("Today''s Date,04/01/2021 1:00:00 PM\nDate of Test:,03/01/2021 1:00:00 PM\n")
+                f.write("Rec#,Step,TestTime,Amps,Volts\n")
+                for i, (step, volts) in enumerate(zip(['1', '1', '2.5', '1'], ['3.1', '', '3.3', '3.4'])):
+                    f.write(f"{i + 1},{step},{i / 2},0,{volts}\n")
+            input_file = MaccorInputFile(path, standard_columns={}, standard_units={})
+            # Labels name the values as written, though Step is read as floats
+            self.assertEqual(input_file.column_info['Step']['data_type'], 'float')
+            self.assertEqual(
+                list(input_file.get_data_labels()),
+                [('Step_1_0', (1, 4)), ('Step_2.5_0', (3, 5)), ('Step_1_1', (4, 5))]
+            )
+            # A blank cell is a missing value, which is sent as null
+            self.assertEqual(input_file.column_info['Volts']['data_type'], 'float')
+            volts = next(input_file.load_columns(['Volts']))['Volts']
+            self.assertEqual(json.dumps(volts, cls=NpEncoder), '[3.1, null, 3.3, 3.4]')
+
+    def test_get_input_file_classes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            maccor_path = os.path.join(tmp, 'test.csv')
+            with open(maccor_path, 'w') as f:
+                f.write("Today''s Date,04/01/2021 1:00:00 PM\nDate of Test:,03/01/2021 1:00:00 PM\n")
+            self.assertEqual(
+                harvester.harvester.harvest.get_input_file_classes(maccor_path),
+                [MaccorInputFile]
+            )
+            for name in ['test.txt', 'test.mpr', 'test.idf', 'test.xls']:
+                path = os.path.join(tmp, name)
+                Path(path).write_bytes(b'\x00' * 100)
+                self.assertEqual(harvester.harvester.harvest.get_input_file_classes(path), [])
+
+    @patch('harvester.harvester.run.report_harvest_result')
+    @patch('harvester.harvester.run.logger')
+    def test_unreadable_file_not_cached(self, mock_logger, mock_report):
+        mock_logger.error = fail
+        mock_report.return_value = JSONResponse(200, {'state': 'GROWING'})
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.csv')
+            with open(path, 'w') as f:
+                f.write("Today''s Date,04/01/2021 1:00:00 PM\nDate of Test:,03/01/2021 1:00:00 PM\n")
+            self.assertRaises(OSError, harvester.harvester.harvest.get_input_file_classes, path + '.missing')
+            cache = FileCache(os.path.join(tmp, 'cache.sqlite3'))
+            monitored_path = {'id': 1, 'path': tmp, 'regex': '.*\\.csv$'}
+            with patch.object(MaccorInputFile, 'sniff', side_effect=PermissionError('locked')):
+                harvester.harvester.run.harvest_path(monitored_path, cache)
+            self.assertIsNone(cache.get(path, os.stat(path)))
+            mock_report.assert_not_called()
+            harvester.harvester.run.harvest_path(monitored_path, cache)
+            self.assertEqual(cache.get(path, os.stat(path))['format'], 'MaccorInputFile')
+            self.assertEqual(mock_report.call_args.kwargs['content']['task'], 'file_size')
+            cache.close()
+
+    @patch('harvester.harvester.run.report_harvest_result')
+    @patch('harvester.harvester.run.import_file')
+    @patch('harvester.harvester.run.logger')
+    def test_import_pool_in_process(self, mock_logger, mock_import, mock_report):
+        mock_logger.error = fail
+        mock_import.return_value = True
+        cache = MagicMock()
+        with patch.dict(os.environ, {'HARVESTER_MAX_IMPORTS': '1'}):
+            pool = harvester.harvester.run.ImportPool(cache)
+        self.assertIsNone(pool.executor)
+        pool.submit('/data/a.csv', 'a.csv', {'id': 1})
+        # Imported before submit returns
+        mock_import.assert_called_once_with('/data/a.csv', {'id': 1})
+        cache.set_state.assert_called_once_with('/data/a.csv', 'IMPORTED')
+        self.assertEqual(mock_report.call_args.kwargs['content'], {'task': 'import', 'status': 'complete'})
+        pool.close()
+
+    @patch('harvester.harvester.run.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch('harvester.harvester.run.report_harvest_result')
+    @patch('harvester.harvester.run.logger')
+    def test_import_pool_limits(self, mock_logger, mock_report):
+        mock_logger.error = fail
+        lock = threading.Lock()
+        running = {}
+        most_running = {}
+        started = []
+        release = {}
+
+        def import_file(path, monitored_path):
+            with lock:
+                started.append(path)
+                running[monitored_path['id']] = running.get(monitored_path['id'], 0) + 1
+                most_running[monitored_path['id']] = max(
+                    most_running.get(monitored_path['id'], 0), running[monitored_path['id']]
+                )
+            release.setdefault(path, threading.Event()).wait(5)
+            time.sleep(0.01)
+            with lock:
+                running[monitored_path['id']] -= 1
+            return path != 'b1'
+
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(condition())
+
+        cache = MagicMock()
+        env = {'HARVESTER_MAX_IMPORTS': '2', 'HARVESTER_MAX_IMPORTS_PER_PATH': '1'}
+        with patch.dict(os.environ, env), patch('harvester.harvester.run.import_file', import_file):
+            pool = harvester.harvester.run.ImportPool(cache)
+            for path in ['a1', 'b1', 'a2', 'b2', 'a3']:
+                release[path] = threading.Event()
+            submitter = threading.Thread(target=lambda: [
+                pool.submit(path, path, {'id': path[0]}) for path in ['a1', 'b1', 'a2', 'b2', 'a3']
+            ])
+            submitter.start()
+            wait_for(lambda: len(started) == 2)
+            time.sleep(0.05)
+            # One import from each path, and a2 waits for a1 to free its slot
+            self.assertEqual(sorted(started), ['a1', 'b1'])
+            release['a1'].set()
+            wait_for(lambda: 'a2' in started)
+            self.assertNotIn('b2', started)
+            for event in release.values():
+                event.set()
+            submitter.join(5)
+            pool.close()
+        self.assertEqual(sorted(started), ['a1', 'a2', 'a3', 'b1', 'b2'])
+        self.assertEqual(most_running, {'a': 1, 'b': 1})
+        states = {c.args[0]: c.args[1] for c in cache.set_state.call_args_list}
+        self.assertEqual(states, {
+            'a1': 'IMPORTED', 'a2': 'IMPORTED', 'a3': 'IMPORTED', 'b1': 'IMPORT FAILED', 'b2': 'IMPORTED'
+        })
+
+    def test_file_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'test.csv')
+            Path(path).write_text('data')
+            stat = os.stat(path)
+            cache = FileCache(os.path.join(tmp, 'cache.sqlite3'))
+            self.assertIsNone(cache.get(path, stat))
+            cache.set(path, stat, 'MaccorInputFile')
+            cache.set_state(path, 'IMPORTED')
+            cache.close()
+            cache = FileCache(os.path.join(tmp, 'cache.sqlite3'))
+            self.assertEqual(cache.get(path, stat)['state'], 'IMPORTED')
+            Path(path).write_text('more data')
+            self.assertIsNone(cache.get(path, os.stat(path)))
+            cache.close()
+
+    @patch('harvester.harvester.settings.get_settings_file')
+    def test_settings_store(self, mock_settings_file):
+        with tempfile.TemporaryDirectory() as tmp:
+            settings_file = os.path.join(tmp, '.harvester.json')
+            mock_settings_file.return_value = settings_file
+            with open(settings_file, 'w') as f:
+                json.dump({'url': 'http://a/'}, f)
+            store = harvester.harvester.settings.SettingsStore()
+            self.assertEqual(store.get()['url'], 'http://a/')
+            with patch('harvester.harvester.settings.SettingsStore.load') as mock_load:
+                store.get()
+                mock_load.assert_not_called()
+            with open(settings_file, 'w') as f:
+                json.dump({'url': 'http://bb/'}, f)
+            self.assertEqual(store.get()['url'], 'http://bb/')
+
+    def test_retry_policy(self):
+        retry = HarvesterRetry(total=3, status_forcelist=[500, 502, 503, 504])
+        self.assertTrue(retry.is_retry('GET', 500))
+        self.assertTrue(retry.is_retry('POST', 503))
+        # The server may have processed the upload, so it must not be sent again
+        self.assertFalse(retry.is_retry('POST', 500))
+        self.assertFalse(retry.is_retry('POST', 504))
+
+    def test_encode_report(self):
+        values = np.array([1.5, 2.5], dtype=np.float64)
+        body = encode_report({'content': {'data': [
+            {'column_id': 1, 'values': values},
+            {'column_id': 2, 'values': np.array(['a', 'b'])},
+        ]}})
+        self.assertTrue(body.startswith(MAGIC))
+        header_length, = struct.unpack_from('<I', body, len(MAGIC))
+        header_end = len(MAGIC) + 4 + header_length
+        header = json.loads(body[len(MAGIC) + 4:header_end])
+        self.assertEqual(header['content']['data'][0], {'column_id': 1, 'values_dtype': '<f8', 'values_length': 2})
+        self.assertEqual(header['content']['data'][1], {'column_id': 2, 'values': ['a', 'b']})
+        self.assertEqual(body[header_end:], values.astype('<f8').tobytes())
+
+    @patch('harvester.harvester.encoding.get_setting')
+    def test_upload_content_encoding(self, mock_get_setting):
+        mock_get_setting.return_value = None
+        self.assertIsNone(get_upload_content_encoding())
+        mock_get_setting.return_value = ['gzip']
+        self.assertEqual(get_upload_content_encoding(), 'gzip')
+        mock_get_setting.return_value = ['gzip', 'zstd']
+        self.assertEqual(get_upload_content_encoding(), 'zstd')
+        body = b'0123456789' * 100
+        self.assertEqual(gzip.decompress(compress(body, 'gzip')), body)
+        self.assertLess(len(compress(body, 'zstd')), len(body))
+
     def test_import_mpr(self):
         self.import_file('adam_3_C05.mpr')
 